@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_autodetect.py - measure device detection cost vs. USB bus population
+
+Runs the real pyusb `usb.core.find()` against a fake backend populated with a
+configurable number of unrelated devices plus a few Notepads, and compares the
+old one-scan-per-device-class detection against `notepad.detectAll()`.
+
+Usage:
+   benchmarks/bench_autodetect.py [--sizes 8,32,128] [--repeat 20] [--output FILE]
+"""
+
+import argparse
+import tempfile
+import time
+from types import SimpleNamespace
+
+import harness
+import usb.backend
+
+from soundcraft import notepad, transport
+
+
+def busywait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class FakeBackend(usb.backend.IBackend):
+    """Enough of a pyusb backend for find() to enumerate and filter devices"""
+
+    def __init__(self, descriptors, descriptorCost):
+        super().__init__()
+        self.descriptors = descriptors
+        self.descriptorCost = descriptorCost
+        self.reads = 0
+
+    def enumerate_devices(self):
+        return iter(range(len(self.descriptors)))
+
+    def get_device_descriptor(self, dev):
+        self.reads += 1
+        busywait(self.descriptorCost)
+        return self.descriptors[dev]
+
+
+def descriptor(idVendor, idProduct, address):
+    return SimpleNamespace(
+        bLength=18,
+        bDescriptorType=1,
+        bcdUSB=0x0200,
+        bDeviceClass=0,
+        bDeviceSubClass=0,
+        bDeviceProtocol=0,
+        bMaxPacketSize0=64,
+        idVendor=idVendor,
+        idProduct=idProduct,
+        bcdDevice=0x0100,
+        iManufacturer=0,
+        iProduct=0,
+        iSerialNumber=0,
+        bNumConfigurations=1,
+        address=address,
+        bus=1,
+        port_number=address,
+        port_numbers=(address,),
+        speed=3,
+    )
+
+
+def populate(size, notepads):
+    descriptors = [descriptor(0x1234, 0x0001, i + 1) for i in range(size)]
+    # Spread the mixers across the bus, like a real hub tree would
+    for (i, idProduct) in enumerate(notepads):
+        pos = (i + 1) * size // (len(notepads) + 1)
+        descriptors.insert(pos, descriptor(notepad.HARMAN_USB, idProduct, 200 + i))
+    return descriptors
+
+
+def legacyAutodetect(stateDir):
+    """The pre-registry algorithm: one bus scan per supported device class"""
+    for devClass in (notepad.Notepad_12fx, notepad.Notepad_8fx, notepad.Notepad_5):
+        dev = devClass(stateDir=stateDir)
+        if dev.found():
+            return [dev]
+    return []
+
+
+def measure(func, backend, stateDir, repeat):
+    # The fake backend is plugged in underneath pyusb
+    transport.setDefault(transport.UsbTransport(backend=backend))
+    try:
+        found = func(stateDir)
+        backend.reads = 0
+        samples = harness.sample(lambda: func(stateDir), repeat, warmup=0)
+    finally:
+        transport.setDefault(None)
+    return (samples, backend.reads // repeat, len(found))
+
+
+def collect(
+    report, sizes=(0, 8, 32, 128, 512), repeat=20, descriptorCost=20e-6, notepads=None
+):
+    if notepads is None:
+        notepads = (0x0030, 0x0031)
+    with tempfile.TemporaryDirectory() as stateDir:
+        for size in sizes:
+            descriptors = populate(size, notepads)
+            for (label, func) in (
+                ("legacy", legacyAutodetect),
+                ("detectAll", lambda d: notepad.detectAll(stateDir=d)),
+            ):
+                backend = FakeBackend(descriptors, descriptorCost)
+                (samples, reads, found) = measure(func, backend, stateDir, repeat)
+                report.add(
+                    f"autodetect.{label}.bus{len(descriptors)}",
+                    samples,
+                    descriptor_reads=reads,
+                    found=found,
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        default="0,8,32,128,512",
+        help="Comma-separated list of unrelated USB device counts to test",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--descriptor-cost-us",
+        type=float,
+        default=20.0,
+        help="Simulated cost of reading one device descriptor, in microseconds",
+    )
+    parser.add_argument(
+        "--notepads",
+        default="0x0030,0x0031",
+        help="Comma-separated idProducts of the Notepads on the simulated bus",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(
+        report,
+        sizes=[int(x) for x in args.sizes.split(",")],
+        repeat=args.repeat,
+        descriptorCost=args.descriptor_cost_us / 1e6,
+        notepads=[int(x, 0) for x in args.notepads.split(",") if x],
+    )
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_control.py - compare the Unix control socket with D-Bus
+
+Starts a private dbus-daemon and a soundcraft_dbus_service with a control
+socket, driving a simulated Notepad, and times the same requests both ways:
+
+    control.dbus.get         reading routingSource through a Client proxy
+    control.dbus.set         setting routingSource through a Client proxy
+    control.socket.get       'get N' on the control socket
+    control.socket.set       'set N SOURCE' on the control socket
+    control.socket.pipelined a batch of --batch set requests written at once,
+                             per request
+
+Needs PyGObject and dbus-daemon; the results are marked as skipped otherwise.
+
+Usage:
+   benchmarks/bench_control.py [--repeat 500] [--batch 50] [--output FILE]
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import bench_dbus
+import harness
+
+BENCHMARKS = (
+    "control.dbus.get",
+    "control.dbus.set",
+    "control.socket.get",
+    "control.socket.set",
+    "control.socket.pipelined",
+)
+
+
+def connectSocket(path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock.makefile("rw")
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def roundTrip(control, *lines):
+    control.write("".join(f"{line}\n" for line in lines))
+    control.flush()
+    for _ in lines:
+        reply = control.readline()
+        if not reply.startswith("ok"):
+            raise RuntimeError(reply)
+
+
+def collect(report, repeat=500, batch=50):
+    try:
+        from gi.repository import GLib  # noqa: F401
+    except ImportError:
+        for name in BENCHMARKS:
+            report.skip(name, "PyGObject is not installed")
+        return
+    if shutil.which("dbus-daemon") is None:
+        for name in BENCHMARKS:
+            report.skip(name, "dbus-daemon is not installed")
+        return
+
+    (busProc, address) = bench_dbus.startBus()
+    os.environ["SOUNDCRAFT_BUS_ADDRESS"] = address
+    from soundcraft.dbus import Client, DbusInitializationError
+
+    with tempfile.TemporaryDirectory() as stateDir:
+        path = os.path.join(stateDir, "control.sock")
+        service = bench_dbus.startService(
+            address, stateDir, "sim:12fx", "--control-socket", path
+        )
+        try:
+            with harness.quiet():
+                client = bench_dbus.connectClient(Client, DbusInitializationError)
+                dev = client.autodetect()
+                control = connectSocket(path)
+                index = dev._path.rsplit("/", 1)[1]
+                sources = iter(range(1 << 30))
+                report.add(
+                    "control.dbus.get",
+                    harness.sample(lambda: dev._proxy.routingSource, repeat),
+                )
+                report.add(
+                    "control.dbus.set",
+                    harness.sample(
+                        lambda: setattr(dev, "routingSource", str(next(sources) % 4)),
+                        repeat,
+                    ),
+                )
+                report.add(
+                    "control.socket.get",
+                    harness.sample(lambda: roundTrip(control, f"get {index}"), repeat),
+                )
+                report.add(
+                    "control.socket.set",
+                    harness.sample(
+                        lambda: roundTrip(control, f"set {index} {next(sources) % 4}"),
+                        repeat,
+                    ),
+                )
+                requests = [f"set {index} {i % 4}" for i in range(batch)]
+                samples = harness.sample(
+                    lambda: roundTrip(control, *requests), max(repeat // batch, 5)
+                )
+                report.add(
+                    "control.socket.pipelined",
+                    [s / batch for s in samples],
+                    batch=batch,
+                )
+                control.close()
+                client.shutdown()
+        finally:
+            service.terminate()
+            service.wait()
+            busProc.terminate()
+            busProc.wait()
+            del os.environ["SOUNDCRAFT_BUS_ADDRESS"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument(
+        "--batch", type=int, default=50, help="Requests per pipelined write"
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(report, repeat=args.repeat, batch=args.batch)
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_dbus.py - measure Client -> Service -> device round trips
+
+Starts a private dbus-daemon and a soundcraft_dbus_service on it that drives
+simulated Notepads, then times from this process:
+
+    dbus.connect   Client() plus the first device proxy
+    dbus.firstread.introspect
+                   connecting and reading a device property the way the
+                   client used to: introspecting the bus, the manager and the
+                   device, and checking the version up front
+    dbus.firstread.static
+                   the same with Client(), which builds its proxies from the
+                   local interface definitions
+    dbus.getall    refreshing a device's property snapshot
+    dbus.set       setting routingSource (the call returns once queued)
+    dbus.switch    setting routingSource until its PropertiesChanged arrives
+
+Needs PyGObject and dbus-daemon; the results are marked as skipped otherwise.
+
+Usage:
+   benchmarks/bench_dbus.py [--repeat 200] [--latency-us 0] [--output FILE]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import harness
+
+BENCHMARKS = (
+    "dbus.connect",
+    "dbus.firstread.introspect",
+    "dbus.firstread.static",
+    "dbus.getall",
+    "dbus.set",
+    "dbus.switch",
+)
+
+
+def startBus():
+    proc = subprocess.Popen(
+        ["dbus-daemon", "--session", "--nofork", "--print-address"],
+        stdout=subprocess.PIPE,
+    )
+    address = proc.stdout.readline().decode().strip()
+    return (proc, address)
+
+
+def startService(address, stateDir, transportSpec, *extraArgs):
+    env = dict(
+        os.environ,
+        SOUNDCRAFT_BUS_ADDRESS=address,
+        SOUNDCRAFT_TRANSPORT=transportSpec,
+    )
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import soundcraft.dbus; soundcraft.dbus.main()",
+            "--state-dir",
+            stateDir,
+            *extraArgs,
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def connectClient(Client, DbusInitializationError, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            client = Client()
+            # Client() doesn't touch the service; this fails until it is up
+            client.serviceVersion()
+            return client
+        except DbusInitializationError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def introspectedFirstRead(dbusModule):
+    bus = dbusModule.getBus()
+    bus.get(".DBus")
+    manager = bus.get(dbusModule.BUSNAME, dbusModule.Client.MGRPATH)
+    manager.version
+    dev = bus.get(dbusModule.BUSNAME, manager.devices[0])
+    return dev["org.freedesktop.DBus.Properties"].GetAll(
+        dbusModule.NotepadDbus.InterfaceName
+    )["routingSource"]
+
+
+def staticFirstRead(dbusModule):
+    client = dbusModule.Client()
+    dev = client.autodetect()
+    source = dev.routingSource
+    dev.close()
+    return source
+
+
+def waitForSwitch(GLib, dev, request, timeout=5):
+    done = []
+    with dev.PropertiesChanged.connect(lambda *args: done.append(True)):
+        dev.routingSource = request
+        context = GLib.MainContext.default()
+        deadline = time.monotonic() + timeout
+        while not done and time.monotonic() < deadline:
+            context.iteration(True)
+
+
+def collect(report, repeat=200, latency=0):
+    try:
+        from gi.repository import GLib
+    except ImportError:
+        for name in BENCHMARKS:
+            report.skip(name, "PyGObject is not installed")
+        return
+    if shutil.which("dbus-daemon") is None:
+        for name in BENCHMARKS:
+            report.skip(name, "dbus-daemon is not installed")
+        return
+
+    (busProc, address) = startBus()
+    os.environ["SOUNDCRAFT_BUS_ADDRESS"] = address
+    import soundcraft.dbus
+    from soundcraft.dbus import Client, DbusInitializationError
+
+    with tempfile.TemporaryDirectory() as stateDir:
+        service = startService(address, stateDir, f"sim:12fx;latency={latency}")
+        try:
+            with harness.quiet():
+                client = connectClient(Client, DbusInitializationError)
+                dev = client.autodetect()
+
+                def connect():
+                    Client().autodetect().close()
+
+                report.add(
+                    "dbus.connect", harness.sample(connect, max(repeat // 10, 5))
+                )
+                for (label, firstRead) in (
+                    ("introspect", introspectedFirstRead),
+                    ("static", staticFirstRead),
+                ):
+                    report.add(
+                        f"dbus.firstread.{label}",
+                        harness.sample(
+                            lambda: firstRead(soundcraft.dbus), max(repeat // 10, 5)
+                        ),
+                    )
+                report.add("dbus.getall", harness.sample(dev.refresh, repeat))
+                sources = iter(range(1 << 30))
+                report.add(
+                    "dbus.set",
+                    harness.sample(
+                        lambda: setattr(dev, "routingSource", str(next(sources) % 4)),
+                        repeat,
+                    ),
+                )
+                report.add(
+                    "dbus.switch",
+                    harness.sample(
+                        lambda: waitForSwitch(GLib, dev, str(next(sources) % 4)),
+                        repeat,
+                    ),
+                )
+                client.shutdown()
+        finally:
+            service.terminate()
+            service.wait()
+            busProc.terminate()
+            busProc.wait()
+            del os.environ["SOUNDCRAFT_BUS_ADDRESS"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--latency-us",
+        type=float,
+        default=0,
+        help="Simulated control transfer latency, in microseconds",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(report, repeat=args.repeat, latency=args.latency_us / 1e6)
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_hotplug.py - measure the time from a udev "add" event to a usable device
+
+A new Notepad is plugged into a fake USB bus (the real pyusb `find()` over a
+fake backend) that already has other Notepads and unrelated devices on it.
+
+    hotplug.rescan.busN   detectAll() skipping the known devices, as the
+                          service did for every add event
+    hotplug.attach.busN   notepad.attach() on the event's BUSNUM/DEVNUM
+    hotplug.added.*       Service.uevent() with a synthetic udev event until
+                          the (batched) Added signal is emitted from the main
+                          loop, for both strategies
+                          (needs PyGObject and dbus-daemon)
+
+Usage:
+   benchmarks/bench_hotplug.py [--sizes 8,128] [--repeat 50] [--output FILE]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import bench_autodetect
+import bench_dbus
+import harness
+
+from soundcraft import notepad, transport
+
+ADDED = ("hotplug.added.rescan", "hotplug.added.attach")
+
+
+class FakeUdevDevice:
+    """The properties of a udev usb_device event that the service reads"""
+
+    def __init__(self, usbdev):
+        self.properties = {
+            "ID_VENDOR_ID": f"{usbdev.idVendor:04x}",
+            "ID_PRODUCT_ID": f"{usbdev.idProduct:04x}",
+            # udev zero-pads these
+            "BUSNUM": f"{usbdev.bus:03d}",
+            "DEVNUM": f"{usbdev.address:03d}",
+        }
+
+    def get_property(self, name):
+        return self.properties[name]
+
+
+def fakeBus(size):
+    """Unrelated devices and two known Notepads, plus one newly plugged one"""
+    descriptors = bench_autodetect.populate(size, (0x0030, 0x0031))
+    new = bench_autodetect.descriptor(notepad.HARMAN_USB, 0x0032, 250)
+    descriptors.insert(len(descriptors) // 2, new)
+    known = {(1, 200), (1, 201)}
+    return (descriptors, known, new)
+
+
+def collectDirect(report, sizes, repeat, descriptorCost, stateDir):
+    for size in sizes:
+        (descriptors, known, new) = fakeBus(size)
+        cases = (
+            (
+                "rescan",
+                lambda: notepad.detectAll(stateDir=stateDir, ignore=known),
+            ),
+            (
+                "attach",
+                lambda: notepad.attach(
+                    new.idProduct, new.bus, new.address, stateDir=stateDir
+                ),
+            ),
+        )
+        for (label, func) in cases:
+            backend = bench_autodetect.FakeBackend(descriptors, descriptorCost)
+            transport.setDefault(transport.UsbTransport(backend=backend))
+            func()
+            backend.reads = 0
+            samples = harness.sample(func, repeat, warmup=0)
+            report.add(
+                f"hotplug.{label}.bus{len(descriptors)}",
+                samples,
+                descriptor_reads=backend.reads // repeat,
+            )
+
+
+def collectAdded(report, size, repeat, descriptorCost, stateDir):
+    try:
+        from gi.repository import GLib
+    except ImportError:
+        for name in ADDED:
+            report.skip(name, "PyGObject is not installed")
+        return
+    if shutil.which("dbus-daemon") is None:
+        for name in ADDED:
+            report.skip(name, "dbus-daemon is not installed")
+        return
+
+    (busProc, address) = bench_dbus.startBus()
+    os.environ["SOUNDCRAFT_BUS_ADDRESS"] = address
+    (descriptors, known, new) = fakeBus(size)
+    backend = bench_autodetect.FakeBackend(descriptors, descriptorCost)
+    transport.setDefault(transport.UsbTransport(backend=backend))
+    try:
+        from soundcraft.dbus import Service
+
+        service = Service(stateDir=stateDir)
+        added = []
+        service.Added.connect(added.append)
+        event = FakeUdevDevice(new)
+        strategies = (
+            # The old behaviour: a rescan for every add event
+            ("rescan", lambda: service.hotplugAdd(new.idVendor, new.idProduct)),
+            ("attach", lambda: service.uevent(None, "add", event)),
+        )
+        context = GLib.MainContext.default()
+        for (label, plugIn) in strategies:
+
+            def plugCycle():
+                plugIn()
+                # Added is batched, and sent once the main loop gets to it
+                deadline = time.monotonic() + 5
+                while not added:
+                    assert time.monotonic() < deadline, "No Added signal"
+                    context.iteration(True)
+                added.clear()
+                service.hotplugRemove(new.bus, new.address)
+                while context.pending():
+                    context.iteration(False)
+
+            with harness.quiet():
+                samples = harness.sample(plugCycle, repeat)
+            report.add(f"hotplug.added.{label}", samples)
+        with harness.quiet():
+            service.unregisterAll()
+    finally:
+        busProc.terminate()
+        busProc.wait()
+        del os.environ["SOUNDCRAFT_BUS_ADDRESS"]
+
+
+def collect(report, sizes=(8, 128), repeat=50, descriptorCost=20e-6):
+    # Each case plugs its own fake backend in underneath pyusb
+    try:
+        with tempfile.TemporaryDirectory() as stateDir:
+            collectDirect(report, sizes, repeat, descriptorCost, stateDir)
+            collectAdded(report, max(sizes), repeat, descriptorCost, stateDir)
+    finally:
+        transport.setDefault(None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        default="8,128",
+        help="Comma-separated list of unrelated USB device counts to test",
+    )
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--descriptor-cost-us",
+        type=float,
+        default=20.0,
+        help="Simulated cost of reading one device descriptor, in microseconds",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(
+        report,
+        sizes=[int(x) for x in args.sizes.split(",")],
+        repeat=args.repeat,
+        descriptorCost=args.descriptor_cost_us / 1e6,
+    )
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_notepad.py - measure routing switches and source name parsing
+
+Uses a simulated Notepad-12FX to time:
+
+    switch.direct   NotepadBase.routingSource assignment (the --no-dbus path)
+    switch.worker   the same switch queued on a DeviceWorker and awaited, as
+                    the D-Bus service does it
+    parse.<input>   NotepadBase._parseSourcename for a number, an exact name,
+                    a substring, a lower case name, a label and an invalid
+                    request
+
+Usage:
+   benchmarks/bench_notepad.py [--repeat 1000] [--latency-us 0] [--output FILE]
+"""
+
+import argparse
+
+import harness
+
+from soundcraft import notepad, simulator, transport
+from soundcraft.worker import DeviceWorker, RoutingCoalescer
+
+PARSE_INPUTS = {
+    "number": "2",
+    "name": "INPUT_7_8",
+    "substring": "5_6",
+    "casefold": "master_l_r",
+    "label": "Stereo 7/8",
+    "invalid": "INPUT_1_2",
+}
+
+
+def collect(report, repeat=1000, latency=0):
+    bus = simulator.SimulatedBus(latency=latency)
+    bus.plug("12fx")
+    transport.setDefault(bus)
+    try:
+        dev = notepad.autodetect(stateDir=None)
+        sources = iter(range(1 << 30))
+        with harness.quiet():
+            report.add(
+                "switch.direct",
+                harness.sample(
+                    lambda: setattr(dev, "routingSource", next(sources) % 4), repeat
+                ),
+            )
+            worker = DeviceWorker()
+            coalescer = RoutingCoalescer(
+                worker, dev.switchSource, lambda: dev.state.get("source")
+            )
+            report.add(
+                "switch.worker",
+                harness.sample(
+                    lambda: coalescer.request(
+                        dev.parseSource(next(sources) % 4)
+                    ).result(),
+                    repeat,
+                ),
+            )
+            worker.stop(timeout=5)
+        for (label, request) in PARSE_INPUTS.items():
+            report.add(
+                f"parse.{label}",
+                harness.sample(lambda: dev._parseSourcename(request), repeat),
+            )
+    finally:
+        transport.setDefault(None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument(
+        "--latency-us",
+        type=float,
+        default=0,
+        help="Simulated control transfer latency, in microseconds",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(report, repeat=args.repeat, latency=args.latency_us / 1e6)
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
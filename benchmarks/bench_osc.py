@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_osc.py - measure OSC message to USB transfer latency
+
+Starts a private dbus-daemon and a soundcraft_dbus_service with an OSC port,
+driving two simulated Notepads, subscribes to feedback, and times:
+
+    osc.reply    sending /notepad/0/source until its reply arrives
+    osc.switch   sending /notepad/0/source until the feedback that the
+                 switch reached the device arrives
+    osc.bundle   one bundle switching both devices, until both have
+    osc.ctl      the old bridge: running soundcraft_ctl --set for a message
+
+Needs PyGObject and dbus-daemon; the results are marked as skipped otherwise.
+
+Usage:
+   benchmarks/bench_osc.py [--repeat 200] [--latency-us 0] [--output FILE]
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import bench_dbus
+import harness
+
+from soundcraft import osc
+
+BENCHMARKS = ("osc.reply", "osc.switch", "osc.bundle", "osc.ctl")
+
+
+def freePort():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def receive(sock, count):
+    """Wait for 'count' /notepad/<n>/source messages"""
+    received = 0
+    while received < count:
+        for (address, args) in osc.decode(sock.recv(65536)):
+            if address == "/notepad/error":
+                raise RuntimeError(args[0])
+            received += 1
+
+
+def waitForService(sock, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    sock.settimeout(0.1)
+    while True:
+        sock.sendto(osc.encodeMessage("/notepad/subscribe"), ("127.0.0.1", port))
+        sock.sendto(osc.encodeMessage("/notepad/*/source"), ("127.0.0.1", port))
+        try:
+            receive(sock, 2)
+            break
+        except (socket.timeout, RuntimeError):
+            # Not listening yet, or the devices aren't registered yet
+            if time.monotonic() > deadline:
+                raise
+    # Drop anything left over from the attempts
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(65536)
+    except BlockingIOError:
+        pass
+    sock.settimeout(5)
+
+
+def collect(report, repeat=200, latency=0):
+    try:
+        from gi.repository import GLib  # noqa: F401
+    except ImportError:
+        for name in BENCHMARKS:
+            report.skip(name, "PyGObject is not installed")
+        return
+    if shutil.which("dbus-daemon") is None:
+        for name in BENCHMARKS:
+            report.skip(name, "dbus-daemon is not installed")
+        return
+
+    (busProc, address) = bench_dbus.startBus()
+    port = freePort()
+    with tempfile.TemporaryDirectory() as stateDir:
+        service = bench_dbus.startService(
+            address,
+            stateDir,
+            f"sim:12fx,12fx;latency={latency}",
+            "--osc-port",
+            str(port),
+        )
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        target = ("127.0.0.1", port)
+        sources = iter(range(1 << 30))
+        try:
+            waitForService(sock, port)
+
+            def reply():
+                sock.sendto(
+                    osc.encodeMessage("/notepad/0/source", next(sources) % 4), target
+                )
+                receive(sock, 1)
+
+            def switch():
+                reply()
+                receive(sock, 1)
+
+            def bundle():
+                source = next(sources) % 4
+                sock.sendto(
+                    osc.encodeBundle(
+                        osc.encodeMessage("/notepad/0/source", source),
+                        osc.encodeMessage("/notepad/1/source", source),
+                    ),
+                    target,
+                )
+                # Two replies, then two feedback messages
+                receive(sock, 4)
+
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                reply()
+                samples.append(time.perf_counter() - start)
+                # The feedback for the switch, which isn't part of this one
+                receive(sock, 1)
+            report.add("osc.reply", samples)
+            report.add("osc.switch", harness.sample(switch, repeat))
+            report.add("osc.bundle", harness.sample(bundle, repeat))
+
+            env = dict(os.environ, SOUNDCRAFT_BUS_ADDRESS=address)
+
+            def ctl():
+                subprocess.run(
+                    [
+                        sys.executable,
+                        "-c",
+                        "import soundcraft.cli; soundcraft.cli.main()",
+                        "--set",
+                        str(next(sources) % 4),
+                    ],
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    check=True,
+                )
+
+            report.add("osc.ctl", harness.sample(ctl, max(repeat // 20, 3), warmup=1))
+        finally:
+            sock.close()
+            service.terminate()
+            service.wait()
+            busProc.terminate()
+            busProc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--latency-us",
+        type=float,
+        default=0,
+        help="Simulated control transfer latency, in microseconds",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(report, repeat=args.repeat, latency=args.latency_us / 1e6)
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
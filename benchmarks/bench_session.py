@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_session.py - measure what keeping device handles open saves
+
+Uses simulated Notepads whose handle takes --open-us to open, and times:
+
+    session.first.<mode>     the first routing switch after detection
+    session.transfer.<mode>  every routing switch after that
+
+where 'lazy' leaves opening the handle to the first transfer (the old
+behaviour) and 'eager' is the DeviceSession opening it at detection.  With
+a real libusb it also times a bus scan that probes for the pyusb backend
+(find.default) against one reusing the transport's backend (find.cached).
+
+Usage:
+   benchmarks/bench_session.py [--repeat 200] [--open-us 500] [--output FILE]
+"""
+
+import argparse
+import time
+
+import harness
+import usb.backend.libusb1
+import usb.core
+
+from soundcraft import notepad, simulator, transport
+
+
+class LazyBus(simulator.SimulatedBus):
+    """A SimulatedBus whose devices are opened by their first transfer"""
+
+    def open(self, dev):
+        pass
+
+
+def firstSwitch(bus, switches):
+    usbdev = bus.plug("12fx")
+    dev = notepad.Notepad_12fx(dev=usbdev, stateDir=None, transport=bus)
+    samples = []
+    for i in range(switches):
+        start = time.perf_counter()
+        dev.routingSource = i % 4
+        samples.append(time.perf_counter() - start)
+    dev.close()
+    bus.unplug(usbdev)
+    return samples
+
+
+def collectFind(report, repeat):
+    backend = usb.backend.libusb1.get_backend()
+    if backend is None:
+        for name in ("session.find.default", "session.find.cached"):
+            report.skip(name, "libusb is not available")
+        return
+    usbTransport = transport.UsbTransport(backend=backend)
+    report.add(
+        "session.find.default",
+        harness.sample(
+            lambda: list(usb.core.find(find_all=True, idVendor=notepad.HARMAN_USB)),
+            repeat,
+        ),
+    )
+    report.add(
+        "session.find.cached",
+        harness.sample(lambda: list(usbTransport.findAll(notepad.HARMAN_USB)), repeat),
+    )
+
+
+def collect(report, repeat=200, openLatency=500e-6, latency=0):
+    for (mode, busClass) in (("lazy", LazyBus), ("eager", simulator.SimulatedBus)):
+        bus = busClass(latency=latency, openLatency=openLatency)
+        first = []
+        steady = []
+        with harness.quiet():
+            for _ in range(repeat):
+                samples = firstSwitch(bus, 5)
+                first.append(samples[0])
+                steady.extend(samples[1:])
+        report.add(f"session.first.{mode}", first)
+        report.add(f"session.transfer.{mode}", steady)
+    collectFind(report, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--open-us",
+        type=float,
+        default=500,
+        help="Simulated cost of opening a device handle, in microseconds",
+    )
+    parser.add_argument(
+        "--latency-us",
+        type=float,
+        default=0,
+        help="Simulated control transfer latency, in microseconds",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(
+        report,
+        repeat=args.repeat,
+        openLatency=args.open_us / 1e6,
+        latency=args.latency_us / 1e6,
+    )
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
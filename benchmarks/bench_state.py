@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+bench_state.py - measure routing switch latency with and without persistence
+
+Switches the routing source of a Notepad-12FX (with a no-op USB device)
+repeatedly and reports the per-switch latency for:
+
+    memory        no state persistence at all (stateDir=None)
+    legacy        the old unconditional, non-atomic rewrite on every switch
+    writethrough  atomic replace + fsync on every switch (flushInterval=0)
+    writebehind   coalesced atomic writes (flushInterval=--interval)
+
+It also times _loadState() and _saveState() on their own.
+
+Usage:
+   benchmarks/bench_state.py [--switches 500] [--statedir DIR] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import harness
+
+from soundcraft import notepad
+
+
+class NullUsbDevice:
+    bcdDevice = 0x0100
+    product = "Notepad-12FX"
+    serial_number = None
+    bus = 1
+    address = 1
+    port_numbers = (1,)
+
+    def ctrl_transfer(self, *args, **kwargs):
+        pass
+
+
+class LegacyNotepad(notepad.Notepad_12fx):
+    """Notepad_12fx with the pre-StateFile save behaviour"""
+
+    def _saveState(self):
+        os.makedirs(self.stateDir, exist_ok=True)
+        with open(f"{self.stateDir}/{self.product}.state", "w") as fh:
+            fh.write(json.dumps(self.state, sort_keys=True, indent=4))
+
+
+def switchSamples(dev, switches):
+    samples = []
+    with harness.quiet():
+        for i in range(switches):
+            start = time.perf_counter()
+            dev.routingSource = i % 4
+            samples.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    dev.close()
+    return (samples, time.perf_counter() - start)
+
+
+def collect(report, switches=500, interval=2.0, stateDir=None):
+    with tempfile.TemporaryDirectory(dir=stateDir) as stateDir:
+        variants = (
+            ("memory", notepad.Notepad_12fx, {"stateDir": None}),
+            ("legacy", LegacyNotepad, {"stateDir": stateDir}),
+            ("writethrough", notepad.Notepad_12fx, {"stateDir": stateDir}),
+            (
+                "writebehind",
+                notepad.Notepad_12fx,
+                {"stateDir": stateDir, "flushInterval": interval},
+            ),
+        )
+        for (label, devClass, kwargs) in variants:
+            if kwargs["stateDir"] is not None:
+                # Devices in one state directory share a store, and its
+                # flush interval; keep the variants apart
+                kwargs["stateDir"] = os.path.join(kwargs["stateDir"], label)
+            dev = devClass(dev=NullUsbDevice(), **kwargs)
+            (samples, closeTime) = switchSamples(dev, switches)
+            report.add(f"switch.{label}", samples, close_us=closeTime * 1e6)
+
+        dev = notepad.Notepad_12fx(dev=NullUsbDevice(), stateDir=stateDir)
+        dev.state = {"source": 2}
+        report.add("state.save", harness.sample(dev._saveState, switches))
+        report.add("state.load", harness.sample(dev._loadState, switches))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--switches", type=int, default=500)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Write-behind flush interval in seconds",
+    )
+    parser.add_argument(
+        "--statedir",
+        help="Directory to write state into (default: a fresh temporary directory)",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = harness.Report()
+    collect(
+        report, switches=args.switches, interval=args.interval, stateDir=args.statedir
+    )
+    report.printTable()
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
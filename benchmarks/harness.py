@@ -0,0 +1,126 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Shared timing and reporting helpers for the benchmark scripts"""
+
+import contextlib
+import datetime
+import json
+import logging
+import platform
+import time
+
+import soundcraft
+
+
+def sample(func, repeat, warmup=3):
+    """Call func() repeatedly and return the wall-clock time of each call"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def distribution(samples):
+    """Summarize latency samples (in seconds) as microseconds"""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_us": sum(ordered) / len(ordered) * 1e6,
+        "min_us": ordered[0] * 1e6,
+        "p50_us": percentile(ordered, 50) * 1e6,
+        "p90_us": percentile(ordered, 90) * 1e6,
+        "p99_us": percentile(ordered, 99) * 1e6,
+        "max_us": ordered[-1] * 1e6,
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Keep the code under test's log messages out of the report"""
+    logger = logging.getLogger("soundcraft")
+    level = logger.level
+    logger.setLevel(logging.CRITICAL + 1)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+class Report:
+    def __init__(self):
+        self.results = {}
+
+    def add(self, name, samples, **extra):
+        self.results[name] = dict(distribution(samples), **extra)
+
+    def skip(self, name, reason):
+        self.results[name] = {"skipped": reason}
+
+    def asDict(self):
+        return {
+            "meta": {
+                "version": soundcraft.__version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            },
+            "results": self.results,
+        }
+
+    def write(self, path):
+        with open(path, "w") as fh:
+            json.dump(self.asDict(), fh, indent=2, sort_keys=True)
+
+    def printTable(self, baseline=None):
+        width = max([len(name) for name in self.results] + [9])
+        header = f"{'benchmark':<{width}} {'p50 us':>10} {'p99 us':>10} {'max us':>10}"
+        if baseline is not None:
+            header += f" {'p50 vs base':>12}"
+        print(header)
+        for (name, result) in sorted(self.results.items()):
+            if "skipped" in result:
+                print(f"{name:<{width}} skipped: {result['skipped']}")
+                continue
+            line = f"{name:<{width}} {result['p50_us']:>10.1f} {result['p99_us']:>10.1f} {result['max_us']:>10.1f}"
+            if baseline is not None:
+                line += f" {compare(result, baseline.get(name)):>12}"
+            print(line)
+
+
+def compare(result, base):
+    if base is None or "p50_us" not in base or not base["p50_us"]:
+        return "new"
+    change = (result["p50_us"] - base["p50_us"]) / base["p50_us"] * 100
+    return f"{change:+.1f}%"
+
+
+def loadBaseline(path):
+    with open(path, "r") as fh:
+        return json.load(fh)["results"]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""\
+run.py - run the whole benchmark suite
+
+Runs every benchmark, prints a summary table and writes all latency
+distributions to a JSON file, so results from different releases can be
+compared with --baseline.
+
+Usage:
+   benchmarks/run.py [--output results.json] [--baseline old.json] [--quick]
+                     [--only autodetect,hotplug,session,state,notepad,dbus,control,osc]
+"""
+
+import argparse
+
+import bench_autodetect
+import bench_control
+import bench_dbus
+import bench_hotplug
+import bench_notepad
+import bench_osc
+import bench_session
+import bench_state
+import harness
+
+SUITES = {
+    "autodetect": lambda report, quick: bench_autodetect.collect(
+        report, sizes=(0, 32) if quick else (0, 8, 32, 128, 512), repeat=20
+    ),
+    "hotplug": lambda report, quick: bench_hotplug.collect(
+        report, sizes=(8,) if quick else (8, 128), repeat=10 if quick else 50
+    ),
+    "session": lambda report, quick: bench_session.collect(
+        report, repeat=20 if quick else 200
+    ),
+    "state": lambda report, quick: bench_state.collect(
+        report, switches=50 if quick else 500
+    ),
+    "notepad": lambda report, quick: bench_notepad.collect(
+        report, repeat=100 if quick else 1000
+    ),
+    "dbus": lambda report, quick: bench_dbus.collect(
+        report, repeat=20 if quick else 200
+    ),
+    "control": lambda report, quick: bench_control.collect(
+        report, repeat=50 if quick else 500
+    ),
+    "osc": lambda report, quick: bench_osc.collect(report, repeat=20 if quick else 200),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--output",
+        default="benchmark-results.json",
+        help="JSON file to write the results to (default %(default)s)",
+    )
+    parser.add_argument(
+        "--baseline", help="JSON results from an earlier run to compare against"
+    )
+    parser.add_argument(
+        "--quick", help="Fewer iterations, for a smoke test", action="store_true"
+    )
+    parser.add_argument(
+        "--only",
+        help=f"Comma-separated subset of: {', '.join(SUITES)}",
+    )
+    args = parser.parse_args()
+    names = args.only.split(",") if args.only else list(SUITES)
+
+    report = harness.Report()
+    for name in names:
+        SUITES[name](report, args.quick)
+    baseline = harness.loadBaseline(args.baseline) if args.baseline else None
+    report.printTable(baseline)
+    report.write(args.output)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
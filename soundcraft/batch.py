@@ -0,0 +1,190 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import shlex
+
+
+class BatchError(Exception):
+    pass
+
+
+class Batch:
+    """Runs soundcraft_ctl commands read one per line, sharing one connection
+
+    'openDevices' returns the devices to work on, and is only called again
+    by the 'devices' command.  Without a D-Bus 'client' the preset commands
+    are unavailable.  Every command prints one result line, as plain text or
+    as a JSON object.
+    """
+
+    # Command name: (argument names, method name, description)
+    COMMANDS = {
+        "devices": ((), "devices", "List the connected devices"),
+        "use": (("N",), "use", "Send the following commands to device number N"),
+        "get": ((), "get", "Show the current routing source"),
+        "list": ((), "list", "Show the current and available routing sources"),
+        "set": (("SOURCE",), "set", "Route SOURCE to the USB capture input"),
+        "presets": ((), "presets", "List the saved routing presets"),
+        "save-preset": (
+            ("NAME",),
+            "savePreset",
+            "Save the current routing as a preset",
+        ),
+        "recall-preset": (
+            ("NAME",),
+            "recallPreset",
+            "Switch every device in a preset at once",
+        ),
+        "delete-preset": (("NAME",), "deletePreset", "Delete a preset"),
+    }
+
+    def __init__(self, openDevices, client=None):
+        self._openDevices = openDevices
+        self._devices = None
+        self._current = 0
+        self.client = client
+
+    @classmethod
+    def usage(cls):
+        lines = []
+        for (command, (argNames, _, description)) in cls.COMMANDS.items():
+            lines.append(f"  {' '.join((command, *argNames)):<20} {description}")
+        return "\n".join(lines)
+
+    def run(self, lines, out, asJson=False):
+        """Execute every command in 'lines'; returns the number that failed"""
+        failures = 0
+        for (number, line) in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            record = {"line": number, "command": line}
+            try:
+                record["result"] = self.execute(line)
+                record["ok"] = True
+            except Exception as e:
+                record["error"] = str(e)
+                record["ok"] = False
+                failures += 1
+            out.write(self.format(record, asJson) + "\n")
+            # Let a reader on the other end of a pipe act on it right away
+            out.flush()
+        return failures
+
+    def execute(self, line):
+        (command, *args) = shlex.split(line)
+        if command not in self.COMMANDS:
+            raise BatchError(f"Unknown command {command}")
+        (argNames, method, _) = self.COMMANDS[command]
+        if len(args) != len(argNames):
+            raise BatchError(f"Usage: {' '.join((command, *argNames))}")
+        return getattr(self, method)(*args)
+
+    @staticmethod
+    def format(record, asJson):
+        if asJson:
+            return json.dumps(record, sort_keys=True)
+        if not record["ok"]:
+            return f"error {record['command']}: {record['error']}"
+        fields = []
+        for (key, value) in record["result"].items():
+            if isinstance(value, dict):
+                value = ",".join(f"{k}:{v}" for (k, v) in value.items())
+            elif isinstance(value, (list, tuple)):
+                value = ",".join(str(v) for v in value)
+            fields.append(f"{key}={value}")
+        return f"ok {record['command']}: {' '.join(fields)}"
+
+    def close(self):
+        for dev in self._devices or ():
+            dev.close()
+
+    def _allDevices(self):
+        if self._devices is None:
+            self._devices = list(self._openDevices())
+        return self._devices
+
+    def _device(self):
+        devices = self._allDevices()
+        if not devices:
+            raise BatchError("No compatible device detected")
+        if self._current >= len(devices):
+            raise BatchError(f"Device {self._current} is gone")
+        dev = devices[self._current]
+        # A D-Bus proxy's snapshot only follows changes made by others while
+        # a main loop runs, and none does here
+        refresh = getattr(dev, "refresh", None)
+        if refresh is not None:
+            refresh()
+        return dev
+
+    def _needClient(self):
+        if self.client is None:
+            raise BatchError(
+                "Presets are kept by the D-Bus service, and need it to be running"
+            )
+        return self.client
+
+    def devices(self):
+        self.close()
+        self._devices = None
+        return {"devices": [dev.name for dev in self._allDevices()]}
+
+    def use(self, index):
+        devices = self._allDevices()
+        if not index.isdigit() or int(index) >= len(devices):
+            raise BatchError(f"No device number {index}")
+        self._current = int(index)
+        return {"device": devices[self._current].name}
+
+    def get(self):
+        dev = self._device()
+        return {"device": dev.name, "routingSource": dev.routingSource}
+
+    def list(self):
+        dev = self._device()
+        return {
+            "device": dev.name,
+            "routingSource": dev.routingSource,
+            "sources": list(dev.sources),
+        }
+
+    def set(self, source):
+        dev = self._device()
+        dev.routingSource = source
+        return {"device": dev.name, "routingSource": dev.routingSource}
+
+    def presets(self):
+        return {"presets": list(self._needClient().presets())}
+
+    def savePreset(self, name):
+        self._needClient().savePreset(name)
+        return {"preset": name}
+
+    def recallPreset(self, name):
+        timings = self._needClient().recallScene(name)
+        return {"preset": name, "timings": dict(timings)}
+
+    def deletePreset(self, name):
+        self._needClient().deletePreset(name)
+        return {"preset": name}
@@ -20,9 +20,11 @@
 # SOFTWARE.
 
 import argparse
+import logging
 import sys
 
 from soundcraft import __version__
+from soundcraft.diagnostics import profiled, setupLogging
 
 
 def autodetect(dbus=True):
@@ -45,6 +47,63 @@ def autodetect(dbus=True):
         return soundcraft.notepad.autodetect()
 
 
+def connectClient():
+    from soundcraft.dbus import Client, DbusInitializationError
+
+    try:
+        client = Client()
+        # The client only reaches the service on its first call
+        client.checkService()
+    except DbusInitializationError as e:
+        print(e)
+        sys.exit(2)
+    return client
+
+
+def presetCommand(args):
+    client = connectClient()
+    try:
+        if args.save_preset:
+            client.savePreset(args.save_preset)
+            print(f"Saved the current routing as preset {args.save_preset}")
+        if args.delete_preset:
+            client.deletePreset(args.delete_preset)
+            print(f"Deleted preset {args.delete_preset}")
+        if args.recall_preset:
+            timings = client.recallScene(args.recall_preset)
+            print(f"Recalled preset {args.recall_preset}:")
+            for (path, seconds) in sorted(timings.items()):
+                print(f"  {path}: {seconds * 1000:.1f}ms")
+    except Exception as e:
+        print(f"Preset command failed: {e}")
+        sys.exit(1)
+    if args.presets:
+        for name in client.presets():
+            print(name)
+
+
+def batchCommand(args):
+    from soundcraft.batch import Batch
+
+    if args.no_dbus:
+        import soundcraft.notepad
+
+        batch = Batch(soundcraft.notepad.detectAll)
+    else:
+        client = connectClient()
+        batch = Batch(client.devices, client=client)
+    try:
+        if args.batch == "-":
+            failures = batch.run(sys.stdin, sys.stdout, asJson=args.json)
+        else:
+            with open(args.batch) as fh:
+                failures = batch.run(fh, sys.stdout, asJson=args.json)
+    finally:
+        batch.close()
+    if failures:
+        sys.exit(1)
+
+
 def max_lengths(dev):
     target_len = max([len(x) for x in dev.routingTarget])
     source_len = 0
@@ -84,7 +143,12 @@ def show(dev):
 
 
 def main():
-    parser = argparse.ArgumentParser()
+    from soundcraft.batch import Batch
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"batch commands:\n{Batch.usage()}",
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -104,8 +168,57 @@ def main():
     parser.add_argument(
         "-s", "--set", help="Set the specified source to route to the USB capture input"
     )
+    parser.add_argument(
+        "--presets", help="List the saved routing presets", action="store_true"
+    )
+    parser.add_argument(
+        "--save-preset",
+        metavar="NAME",
+        help="Save the current routing of every connected device as a preset",
+    )
+    parser.add_argument(
+        "--recall-preset",
+        metavar="NAME",
+        help="Switch every device in a preset at once",
+    )
+    parser.add_argument("--delete-preset", metavar="NAME", help="Delete a preset")
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Run the batch commands in FILE ('-' for stdin), one per line, over a single connection",
+    )
+    parser.add_argument(
+        "--json",
+        help="Print batch results as one JSON object per line",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="Log progress (twice for debug output with timings)",
+        action="count",
+        default=0,
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="MODE[:FILE]",
+        help="Profile this command with MODE 'cprofile' or 'tracemalloc', saving the results to FILE (default: in the temporary directory).  Also settable with SOUNDCRAFT_PROFILE",
+    )
     args = parser.parse_args()
-    if args.list or args.set:
+    setupLogging([logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+    with profiled(args.profile, "soundcraft_ctl"):
+        run(parser, args)
+
+
+def run(parser, args):
+    if args.batch:
+        batchCommand(args)
+    elif args.presets or args.save_preset or args.recall_preset or args.delete_preset:
+        if args.no_dbus:
+            print("Presets are kept by the D-Bus service, and need it to be running")
+            sys.exit(1)
+        presetCommand(args)
+    elif args.list or args.set:
         dev = autodetect(dbus=not args.no_dbus)
         if dev is None:
             print("No compatible device detected")
@@ -114,8 +227,13 @@ def main():
         if args.set:
             try:
                 dev.routingSource = args.set
-            except ValueError:
-                print(f"Unrecognised input choice {args.set}")
+            except ValueError as e:
+                from soundcraft.notepad import AmbiguousSourceError
+
+                if isinstance(e, AmbiguousSourceError):
+                    print(e)
+                else:
+                    print(f"Unrecognised input choice {args.set}")
                 print("Run -l to list the valid choices")
                 sys.exit(1)
         show(dev)
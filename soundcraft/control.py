@@ -0,0 +1,259 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import logging
+import os
+import socket
+import stat
+
+# Permissions of the socket file, which decide who may connect
+DEFAULT_MODE = 0o660
+# Longest request line accepted, and most unsent output a client may pile
+# up, so a misbehaving client can't make the service buffer forever
+MAX_LINE = 4096
+MAX_BUFFER = 1 << 20
+
+log = logging.getLogger(__name__)
+
+
+class ControlServer:
+    """A compact line protocol on a Unix socket, alongside D-Bus
+
+    Every request is one line and gets exactly one reply line, in order:
+    'ok <JSON value>' or 'error <message>'.  Requests may be pipelined.
+
+        list            {N: {name, routingSource, sources}} for every device
+        get N           device N's routingSource
+        set N SOURCE    request a routing change; replies with the source
+                        name it resolved to
+        subscribe       like list, and from then on changes arrive between
+                        replies as 'event {"device": N, <property>: <value>}'
+                        lines, or with "added"/"removed" on hotplug
+        unsubscribe
+
+    N is the index in the device's D-Bus object path, and the requests act
+    on the same objects the D-Bus interface publishes.  'watcher' hooks the
+    sockets into the caller's event loop (see GLibWatcher in dbus.py).
+    """
+
+    def __init__(self, path, watcher, mode=DEFAULT_MODE):
+        self.path = path
+        self.watcher = watcher
+        self.devices = {}
+        self._subscriptions = {}
+        self._connections = set()
+        self._commands = {
+            "list": self.list,
+            "get": self.get,
+            "set": self.set,
+            "subscribe": self.subscribe,
+            "unsubscribe": self.unsubscribe,
+        }
+        removeStaleSocket(path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        # Nobody can connect before listen(), so there is no window where
+        # the umask's permissions apply instead
+        os.chmod(path, mode)
+        self._sock.listen(16)
+        self._sock.setblocking(False)
+        self._watch = watcher.watch(self._sock.fileno(), self._accept)
+        log.info("Listening for control connections on %s", path)
+
+    def addDevice(self, idx, wrapped):
+        self.devices[idx] = wrapped
+        self._subscriptions[idx] = wrapped.PropertiesChanged.connect(
+            lambda interface, changed, invalidated: self.broadcast(
+                dict(changed, device=idx)
+            )
+        )
+        self.broadcast({"device": idx, "added": True})
+
+    def removeDevice(self, idx):
+        if self.devices.pop(idx, None) is None:
+            return
+        self._subscriptions.pop(idx).disconnect()
+        self.broadcast({"device": idx, "removed": True})
+
+    def broadcast(self, event):
+        line = f"event {json.dumps(event)}"
+        for connection in list(self._connections):
+            if connection.subscribed:
+                connection.send(line)
+
+    def handle(self, connection, line):
+        """Run one request line and return the reply line"""
+        (command, _, args) = line.partition(" ")
+        try:
+            if command not in self._commands:
+                raise ValueError(f"Unknown command {command}")
+            result = self._commands[command](connection, args.strip())
+        except Exception as e:
+            return "error " + " ".join(str(e).split())
+        return f"ok {json.dumps(result)}"
+
+    def _device(self, index):
+        if not index.isdigit() or int(index) not in self.devices:
+            raise ValueError(f"No device {index}")
+        return self.devices[int(index)]
+
+    def list(self, connection, args):
+        return {
+            idx: {
+                "name": wrapped.name,
+                "routingSource": wrapped.routingSource,
+                "sources": list(wrapped.sources),
+            }
+            for (idx, wrapped) in sorted(self.devices.items())
+        }
+
+    def get(self, connection, args):
+        return self._device(args).routingSource
+
+    def set(self, connection, args):
+        (index, _, source) = args.partition(" ")
+        wrapped = self._device(index)
+        wrapped.routingSource = source.strip()
+        return wrapped.routingSource
+
+    def subscribe(self, connection, args):
+        connection.subscribed = True
+        return self.list(connection, args)
+
+    def unsubscribe(self, connection, args):
+        connection.subscribed = False
+        return None
+
+    def _accept(self):
+        try:
+            (sock, _) = self._sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return True
+        self._connections.add(ControlConnection(self, sock))
+        return True
+
+    def _closed(self, connection):
+        self._connections.discard(connection)
+
+    def close(self):
+        if self._sock is None:
+            return
+        for connection in list(self._connections):
+            connection.close()
+        self.watcher.unwatch(self._watch)
+        for subscription in self._subscriptions.values():
+            subscription.disconnect()
+        self._subscriptions.clear()
+        self._sock.close()
+        self._sock = None
+        removeStaleSocket(self.path)
+
+
+class ControlConnection:
+    """One client of a ControlServer, with non-blocking buffered I/O"""
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.subscribed = False
+        self._input = b""
+        self._output = bytearray()
+        self._readWatch = server.watcher.watch(sock.fileno(), self._readable)
+        self._writeWatch = None
+
+    def send(self, line):
+        if self.sock is None:
+            return
+        self._output += line.encode() + b"\n"
+        if len(self._output) > MAX_BUFFER:
+            log.warning("Dropping a control connection that is not reading")
+            self.close()
+            return
+        self._flush()
+
+    def _readable(self):
+        try:
+            data = self.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            data = b""
+        if not data:
+            self.close()
+            return False
+        self._input += data
+        (*lines, self._input) = self._input.split(b"\n")
+        for line in lines:
+            line = line.decode(errors="replace").strip()
+            if line and self.sock is not None:
+                self.send(self.server.handle(self, line))
+        if len(self._input) > MAX_LINE:
+            self.send("error Request too long")
+            self.close()
+        return self.sock is not None
+
+    def _flush(self):
+        """Send what the socket will take; returns True if some is left"""
+        try:
+            sent = self.sock.send(self._output)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self.close()
+            return False
+        del self._output[:sent]
+        if self._output and self._writeWatch is None:
+            self._writeWatch = self.server.watcher.watch(
+                self.sock.fileno(), self._writable, writable=True
+            )
+        return bool(self._output)
+
+    def _writable(self):
+        if self.sock is None:
+            return False
+        if self._flush():
+            return True
+        self._writeWatch = None
+        return False
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.server.watcher.unwatch(self._readWatch)
+        if self._writeWatch is not None:
+            self.server.watcher.unwatch(self._writeWatch)
+            self._writeWatch = None
+        self.sock.close()
+        self.sock = None
+        self.server._closed(self)
+
+
+def removeStaleSocket(path):
+    """Remove a socket left behind by an earlier run, but nothing else"""
+    try:
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise FileExistsError(f"{path} exists and is not a socket")
+    except FileNotFoundError:
+        return
+    os.unlink(path)
@@ -0,0 +1,71 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import time
+
+# Sleep until this many seconds before a cue is due, then spin for the rest
+SPIN = 0.002
+
+
+class Cue:
+    """A routing change prepared in advance, due at a monotonic deadline"""
+
+    def __init__(self, timestamp, path, source, message, deadline=None):
+        self.timestamp = timestamp
+        self.path = path
+        self.source = source
+        self.message = message
+        if deadline is None:
+            deadline = toMonotonic(timestamp)
+        self.deadline = deadline
+        self.timer = None
+
+
+def toMonotonic(timestamp):
+    """Convert a wall-clock time.time() timestamp to the monotonic clock
+
+    Converting once, when the cue is scheduled, keeps it immune to the
+    wall clock being stepped by NTP afterwards.
+    """
+    return time.monotonic() + (timestamp - time.time())
+
+
+def waitUntil(deadline, spin=SPIN):
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if remaining > spin:
+            time.sleep(remaining - spin)
+
+
+def fire(cue, switch):
+    """Wait for a cue's deadline, then switch; returns the jitter in seconds
+
+    Runs on the device worker, so the precise wait doesn't hold up the main
+    loop.  The jitter is how late the transfer was started, measured
+    against the deadline.
+    """
+    waitUntil(cue.deadline)
+    jitter = time.monotonic() - cue.deadline
+    switch(cue.source, cue.message)
+    return jitter
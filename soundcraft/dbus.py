@@ -20,9 +20,14 @@
 # SOFTWARE.
 
 import argparse
+import logging
+import os
 import shutil
+import signal as posixsignal
 import subprocess
 import sys
+import time
+import xml.etree.ElementTree as ElementTree
 from pathlib import Path
 from string import Template
 
@@ -38,14 +43,113 @@ python-gi, python-gobject, python3-gobject, pygobject, or something similar.
     raise
 gi.require_version("GUdev", "1.0")
 from gi.repository import GLib, GUdev
-from pydbus import SystemBus
+from pydbus import SystemBus, connect
 from pydbus.generic import signal
+from pydbus.proxy import CompositeInterface
 
 import soundcraft
+import soundcraft.control
+import soundcraft.cues
+import soundcraft.metrics
 import soundcraft.notepad
+import soundcraft.osc
+import soundcraft.presets
+import soundcraft.signals
+import soundcraft.state
+import soundcraft.transport
+import soundcraft.worker
+from soundcraft.diagnostics import profiled, setupLogging, timed
 
 
 BUSNAME = "soundcraft.utils.notepad"
+# Seconds to hold routing state changes in memory before writing them out
+STATE_FLUSH_INTERVAL = 2.0
+# Seconds to wait for each device's outstanding USB transfers at shutdown
+SHUTDOWN_TIMEOUT = 1.0
+# Seconds to hold a routing request so a burst of them becomes one transfer
+COALESCE_WINDOW = 0
+# Longest interval, in seconds, that device info polling backs off to
+INFO_POLL_MAX = 60.0
+# Seconds to wait for every device to switch when recalling a scene
+RECALL_TIMEOUT = 5.0
+# Extra seconds a client waits for the outcome of a recall, in case the
+# service goes away meanwhile
+RECALL_GRACE = 1.0
+# Seconds before a cue is due to hand it to the device worker; this covers
+# main loop timer latency, and the worker waits out the rest precisely
+CUE_LEAD = 0.02
+# Seconds between main loop heartbeats, and how late one may be before it
+# counts as a stall, when metrics are enabled
+STALL_INTERVAL = 0.1
+STALL_THRESHOLD = 0.05
+# Seconds to collect property changes and hotplug signals before emitting
+# them together; 0 merges whatever happens within one main loop iteration
+SIGNAL_WINDOW = 0
+
+log = logging.getLogger(__name__)
+
+
+def getBus():
+    """Connect to the system bus, or the private bus in SOUNDCRAFT_BUS_ADDRESS
+
+    The latter lets tests and benchmarks run the service and its clients on
+    a private dbus-daemon without installing any system configuration.
+    """
+    address = os.environ.get("SOUNDCRAFT_BUS_ADDRESS")
+    if address:
+        return connect(address)
+    return SystemBus()
+
+
+# Every published object also implements the standard Properties interface,
+# which pydbus adds on registration rather than listing in our XML
+PROPERTIES_INTERFACE = """
+        <interface name='org.freedesktop.DBus.Properties'>
+          <method name='Get'>
+            <arg name='interface_name' type='s' direction='in'/>
+            <arg name='property_name'  type='s' direction='in'/>
+            <arg name='value'          type='v' direction='out'/>
+          </method>
+          <method name='GetAll'>
+            <arg name='interface_name' type='s'     direction='in'/>
+            <arg name='properties'     type='a{sv}' direction='out'/>
+          </method>
+          <method name='Set'>
+            <arg name='interface_name' type='s' direction='in'/>
+            <arg name='property_name'  type='s' direction='in'/>
+            <arg name='value'          type='v' direction='in'/>
+          </method>
+          <signal name='PropertiesChanged'>
+            <arg name='interface_name'          type='s'/>
+            <arg name='changed_properties'      type='a{sv}'/>
+            <arg name='invalidated_properties'  type='as'/>
+          </signal>
+        </interface>
+"""
+
+_proxyClasses = {}
+
+
+def staticProxy(bus, path, xml):
+    """A proxy for one of our own objects, built from its interface XML
+
+    Unlike bus.get(), this does not introspect the remote object first, so
+    creating it costs no round trip.  Errors such as the service not running
+    surface on the first call instead.
+    """
+    proxyClass = _proxyClasses.get(xml)
+    if proxyClass is None:
+        node = xml.replace("</node>", PROPERTIES_INTERFACE + "</node>")
+        proxyClass = CompositeInterface(ElementTree.fromstring(node))
+        _proxyClasses[xml] = proxyClass
+    return proxyClass(bus, BUSNAME, path)
+
+
+def scheduleOnMainLoop(delay, callback):
+    if delay > 0:
+        GLib.timeout_add(int(delay * 1000), callback)
+    else:
+        GLib.idle_add(callback)
 
 
 class NotepadDbus(object):
@@ -60,45 +164,293 @@ class NotepadDbus(object):
             <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
                         value="true"/>
           </property>
+          <property name='routingStats'  type='a{st}'       access='read'>
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
+                        value="false"/>
+          </property>
+          <property name='sampleRate'    type='u'           access='read'>
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
+                        value="true"/>
+          </property>
+          <property name='sampleRates'   type='a(uuu)'      access='read'>
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
+                        value="true"/>
+          </property>
+          <property name='lastError'     type='s'           access='read'>
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
+                        value="true"/>
+          </property>
         </interface>
       </node>
     """
 
     InterfaceName = "soundcraft.utils.notepad.device"
 
-    def __init__(self, dev):
+    def __init__(self, dev, coalesceWindow=0, infoPoll=0, metrics=None, signalWindow=0):
         self._dev = dev
+        self._metrics = soundcraft.metrics.NULL if metrics is None else metrics
+        self._signals = soundcraft.signals.PropertyBatcher(
+            lambda changed: self.PropertiesChanged(self.InterfaceName, changed, []),
+            scheduleOnMainLoop,
+            signalWindow,
+        )
+        # All USB I/O happens on the worker so a stuck device can't stall
+        # the main loop.  Bursts of routing requests are collapsed so only
+        # the last one is sent; _pending is that most recently requested
+        # source until it reaches the hardware.
+        self._worker = soundcraft.worker.DeviceWorker(name=f"usb-{dev.name}")
+        self._switcher = soundcraft.worker.RoutingCoalescer(
+            self._worker,
+            dev.switchSource,
+            lambda: dev.state.get("source"),
+            window=coalesceWindow,
+        )
+        if dev.session is not None:
+            # Opening the handle can be slow; it's the worker's first job
+            self._worker.submit(dev.session.open)
+        self._pending = None
+        self._future = None
+        self._signalledSource = dev.routingSource
+        self._closed = False
+        # Routing changes complete after the D-Bus call has returned, so
+        # their failures are reported here instead
+        self._lastError = ""
+        # Device info is re-read every infoPoll seconds (0 disables polling),
+        # backing off while it stays the same
+        self._infoInterval = None
+        if infoPoll > 0:
+            self._infoInterval = soundcraft.worker.AdaptiveInterval(
+                infoPoll, max(infoPoll, INFO_POLL_MAX)
+            )
 
     @property
     def name(self):
+        self._counted("name")
         return self._dev.name
 
     @property
     def fixedRouting(self):
+        self._counted("fixedRouting")
         return self._dev.fixedRouting
 
     @property
     def routingTarget(self):
+        self._counted("routingTarget")
         return self._dev.routingTarget
 
     @property
     def sources(self):
+        self._counted("sources")
         return self._dev.sources
 
     @property
     def routingSource(self):
+        self._counted("routingSource")
+        return self._currentSource()
+
+    def _currentSource(self):
+        # What reads report: the pending request, once one is queued
+        if self._pending is not None:
+            return self._pending.name
         return self._dev.routingSource
 
     @routingSource.setter
     def routingSource(self, request):
-        self._dev.routingSource = request
-        self.PropertiesChanged(
-            self.InterfaceName, {"routingSource": self.routingSource}, []
-        )
+        self._metrics.inc("dbus_property_sets_total", property="routingSource")
+        with timed(log, "Set routingSource"):
+            self._requestSource(request)
+
+    def _requestSource(self, request):
+        # Parse synchronously so a bad request is reported to the caller
+        source = self._dev.parseSource(request)
+        future = self._switcher.request(source)
+        if future.done() and self._future is None:
+            # Already the current source; nothing was queued
+            return
+        self._pending = source
+        if future is not self._future:
+            self._future = future
+            future.add_done_callback(lambda f: GLib.idle_add(self._switchDone, f))
+
+    @property
+    def routingStats(self):
+        self._counted("routingStats")
+        return self._switcher.stats()
+
+    @property
+    def sampleRate(self):
+        self._counted("sampleRate")
+        return self._dev.sampleRate
+
+    @property
+    def sampleRates(self):
+        self._counted("sampleRates")
+        return self._dev.sampleRates
+
+    @property
+    def lastError(self):
+        self._counted("lastError")
+        return self._lastError
+
+    def _counted(self, prop):
+        self._metrics.inc("dbus_property_gets_total", property=prop)
+
+    def _setLastError(self, message):
+        if message != self._lastError:
+            self._lastError = message
+            self._signals.update({"lastError": message})
+
+    def pollInfo(self):
+        """Read the device info now, and keep polling it if enabled"""
+        future = self._worker.submit(self._dev.fetchInfo)
+        future.add_done_callback(lambda f: GLib.idle_add(self._infoDone, f))
+        return GLib.SOURCE_REMOVE
+
+    def _infoDone(self, future):
+        if self._closed:
+            return GLib.SOURCE_REMOVE
+        error = future.exception()
+        changed = False
+        if error is not None:
+            log.warning("Could not read info from %s: %s", self._dev.name, error)
+        elif future.result():
+            changed = True
+            self._signals.update(
+                {
+                    "sampleRate": self._dev.sampleRate,
+                    "sampleRates": self._dev.sampleRates,
+                }
+            )
+        if self._infoInterval is not None:
+            interval = self._infoInterval.next(changed)
+            GLib.timeout_add(int(interval * 1000), self.pollInfo)
+        return GLib.SOURCE_REMOVE
+
+    def _switchDone(self, future):
+        if self._closed:
+            return GLib.SOURCE_REMOVE
+        advertised = None
+        if future is self._future:
+            # Reads of routingSource have been answering with this
+            advertised = self._pending.name
+            self._future = None
+            self._pending = None
+        error = future.exception()
+        if error is not None:
+            log.warning("Could not switch %s: %s", self._dev.name, error)
+            self._setLastError(f"Could not switch routing: {error}")
+        else:
+            self._setLastError("")
+        self.signalRouting(advertised)
+        return GLib.SOURCE_REMOVE
+
+    def signalRouting(self, advertised=None):
+        # Only signal what actually reached the hardware, and only when it
+        # differs from what subscribers were last told, or from the pending
+        # value a client may have read and cached meanwhile
+        current = self._dev.routingSource
+        if current != self._signalledSource or (
+            advertised is not None and advertised != current
+        ):
+            self._signalledSource = current
+            self._signals.update({"routingSource": current})
+
+    def recall(self, source):
+        """Switch straight away for a scene recall, bypassing the coalescer
+
+        Returns a Future for the time.monotonic() the switch finished at.
+        Until then routingSource reports the recalled source.
+        """
+        future = self._worker.submit(self._recallSwitch, source)
+        self._pending = source
+        self._future = future
+        future.add_done_callback(lambda f: GLib.idle_add(self._switchDone, f))
+        return future
+
+    def _recallSwitch(self, source):
+        if source != self._dev.state.get("source"):
+            self._dev.switchSource(source)
+        return time.monotonic()
+
+    def resetState(self):
+        if "source" not in self._dev.state:
+            return
+        # The hardware doesn't remember its routing, so this must bypass
+        # the coalescer, which would see nothing to change
+        source = self._dev.parseSource(self._dev.state["source"])
+        future = self._worker.submit(self._dev.switchSource, source)
+        future.add_done_callback(lambda f: GLib.idle_add(self._switchDone, f))
+
+    def close(self, timeout=0):
+        self._closed = True
+        self._worker.submit(self._dev.close)
+        self._worker.stop(timeout)
 
     PropertiesChanged = signal()
 
 
+class LocalDevice:
+    """A NotepadDbus as the control socket and OSC endpoints see it
+
+    Their reads and writes are not D-Bus calls, so they bypass the
+    dbus_property_* metrics.
+    """
+
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+        self.PropertiesChanged = wrapped.PropertiesChanged
+
+    @property
+    def name(self):
+        return self._wrapped._dev.name
+
+    @property
+    def sources(self):
+        return self._wrapped._dev.sources
+
+    @property
+    def routingSource(self):
+        return self._wrapped._currentSource()
+
+    @routingSource.setter
+    def routingSource(self, request):
+        self._wrapped._requestSource(request)
+
+
+class Stats:
+    dbus = """
+      <node>
+        <interface name='soundcraft.utils.notepad.Stats'>
+          <property name='counters'   type='a{sd}'              access='read'>
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
+                        value="false"/>
+          </property>
+          <property name='histograms' type='a{s(tda(dt))}'      access='read'>
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
+                        value="false"/>
+          </property>
+          <method name='Prometheus'>
+            <arg name='text' type='s' direction='out'/>
+          </method>
+        </interface>
+      </node>
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    @property
+    def counters(self):
+        return {k: float(v) for (k, v) in self._registry.counters().items()}
+
+    @property
+    def histograms(self):
+        return self._registry.histograms()
+
+    def Prometheus(self):
+        return self._registry.prometheus()
+
+
 class Service:
     dbus = """
       <node>
@@ -108,12 +460,43 @@ class Service:
             <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
                         value="true"/>
           </property>
+          <property name='presets' type='as' access='read'>
+            <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"
+                        value="true"/>
+          </property>
           <signal name='Added'>
             <arg name='path' type='o'/>
           </signal>
           <signal name='Removed'>
             <arg name='path' type='o'/>
           </signal>
+          <signal name='CueFired'>
+            <arg name='path' type='o'/>
+            <arg name='source' type='s'/>
+            <arg name='timestamp' type='d'/>
+            <arg name='jitter' type='d'/>
+          </signal>
+          <method name='SavePreset'>
+            <arg name='name' type='s' direction='in'/>
+          </method>
+          <method name='DeletePreset'>
+            <arg name='name' type='s' direction='in'/>
+          </method>
+          <signal name='SceneRecalled'>
+            <arg name='recall' type='u'/>
+            <arg name='name' type='s'/>
+            <arg name='timings' type='a{od}'/>
+            <arg name='errors' type='a{os}'/>
+          </signal>
+          <method name='RecallScene'>
+            <arg name='name' type='s' direction='in'/>
+            <arg name='recall' type='u' direction='out'/>
+          </method>
+          <method name='ScheduleCues'>
+            <arg name='cues' type='a(dos)' direction='in'/>
+            <arg name='scheduled' type='u' direction='out'/>
+          </method>
+          <method name='CancelCues'/>
           <method name='Shutdown'/>
         </interface>
       </node>
@@ -123,19 +506,105 @@ class Service:
     PropertiesChanged = signal()
     Added = signal()
     Removed = signal()
-
-    def __init__(self):
-        self.object = None
-        self.bus = SystemBus()
-        self.udev = GUdev.Client(subsystems=["usb/usb_device"])
-        self.udev.connect("uevent", self.uevent)
+    CueFired = signal()
+    SceneRecalled = signal()
+
+    def __init__(
+        self,
+        flushInterval=STATE_FLUSH_INTERVAL,
+        coalesceWindow=COALESCE_WINDOW,
+        stateDir=soundcraft.notepad.DEFAULT_STATEDIR,
+        infoPoll=0,
+        metrics=False,
+        metricsPort=None,
+        controlSocket=None,
+        controlMode=soundcraft.control.DEFAULT_MODE,
+        oscPort=None,
+        oscHost="127.0.0.1",
+        signalWindow=SIGNAL_WINDOW,
+    ):
+        self.stateDir = stateDir
+        self.flushInterval = flushInterval
+        self.coalesceWindow = coalesceWindow
+        self.infoPoll = infoPoll
+        self.signalWindow = signalWindow
+        self._signals = soundcraft.signals.PropertyBatcher(
+            lambda changed: self.PropertiesChanged(self.InterfaceName, changed, []),
+            scheduleOnMainLoop,
+            signalWindow,
+        )
+        self._membership = soundcraft.signals.MembershipBatcher(
+            self.Added, self.Removed, scheduleOnMainLoop, signalWindow
+        )
+        # Published devices, keyed by object path index
+        self.objects = {}
+        # (busnum, devnum) -> index, for O(1) lookup on udev removal
+        self._byAddress = {}
+        # serial number (or port path) -> index; kept after removal so a
+        # device that is plugged back in reappears at the same object path
+        self._bySerial = {}
+        self._nextIndex = 0
+        # Cues waiting for their timer
+        self._cues = set()
+        # Recalls in progress: ID -> timeout source
+        self._recalls = {}
+        self._lastRecall = 0
+        self._presets = soundcraft.presets.PresetStore(
+            None if stateDir is None else f"{stateDir}/presets.json"
+        )
+        if stateDir is not None:
+            # Load every device's saved state in one go, up front
+            soundcraft.state.openStore(stateDir, flushInterval)
+        self.bus = getBus()
+        self.transport = soundcraft.transport.get()
+        if self.transport.hotplug is None:
+            self.udev = GUdev.Client(subsystems=["usb/usb_device"])
+            self.udev.connect("uevent", self.uevent)
+        else:
+            self.udev = None
+            self.transport.hotplug.connect(self.simulatedHotplug)
         self.loop = GLib.MainLoop()
         self.busname = self.bus.publish(BUSNAME, self)
+        self.metrics = soundcraft.metrics.NULL
+        self._prometheus = None
+        if metrics or metricsPort:
+            self.enableMetrics(metricsPort)
+        # Other ways in to the published devices: the control socket, OSC
+        self._endpoints = []
+        if controlSocket:
+            self._endpoints.append(
+                soundcraft.control.ControlServer(
+                    controlSocket, GLibWatcher(), controlMode
+                )
+            )
+        if oscPort:
+            self._endpoints.append(
+                soundcraft.osc.OscServer(oscPort, GLibWatcher(), oscHost)
+            )
+
+    def enableMetrics(self, port=None):
+        self.metrics = soundcraft.metrics.Registry()
+        self._stats = self.bus.register_object(
+            self.objPath("stats"), Stats(self.metrics), None
+        )
+        self._stallDetector = soundcraft.metrics.StallDetector(
+            self.metrics, STALL_INTERVAL, STALL_THRESHOLD
+        )
+        GLib.timeout_add(int(STALL_INTERVAL * 1000), self._heartbeat)
+        if port:
+            self._prometheus = soundcraft.metrics.servePrometheus(self.metrics, port)
+            log.info("Serving metrics on http://127.0.0.1:%d/metrics", port)
+
+    def _heartbeat(self):
+        self._stallDetector.tick()
+        return GLib.SOURCE_CONTINUE
 
     def run(self):
+        for signum in (posixsignal.SIGINT, posixsignal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, self._onSignal)
         self.tryRegister()
         if not self.hasDevice():
-            print("Waiting for one to arrive...")
+            log.info("Waiting for one to arrive...")
         self.loop.run()
 
     @property
@@ -144,76 +613,336 @@ class Service:
 
     @property
     def devices(self):
-        if self.hasDevice():
-            return [self.object._path]
-        return []
+        return [self.objects[idx]._path for idx in sorted(self.objects)]
+
+    @property
+    def presets(self):
+        return self._presets.names()
+
+    def SavePreset(self, name):
+        routing = {}
+        for obj in self.objects.values():
+            dev = obj._wrapped._dev
+            if "source" in dev.state:
+                routing[dev.stateKey] = dev.routingSource
+        if not routing:
+            raise ValueError("No device has a known routing to save")
+        self._presets.save(name, routing)
+        log.info("Saved preset %s for %d device(s)", name, len(routing))
+        self._signals.update({"presets": self.presets})
+
+    def DeletePreset(self, name):
+        self._presets.delete(name)
+        self._signals.update({"presets": self.presets})
+
+    def RecallScene(self, name):
+        """Start switching every device in a preset; returns the recall's ID
+
+        The devices switch in parallel, and SceneRecalled reports the
+        outcome under the same ID once they all have, or after
+        RECALL_TIMEOUT.  The main loop carries on meanwhile.
+        """
+        with timed(log, f"RecallScene {name}"):
+            return self._recallScene(name)
+
+    def _recallScene(self, name):
+        routing = self._presets.get(name)
+        targets = []
+        # Validate the whole scene before touching any device
+        for obj in self.objects.values():
+            wrapped = obj._wrapped
+            key = wrapped._dev.stateKey
+            if key not in routing:
+                continue
+            targets.append((obj._path, wrapped, wrapped._dev.parseSource(routing[key])))
+        if not targets:
+            raise ValueError(f"None of the devices in preset {name} are connected")
+        self._lastRecall += 1
+        recallId = self._lastRecall
+        recall = soundcraft.presets.Recall(
+            {path: wrapped.recall(source) for (path, wrapped, source) in targets},
+            time.monotonic(),
+            GLib.idle_add,
+            lambda timings, errors: self._sceneRecalled(
+                recallId, name, timings, errors
+            ),
+        )
+        self._recalls[recallId] = GLib.timeout_add(
+            int(RECALL_TIMEOUT * 1000), self._recallExpired, recallId, recall
+        )
+        return recallId
+
+    def _recallExpired(self, recallId, recall):
+        del self._recalls[recallId]
+        recall.expire(RECALL_TIMEOUT)
+        return GLib.SOURCE_REMOVE
+
+    def _sceneRecalled(self, recallId, name, timings, errors):
+        timer = self._recalls.pop(recallId, None)
+        if timer is not None:
+            GLib.source_remove(timer)
+        for (path, error) in errors.items():
+            log.warning("Could not recall %s on %s: %s", name, path, error)
+        if not errors:
+            log.info("Recalled preset %s on %d device(s)", name, len(timings))
+        self.SceneRecalled(
+            recallId,
+            name,
+            timings,
+            {path: str(error) for (path, error) in errors.items()},
+        )
+
+    def _wrappedByPath(self, path):
+        for obj in self.objects.values():
+            if obj._path == path:
+                return obj._wrapped
+        raise ValueError(f"No device at {path}")
+
+    def ScheduleCues(self, cues):
+        """Schedule (timestamp, device path, source) routing changes
+
+        Timestamps are seconds since the epoch, like time.time().  The
+        whole list is validated before anything is scheduled.
+        """
+        with timed(log, f"ScheduleCues of {len(cues)}"):
+            return self._scheduleCues(cues)
+
+    def _scheduleCues(self, cues):
+        prepared = []
+        for (timestamp, path, request) in cues:
+            wrapped = self._wrappedByPath(path)
+            source = wrapped._dev.parseSource(request)
+            message = wrapped._dev.routingMessage(source)
+            prepared.append(
+                (wrapped, soundcraft.cues.Cue(timestamp, path, source, message))
+            )
+        for (wrapped, cue) in prepared:
+            delay = max(0, cue.deadline - CUE_LEAD - time.monotonic())
+            cue.timer = GLib.timeout_add(int(delay * 1000), self._cueDue, wrapped, cue)
+            self._cues.add(cue)
+        return len(prepared)
+
+    def CancelCues(self):
+        for cue in self._cues:
+            GLib.source_remove(cue.timer)
+        log.info("Cancelled %d cue(s)", len(self._cues))
+        self._cues.clear()
+
+    def _cueDue(self, wrapped, cue):
+        self._cues.discard(cue)
+        # Straight to the worker: cues must not wait out a coalesce window
+        future = wrapped._worker.submit(
+            soundcraft.cues.fire, cue, wrapped._dev.switchSource
+        )
+        future.add_done_callback(
+            lambda f: GLib.idle_add(self._cueFired, wrapped, cue, f)
+        )
+        return GLib.SOURCE_REMOVE
+
+    def _cueFired(self, wrapped, cue, future):
+        if wrapped._closed:
+            return GLib.SOURCE_REMOVE
+        wrapped.signalRouting()
+        error = future.exception()
+        if error is not None:
+            log.warning("Cue for %s at %s failed: %s", cue.path, cue.timestamp, error)
+        else:
+            self.CueFired(cue.path, cue.source.name, cue.timestamp, future.result())
+        return GLib.SOURCE_REMOVE
 
     def Shutdown(self):
-        print("Shutting down")
-        self.unregister()
+        log.info("Shutting down")
+        self.CancelCues()
+        # Give in-flight transfers a moment to finish and save their state
+        self.unregisterAll(timeout=SHUTDOWN_TIMEOUT)
+        # Deliver the final state before the loop stops running
+        self._membership.flush()
+        self._signals.flush()
+        self._presets.close()
+        for endpoint in self._endpoints:
+            endpoint.close()
+        if self._prometheus is not None:
+            self._prometheus.shutdown()
+            self._prometheus.server_close()
         self.loop.quit()
 
+    def _onSignal(self):
+        # Make sure pending state is saved when stopped by systemd or ^C
+        self.Shutdown()
+        return GLib.SOURCE_REMOVE
+
     def objPath(self, idx):
         return f"/soundcraft/utils/notepad/{idx}"
 
+    def _allocateIndex(self, dev):
+        key = dev.stateKey
+        idx = self._bySerial.get(key)
+        if idx is None or idx in self.objects:
+            idx = self._nextIndex
+            self._nextIndex += 1
+            self._bySerial.setdefault(key, idx)
+        return idx
+
     def tryRegister(self):
-        if self.hasDevice():
-            print(
-                f"There is already a {self.object._wrapped._dev.name} on the bus at {self.object._path}"
-            )
-            return
-        dev = soundcraft.notepad.autodetect()
-        if dev is None:
-            print("No recognised device was found")
+        found = soundcraft.notepad.detectAll(
+            ignore=self._byAddress,
+            stateDir=self.stateDir,
+            flushInterval=self.flushInterval,
+            transport=self.transport,
+            openSession=False,
+        )
+        if not found:
+            if not self.hasDevice():
+                log.info("No recognised device was found")
             return
-        # Reset any stored state
-        dev.resetState()
-        path = self.objPath(0)
-        wrapped = NotepadDbus(dev)
-        self.object = self.bus.register_object(path, wrapped, None)
-        self.object._wrapped = wrapped
-        self.object._path = path
-        print(
-            f"Presenting {self.object._wrapped._dev.name} on the system bus as {path}"
+        for dev in found:
+            self._membership.added(self.register(dev))
+        self._signals.update({"devices": self.devices})
+
+    def register(self, dev):
+        idx = self._allocateIndex(dev)
+        path = self.objPath(idx)
+        if self.metrics is not soundcraft.metrics.NULL:
+            dev.dev = soundcraft.metrics.InstrumentedDevice(
+                dev.dev, self.metrics, dev.stateKey
+            )
+        wrapped = NotepadDbus(
+            dev,
+            coalesceWindow=self.coalesceWindow,
+            infoPoll=self.infoPoll,
+            metrics=self.metrics,
+            signalWindow=self.signalWindow,
         )
-        self.Added(path)
-        self.PropertiesChanged(self.InterfaceName, {"devices": self.devices}, [])
+        # Reset any stored state
+        wrapped.resetState()
+        wrapped.pollInfo()
+        obj = self.bus.register_object(path, wrapped, None)
+        obj._wrapped = wrapped
+        obj._path = path
+        self.objects[idx] = obj
+        self._byAddress[(dev.dev.bus, dev.dev.address)] = idx
+        for endpoint in self._endpoints:
+            endpoint.addDevice(idx, LocalDevice(wrapped))
+        log.info("Presenting %s on the system bus as %s", dev.name, path)
+        return path
 
     def hasDevice(self):
-        return self.object is not None
+        return len(self.objects) > 0
 
-    def unregister(self):
-        if not self.hasDevice():
-            return
-        path = self.object._path
-        print(
-            f"Removed {self.object._wrapped._dev.name} AKA {path} from the system bus"
+    def unregister(self, idx, timeout=0):
+        obj = self.objects.pop(idx, None)
+        if obj is None:
+            return None
+        usbdev = obj._wrapped._dev.dev
+        del self._byAddress[(usbdev.bus, usbdev.address)]
+        log.info(
+            "Removed %s AKA %s from the system bus", obj._wrapped._dev.name, obj._path
         )
-        self.object.unregister()
-        self.object = None
-        self.PropertiesChanged(self.InterfaceName, {"devices": self.devices}, [])
-        self.Removed(path)
+        obj.unregister()
+        for endpoint in self._endpoints:
+            endpoint.removeDevice(idx)
+        self._dropCues(obj._path)
+        obj._wrapped.close(timeout)
+        return obj._path
+
+    def _dropCues(self, path):
+        # Their device is gone; the ones already on its worker still finish
+        dropped = [cue for cue in self._cues if cue.path == path]
+        for cue in dropped:
+            GLib.source_remove(cue.timer)
+            self._cues.discard(cue)
+        if dropped:
+            log.info("Dropped %d cue(s) for %s", len(dropped), path)
+
+    def unregisterAll(self, timeout=0):
+        removed = [self.unregister(idx, timeout) for idx in list(self.objects)]
+        if not removed:
+            return
+        self._signals.update({"devices": self.devices})
+        for path in removed:
+            self._membership.removed(path)
 
     def uevent(self, observer, action, device):
+        if action not in ("add", "remove"):
+            return
+        self.metrics.inc("hotplug_events_total", action=action)
+        # UDEV adds leading 0s to decimal numbers.  They're not octal.  Why??
+        busnum = int(device.get_property("BUSNUM"), 10)
+        devnum = int(device.get_property("DEVNUM"), 10)
         if action == "add":
             idVendor = int(device.get_property("ID_VENDOR_ID"), 16)
             idProduct = int(device.get_property("ID_PRODUCT_ID"), 16)
-            if idVendor == soundcraft.notepad.HARMAN_USB:
-                print(
-                    f"Checking new Soundcraft device ({idVendor:0>4x}:{idProduct:0>4x})..."
+            self.hotplugAdd(idVendor, idProduct, busnum, devnum)
+        else:
+            self.hotplugRemove(busnum, devnum)
+
+    def simulatedHotplug(self, action, dev):
+        # Simulator callbacks may come from any thread
+        self.metrics.inc("hotplug_events_total", action=action)
+        if action == "add":
+            GLib.idle_add(
+                self.hotplugAdd, dev.idVendor, dev.idProduct, dev.bus, dev.address
+            )
+        elif action == "remove":
+            GLib.idle_add(self.hotplugRemove, dev.bus, dev.address)
+
+    def hotplugAdd(self, idVendor, idProduct, busnum=None, devnum=None):
+        if idVendor == soundcraft.notepad.HARMAN_USB:
+            log.info(
+                "Checking new Soundcraft device (%04x:%04x)...", idVendor, idProduct
+            )
+            if idProduct not in soundcraft.notepad.DEVICES:
+                log.warning(
+                    "Contact the developer for help adding support for your device"
                 )
+                return GLib.SOURCE_REMOVE
+            if busnum is None:
                 self.tryRegister()
-                if not self.hasDevice():
-                    print(
-                        "Contact the developer for help adding support for your device"
-                    )
-        elif action == "remove" and self.hasDevice():
-            # UDEV adds leading 0s to decimal numbers.  They're not octal.  Why??
-            busnum = int(device.get_property("BUSNUM"), 10)
-            devnum = int(device.get_property("DEVNUM"), 10)
-            objectdev = self.object._wrapped._dev.dev
-            if busnum == objectdev.bus and devnum == objectdev.address:
-                self.unregister()
+            elif (busnum, devnum) not in self._byAddress:
+                self.attach(idProduct, busnum, devnum)
+        return GLib.SOURCE_REMOVE
+
+    def attach(self, idProduct, busnum, devnum):
+        """Register just the device a hotplug event is about, without a rescan"""
+        dev = soundcraft.notepad.attach(
+            idProduct,
+            busnum,
+            devnum,
+            stateDir=self.stateDir,
+            flushInterval=self.flushInterval,
+            transport=self.transport,
+            openSession=False,
+        )
+        if dev is None:
+            # Not visible at that address (yet); fall back to a full scan
+            self.tryRegister()
+            return
+        self._membership.added(self.register(dev))
+        self._signals.update({"devices": self.devices})
+
+    def hotplugRemove(self, busnum, devnum):
+        idx = self._byAddress.get((busnum, devnum))
+        if idx is None:
+            return GLib.SOURCE_REMOVE
+        self._membership.removed(self.unregister(idx))
+        self._signals.update({"devices": self.devices})
+        return GLib.SOURCE_REMOVE
+
+
+class GLibWatcher:
+    """Runs ControlServer and OscServer socket callbacks from the main loop"""
+
+    def watch(self, fd, callback, writable=False):
+        if writable:
+            condition = GLib.IO_OUT
+        else:
+            condition = GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR
+        return GLib.io_add_watch(
+            fd, GLib.PRIORITY_DEFAULT, condition, lambda fd, condition: callback()
+        )
+
+    def unwatch(self, handle):
+        GLib.source_remove(handle)
 
 
 def findDataFiles(subdir):
@@ -356,40 +1085,172 @@ class DbusServiceSetupError(DbusInitializationError):
         )
 
 
+class DeviceProxy:
+    """Client-side view of a published device
+
+    All properties are fetched with a single GetAll call and served from
+    that snapshot, which is kept up to date from PropertiesChanged (when a
+    main loop is running) instead of making a D-Bus round trip per read.
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._path = proxy._path
+        self._props = {}
+        self._stale = True
+        self._subscription = proxy.PropertiesChanged.connect(self._propertiesChanged)
+        self.refresh()
+
+    def refresh(self):
+        properties = self._proxy["org.freedesktop.DBus.Properties"]
+        self._props = properties.GetAll(NotepadDbus.InterfaceName)
+        self._stale = False
+
+    def _get(self, name):
+        if self._stale:
+            self.refresh()
+        return self._props[name]
+
+    @property
+    def name(self):
+        return self._get("name")
+
+    @property
+    def fixedRouting(self):
+        return self._get("fixedRouting")
+
+    @property
+    def routingTarget(self):
+        return self._get("routingTarget")
+
+    @property
+    def sources(self):
+        return self._get("sources")
+
+    @property
+    def routingSource(self):
+        return self._get("routingSource")
+
+    @routingSource.setter
+    def routingSource(self, request):
+        self._proxy.routingSource = request
+        # The service resolves the request and signals the result, which
+        # updates the snapshot when a main loop runs.  Without one, the next
+        # read fetches it instead; either way this costs no extra round trip.
+        self._stale = True
+
+    @property
+    def routingStats(self):
+        # Counters change on every request without a signal; always re-read
+        return self._proxy.routingStats
+
+    @property
+    def sampleRate(self):
+        return self._get("sampleRate")
+
+    @property
+    def sampleRates(self):
+        return self._get("sampleRates")
+
+    @property
+    def lastError(self):
+        return self._get("lastError")
+
+    PropertiesChanged = signal()
+
+    @property
+    def onPropertiesChanged(self):
+        return getattr(self, "_onPropertiesChanged", None)
+
+    @onPropertiesChanged.setter
+    def onPropertiesChanged(self, callback):
+        old = getattr(self, "_onPropertiesSubscription", None)
+        if old is not None:
+            old.disconnect()
+        self._onPropertiesChanged = callback
+        self._onPropertiesSubscription = None
+        if callback is not None:
+            self._onPropertiesSubscription = self.PropertiesChanged.connect(callback)
+
+    def _propertiesChanged(self, interface, changed, invalidated):
+        if interface != NotepadDbus.InterfaceName:
+            return
+        self._props.update(changed)
+        if invalidated:
+            self._stale = True
+        self.PropertiesChanged(interface, changed, invalidated)
+
+    def close(self):
+        if self._subscription is not None:
+            self._subscription.disconnect()
+            self._subscription = None
+
+
 class Client:
     MGRPATH = "/soundcraft/utils/notepad"
 
     def __init__(self, added_cb=None, removed_cb=None):
-        self.bus = SystemBus()
-        self.dbusmgr = self.bus.get(".DBus")
-        self.dbusmgr.onNameOwnerChanged = self._nameChanged
+        self.bus = getBus()
+        self._dbusmgr = None
+        self._nameSubscription = self.bus.subscribe(
+            sender="org.freedesktop.DBus",
+            iface="org.freedesktop.DBus",
+            signal="NameOwnerChanged",
+            arg0=BUSNAME,
+            signal_fired=lambda sender, path, iface, name, args: self._nameChanged(
+                *args
+            ),
+        )
         self.manager = None
+        self._versionChecked = False
         self.initManager()
-        self.ensureServiceVersion(allowRestart=True)
         if removed_cb is not None:
             self.deviceRemoved.connect(removed_cb)
         if added_cb is not None:
             self.deviceAdded.connect(added_cb)
-            self.autodetect()
+            # Announce every device that is already there, not just the first
+            for proxyDevice in self.devices():
+                self.deviceAdded(proxyDevice)
 
     def initManager(self):
+        self.manager = staticProxy(self.bus, self.MGRPATH, Service.dbus)
+        self.manager.onAdded = self._onAdded
+        self.manager.onRemoved = self._onRemoved
+
+    @property
+    def dbusmgr(self):
+        # Only needed to report the service's PID
+        if self._dbusmgr is None:
+            self._dbusmgr = self.bus.get(".DBus")
+        return self._dbusmgr
+
+    def servicePid(self):
+        return self.dbusmgr.GetConnectionUnixProcessID(BUSNAME)
+
+    def serviceVersion(self):
         try:
-            self.manager = self.bus.get(BUSNAME, self.MGRPATH)
-            self.manager.onAdded = self._onAdded
-            self.manager.onRemoved = self._onRemoved
+            return self.manager.version
         except Exception as e:
-            if "org.freedesktop.DBus.Error.ServiceUnknown" in e.message:
+            if "org.freedesktop.DBus.Error.ServiceUnknown" in getattr(e, "message", ""):
                 raise DbusServiceSetupError()
             raise e
 
-    def servicePid(self):
-        return self.dbusmgr.GetConnectionUnixProcessID(BUSNAME)
+    def _manager(self):
+        """The manager proxy, once the service is known to be compatible"""
+        if not self._versionChecked:
+            self.ensureServiceVersion(allowRestart=True)
+            self._versionChecked = True
+        return self.manager
 
-    def serviceVersion(self):
-        return self.manager.version
+    def checkService(self):
+        """Make sure the service is running and compatible, now rather than on first use"""
+        self._manager()
 
     def _canShutdown(self):
-        return callable(getattr(self.manager, "Shutdown", None))
+        # Ask the running service rather than our own interface definition,
+        # since older versions had no Shutdown
+        remote = self.bus.get(BUSNAME, self.MGRPATH)
+        return callable(getattr(remote, "Shutdown", None))
 
     def ensureServiceVersion(self, allowRestart=False):
         mgrVersion = self.serviceVersion()
@@ -404,12 +1265,15 @@ class Client:
                 self.ensureServiceVersion(allowRestart=False)
 
     def restartService(self, mgrVersion, localVersion):
-        print(
-            f"Restarting soundcraft D-Bus service ({self.servicePid()}) to upgrade {mgrVersion}->{localVersion}"
+        log.warning(
+            "Restarting soundcraft D-Bus service (%s) to upgrade %s->%s",
+            self.servicePid(),
+            mgrVersion,
+            localVersion,
         )
         self.shutdown()
         self.initManager()
-        print(f"Restarted the service at {self.servicePid()}")
+        log.warning("Restarted the service at %s", self.servicePid())
 
     def shutdown(self):
         loop = GLib.MainLoop()
@@ -425,30 +1289,89 @@ class Client:
         if busname != BUSNAME:
             return
         if old == "":
-            print(f"New {busname} connected")
+            log.info("New %s connected", busname)
             self.serviceConnected()
         elif new == "":
-            print(f"{busname} service disconnected")
+            log.info("%s service disconnected", busname)
+            # Whatever replaces it needs checking again
+            self._versionChecked = False
             self.serviceDisconnected()
 
     def autodetect(self):
-        devices = self.manager.devices
+        devices = self._manager().devices
         if not devices:
             return None
-        proxyDevice = self.bus.get(BUSNAME, devices[0])
+        proxyDevice = self.getDevice(devices[0])
         self.deviceAdded(proxyDevice)
         return proxyDevice
 
+    def getDevice(self, path):
+        return DeviceProxy(staticProxy(self.bus, path, NotepadDbus.dbus))
+
+    def devices(self):
+        """Proxies for every published device"""
+        return [self.getDevice(path) for path in self._manager().devices]
+
+    def presets(self):
+        return self._manager().presets
+
+    def savePreset(self, name):
+        self._manager().SavePreset(name)
+
+    def deletePreset(self, name):
+        self._manager().DeletePreset(name)
+
+    def recallScene(self, name):
+        """Apply a saved preset; returns the seconds each device took"""
+        manager = self._manager()
+        loop = GLib.MainLoop()
+        results = {}
+        expired = []
+
+        def recalled(recallId, recalledName, timings, errors):
+            results[recallId] = (timings, errors)
+            loop.quit()
+
+        def expire():
+            expired.append(True)
+            loop.quit()
+            return GLib.SOURCE_REMOVE
+
+        with manager.SceneRecalled.connect(recalled):
+            recallId = manager.RecallScene(name)
+            timer = GLib.timeout_add(
+                int((RECALL_TIMEOUT + RECALL_GRACE) * 1000), expire
+            )
+            while recallId not in results and not expired:
+                loop.run()
+            if not expired:
+                GLib.source_remove(timer)
+        if recallId not in results:
+            raise TimeoutError(f"The service did not finish recalling {name}")
+        (timings, errors) = results[recallId]
+        if errors:
+            raise RuntimeError(f"Preset {name} failed on {', '.join(sorted(errors))}")
+        return timings
+
+    def scheduleCues(self, cues):
+        """Schedule a list of (timestamp, device path, source) routing changes"""
+        return self._manager().ScheduleCues(
+            [(float(t), p, str(s)) for (t, p, s) in cues]
+        )
+
+    def cancelCues(self):
+        self._manager().CancelCues()
+
     def waitForDevice(self):
         loop = GLib.MainLoop()
-        with self.manager.Added.connect(lambda path: loop.quit()):
+        with self._manager().Added.connect(lambda path: loop.quit()):
             loop.run()
         return self.autodetect()
 
     deviceAdded = signal()
 
     def _onAdded(self, path):
-        proxyDevice = self.bus.get(BUSNAME, path)
+        proxyDevice = self.getDevice(path)
         self.deviceAdded(proxyDevice)
 
     deviceRemoved = signal()
@@ -474,11 +1397,110 @@ def main():
         help="Remove any setup performed by --setup",
         action="store_true",
     )
+    parser.add_argument(
+        "--state-flush-interval",
+        help=f"Seconds to batch up routing state changes before saving them to disk (default {STATE_FLUSH_INTERVAL}, 0 saves immediately)",
+        type=float,
+        default=STATE_FLUSH_INTERVAL,
+    )
+    parser.add_argument(
+        "--coalesce-window",
+        help="Seconds to wait for more routing requests before sending the latest one to the device (default 0: only merge requests that queue up behind a transfer)",
+        type=float,
+        default=COALESCE_WINDOW,
+    )
+    parser.add_argument(
+        "--signal-window",
+        help="Seconds to collect property changes and hotplug signals before emitting only their final state (default 0: merge what happens within one main loop iteration)",
+        type=float,
+        default=SIGNAL_WINDOW,
+    )
+    parser.add_argument(
+        "--state-dir",
+        help=f"Directory to save device routing state in (default {soundcraft.notepad.DEFAULT_STATEDIR})",
+        default=soundcraft.notepad.DEFAULT_STATEDIR,
+    )
+    parser.add_argument(
+        "--info-poll",
+        help=f"Seconds between re-reading device info such as the sample rate, backing off to {INFO_POLL_MAX:g}s while it is unchanged (default 0: only read it when a device is added)",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--usb-timeout",
+        help=f"Milliseconds to wait for each USB control transfer (default {soundcraft.transport.defaultPolicy().timeout})",
+        type=int,
+        default=soundcraft.transport.defaultPolicy().timeout,
+    )
+    parser.add_argument(
+        "--usb-retries",
+        help=f"Times to retry a USB control transfer that stalled or timed out, with exponential backoff (default {soundcraft.transport.defaultPolicy().retries})",
+        type=int,
+        default=soundcraft.transport.defaultPolicy().retries,
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="MODE[:FILE]",
+        help="Profile the service until it stops, with MODE 'cprofile' or 'tracemalloc', saving the results to FILE (default: in the temporary directory).  Also settable with SOUNDCRAFT_PROFILE",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Collect USB latency, error, D-Bus call and main loop stall metrics, readable through the soundcraft.utils.notepad.Stats interface",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="Also serve the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics (implies --metrics)",
+        type=int,
+    )
+    parser.add_argument(
+        "--control-socket",
+        metavar="PATH",
+        help="Also accept get/set/list/subscribe requests on a Unix socket at PATH; see soundcraft/control.py for the protocol",
+    )
+    parser.add_argument(
+        "--control-socket-mode",
+        metavar="MODE",
+        help="Octal permissions of the control socket, which decide who may use it (default %(default)s)",
+        type=lambda mode: int(mode, 8),
+        default=oct(soundcraft.control.DEFAULT_MODE)[2:],
+    )
+    parser.add_argument(
+        "--osc-port",
+        metavar="PORT",
+        help="Also accept OSC routing messages such as /notepad/0/source on UDP port PORT",
+        type=int,
+    )
+    parser.add_argument(
+        "--osc-host",
+        metavar="ADDRESS",
+        help="Address to receive OSC on (default %(default)s; use 0.0.0.0 for every interface)",
+        default="127.0.0.1",
+    )
     args = parser.parse_args()
+    setupLogging()
     if args.setup:
         setup()
     elif args.uninstall:
         uninstall()
     else:
-        service = Service()
-        service.run()
+        soundcraft.transport.setDefaultPolicy(
+            soundcraft.transport.TransferPolicy(
+                timeout=args.usb_timeout, retries=args.usb_retries
+            )
+        )
+        with profiled(args.profile, "soundcraft_dbus_service"):
+            service = Service(
+                flushInterval=args.state_flush_interval,
+                coalesceWindow=args.coalesce_window,
+                signalWindow=args.signal_window,
+                stateDir=args.state_dir,
+                infoPoll=args.info_poll,
+                metrics=args.metrics,
+                metricsPort=args.metrics_port,
+                controlSocket=args.control_socket,
+                controlMode=args.control_socket_mode,
+                oscPort=args.osc_port,
+                oscHost=args.osc_host,
+            )
+            service.run()
@@ -0,0 +1,75 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+class DeviceModel:
+    """The GUI's own copy of a device's properties
+
+    Taken from the proxy's snapshot once, then kept current only from
+    PropertiesChanged, so widgets can read it freely without a D-Bus round
+    trip on the GTK main loop.  Setting the source is the only call made,
+    and routingSource only changes once the device has confirmed it.
+    """
+
+    PROPERTIES = (
+        "name",
+        "fixedRouting",
+        "routingTarget",
+        "sources",
+        "routingSource",
+        "lastError",
+    )
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.path = dev._path
+        self.values = {name: getattr(dev, name) for name in self.PROPERTIES}
+        self._listeners = []
+        dev.onPropertiesChanged = self._propertiesChanged
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    @property
+    def layout(self):
+        """Everything a device page is built from, apart from the name"""
+        return (self["fixedRouting"], self["routingTarget"], self["sources"])
+
+    def watch(self, callback):
+        """Call callback(changed) after properties change"""
+        self._listeners.append(callback)
+
+    def _propertiesChanged(self, interface, changed, invalidated):
+        # The service always sends new values, never just invalidations
+        changed = {k: v for (k, v) in changed.items() if k in self.values}
+        if not changed:
+            return
+        self.values.update(changed)
+        for callback in list(self._listeners):
+            callback(changed)
+
+    def requestSource(self, source):
+        self.dev.routingSource = source
+
+    def close(self):
+        self._listeners.clear()
+        self.dev.onPropertiesChanged = None
+        self.dev.close()
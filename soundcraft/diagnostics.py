@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Logging setup, timing spans and opt-in profiling
+
+Every module logs to its own logging.getLogger(__name__).  The programs
+call setupLogging() once; SOUNDCRAFT_LOG_LEVEL (e.g. DEBUG) overrides the
+default level.
+
+Profiling is enabled with --profile or SOUNDCRAFT_PROFILE, set to
+'cprofile' or 'tracemalloc', optionally followed by ':<output file>'.
+"""
+
+import contextlib
+import cProfile
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+log = logging.getLogger(__name__)
+
+
+def setupLogging(level=logging.INFO):
+    level = os.environ.get("SOUNDCRAFT_LOG_LEVEL", level)
+    if isinstance(level, str):
+        level = level.upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+class timed:
+    """Context manager that logs how long its block took, at DEBUG level
+
+    Costs a single isEnabledFor() check when DEBUG logging is off.
+    """
+
+    def __init__(self, logger, what):
+        self.logger = logger
+        self.what = what
+        self.start = None
+
+    def __enter__(self):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        if self.start is not None:
+            elapsed = (time.perf_counter() - self.start) * 1000
+            outcome = "failed after" if excType is not None else "took"
+            self.logger.debug("%s %s %.3fms", self.what, outcome, elapsed)
+
+
+def _outputPath(mode, prog, path):
+    if path:
+        return path
+    suffix = "prof" if mode == "cprofile" else "tracemalloc"
+    return os.path.join(tempfile.gettempdir(), f"{prog}-{os.getpid()}.{suffix}")
+
+
+@contextlib.contextmanager
+def profiled(spec=None, prog="soundcraft"):
+    """Profile the enclosed block if spec (or SOUNDCRAFT_PROFILE) asks for it
+
+    cProfile statistics are saved for use with pstats or snakeviz; a
+    tracemalloc snapshot is saved for tracemalloc.Snapshot.load(), and its
+    biggest allocation sites are logged.
+    """
+    if spec is None:
+        spec = os.environ.get("SOUNDCRAFT_PROFILE")
+    if not spec:
+        yield
+        return
+    (mode, _, path) = spec.partition(":")
+    if mode not in ("cprofile", "tracemalloc"):
+        raise ValueError(f"Unknown profiling mode {mode}")
+    path = _outputPath(mode, prog, path)
+    if mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+            log.warning("Saved cProfile statistics to %s", path)
+    else:
+        tracemalloc.start(25)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(path)
+            log.warning("Saved tracemalloc snapshot to %s", path)
+            for stat in snapshot.statistics("lineno")[:10]:
+                log.warning("  %s", stat)
@@ -19,8 +19,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import logging
 import sys
-import traceback
 from pathlib import Path
 from collections.abc import Iterable
 
@@ -42,6 +42,10 @@ from gi.repository import Gio
 import soundcraft
 import soundcraft.contributors
 from soundcraft.dbus import Client, DbusInitializationError, VersionIncompatibilityError
+from soundcraft.devicemodel import DeviceModel
+from soundcraft.diagnostics import profiled, setupLogging
+
+log = logging.getLogger(__name__)
 
 
 def iconFile():
@@ -53,112 +57,67 @@ def iconFile():
     return None
 
 
-class Main(Gtk.ApplicationWindow):
-    def __init__(self, app):
-        super().__init__(title="Soundcraft-utils", application=app)
-        self.app = app
-        icon = iconFile()
-        if icon is not None:
-            self.set_default_icon_from_file(icon)
-        self.connect("destroy", self.app.quit_cb)
-        self.grid = None
-        self.dev = None
-        self.setNoDevice()
-        try:
-            self.dbus = Client(added_cb=self.deviceAdded, removed_cb=self.deviceRemoved)
-        except DbusInitializationError as e:
-            print(f"Startup error: {str(e)}")
-            self._startupFailure("Could not start soundcraft_gui", str(e))
-            raise e
-        except Exception as e:
-            print("Unexpected exception at gui startup")
-            traceback.print_exc()
-            self._startupFailure(f"Unexpected exception {e.__class__.__name__}", str(e))
-            raise e
-        self.dbus.serviceDisconnected.connect(self.dbusDisconnect)
-        self.dbus.serviceConnected.connect(self.dbusReconnect)
+class DevicePage(Gtk.Grid):
+    """The controls for one device
 
-    def _startupFailure(self, title, message):
-        dialog = Gtk.MessageDialog(
-            parent=self,
-            message_type=Gtk.MessageType.ERROR,
-            buttons=Gtk.ButtonsType.OK,
-            text=title,
-        )
-        dialog.format_secondary_text(message)
-        dialog.run()
+    Built once, and rebound to a new model when the same device comes back,
+    so a flaky cable doesn't churn through widgets.
+    """
 
-    def dbusDisconnect(self):
-        self.setNoDevice()
-
-    def dbusReconnect(self):
-        try:
-            self.dbus.ensureServiceVersion()
-        except VersionIncompatibilityError:
-            self._startupFailure(
-                "D-Bus service version incompatibility",
-                "Restart of this gui application is required",
-            )
-            self.app.quit()
-            # Todo: Can we relaunch ourselves?
-
-    def setDevice(self, dev):
-        if self.dev is not None:
-            if self.dev._path == dev._path:
-                # This already is our device
-                return
-        if self.grid is not None:
-            self.remove(self.grid)
-        self.dev = dev
-        dev.onPropertiesChanged = self.reset
-        self.grid = Gtk.Grid()
-        self.add(self.grid)
+    def __init__(self, model):
+        super().__init__()
+        self.layout = model.layout
+        self.model = None
         self.row = 0
-        self.addHeading(self.dev.name)
+        self.heading = self.addHeading(model["name"])
         self.addSep()
-        for (targets, sources) in self.dev.fixedRouting:
+        for (targets, sources) in model["fixedRouting"]:
             self.addRow(targets, sources)
             self.addSep()
         sourceData = Gtk.ListStore(str, str)
-        for source in self.dev.sources.items():
+        for source in model["sources"].items():
             sourceData.append([source[0], "\n".join(source[1])])
         self.sourceCombo = Gtk.ComboBox(model=sourceData)
         renderer_text = Gtk.CellRendererText()
         self.sourceCombo.pack_start(renderer_text, True)
         self.sourceCombo.add_attribute(renderer_text, "text", 1)
         self.sourceCombo.connect("changed", self.selectionChanged)
-        self.addRow(self.dev.routingTarget, self.sourceCombo)
+        self.addRow(model["routingTarget"], self.sourceCombo)
+        self.addError()
         self.addActions()
+        self.bind(model)
+
+    def bind(self, model):
+        if model is not self.model:
+            self.unbind()
+        self.model = model
+        model.watch(self.modelChanged)
+        self.heading.set_markup(f"<b>{model['name']}</b>")
+        self.showError(model["lastError"])
         self.reset()
-        self.show_all()
 
-    def setNoDevice(self):
-        self.dev = None
-        if self.grid is not None:
-            self.remove(self.grid)
-        self.grid = Gtk.Grid()
-        self.add(self.grid)
-        self.row = 0
-        self.addHeading("No device found")
-        self.show_all()
-
-    def deviceAdded(self, dev):
-        print(f"Added {dev._path}")
-        self.setDevice(dev)
+    def unbind(self):
+        if self.model is None:
+            return
+        self.model.close()
+        self.model = None
+        self.setActionsEnabled(False)
 
-    def deviceRemoved(self, path):
-        print(f"Removed {path}")
-        if self.dev is not None:
-            if self.dev._path != path:
-                # Not our device
-                return
-        self.setNoDevice()
+    def modelChanged(self, changed):
+        if "name" in changed:
+            self.heading.set_markup(f"<b>{changed['name']}</b>")
+        if "lastError" in changed:
+            self.showError(changed["lastError"])
+        if "routingSource" in changed or changed.get("lastError"):
+            # A failed switch leaves the device on its confirmed source
+            self.reset()
 
     def addHeading(self, text):
         section = Gtk.Label(label=None, margin=10, halign=Gtk.Align.START)
         section.set_markup(f"<b>{text}</b>")
-        self.grid.attach(section, 0, self.row, 3, 1)
+        self.attach(section, 0, self.row, 3, 1)
         self.row += 1
+        return section
 
     def _wrap_as_widget(self, item):
         if not isinstance(item, Gtk.Widget):
@@ -173,31 +132,43 @@ class Main(Gtk.ApplicationWindow):
         left.set_margin_bottom(10)
         left.set_margin_start(10)
         left.set_margin_end(2)
-        self.grid.attach(left, 0, self.row, 1, 2)
+        self.attach(left, 0, self.row, 1, 2)
         img = Gtk.Image.new_from_icon_name("pan-start", Gtk.IconSize.BUTTON)
         img.set_valign(Gtk.Align.END)
-        self.grid.attach(img, 1, self.row, 1, 1)
+        self.attach(img, 1, self.row, 1, 1)
         img = Gtk.Image.new_from_icon_name("pan-start", Gtk.IconSize.BUTTON)
         img.set_valign(Gtk.Align.START)
-        self.grid.attach(img, 1, self.row + 1, 1, 1)
+        self.attach(img, 1, self.row + 1, 1, 1)
         right = self._wrap_as_widget(right)
         right.set_margin_top(10)
         right.set_margin_bottom(10)
         right.set_margin_end(10)
         right.set_margin_start(2)
         right.set_halign(Gtk.Align.START)
-        self.grid.attach(right, 2, self.row, 1, 2)
+        self.attach(right, 2, self.row, 1, 2)
         self.row += 2
 
     def addSep(self):
-        self.grid.attach(
+        self.attach(
             Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL), 0, self.row, 3, 1
         )
         self.row += 1
 
+    def addError(self):
+        self.errorLabel = Gtk.Label(label=None, margin=10, halign=Gtk.Align.START)
+        self.errorLabel.set_line_wrap(True)
+        # Only shown while there is an error to show
+        self.errorLabel.set_no_show_all(True)
+        self.attach(self.errorLabel, 0, self.row, 3, 1)
+        self.row += 1
+
+    def showError(self, message):
+        self.errorLabel.set_text(message)
+        self.errorLabel.set_visible(bool(message))
+
     def addActions(self):
         self.actions = Gtk.ActionBar()
-        self.grid.attach(self.actions, 0, self.row, 3, 1)
+        self.attach(self.actions, 0, self.row, 3, 1)
         self.applyButton = Gtk.Button.new_with_mnemonic("_Apply")
         self.resetButton = Gtk.Button.new_with_mnemonic("_Reset")
         self.actions.pack_end(self.applyButton)
@@ -207,17 +178,27 @@ class Main(Gtk.ApplicationWindow):
 
     def selectionChanged(self, comboBox):
         i = comboBox.get_active_iter()
+        if i is None or self.model is None:
+            return
         self.nextSelection = comboBox.get_model()[i][0]
-        self.setActionsEnabled(self.nextSelection != self.dev.routingSource)
+        self.setActionsEnabled(self.nextSelection != self.model["routingSource"])
 
     def apply(self, button=None):
-        print(f"Setting routing source to {self.nextSelection}")
-        self.dev.routingSource = self.nextSelection
+        log.info("Setting routing source to %s", self.nextSelection)
+        try:
+            self.model.requestSource(self.nextSelection)
+        except Exception as e:
+            log.warning("Could not set routing source: %s", e)
+            self.showError(f"Could not switch routing: {e}")
+            self.reset()
+            return
         self.setActionsEnabled(False)
 
-    def reset(self, button=None, *args, **kwargs):
-        for (i, source) in enumerate(self.dev.sources.items()):
-            if self.dev.routingSource == source[0]:
+    def reset(self, button=None):
+        current = self.model["routingSource"]
+        # The combo's rows are in the same order as the sources
+        for (i, source) in enumerate(self.model["sources"]):
+            if source == current:
                 self.sourceCombo.set_active(i)
         self.setActionsEnabled(False)
 
@@ -226,6 +207,106 @@ class Main(Gtk.ApplicationWindow):
         self.resetButton.set_sensitive(enabled)
 
 
+class Main(Gtk.ApplicationWindow):
+    def __init__(self, app):
+        super().__init__(title="Soundcraft-utils", application=app)
+        self.app = app
+        icon = iconFile()
+        if icon is not None:
+            self.set_default_icon_from_file(icon)
+        self.connect("destroy", self.app.quit_cb)
+        # One page per device object path.  Pages of devices that went away
+        # are only hidden, ready to be rebound if they come back.
+        self.pages = {}
+        self.notebook = Gtk.Notebook(show_border=False)
+        noDevice = Gtk.Label(label=None, margin=10, halign=Gtk.Align.START)
+        noDevice.set_markup("<b>No device found</b>")
+        self.stack = Gtk.Stack()
+        self.stack.add_named(noDevice, "none")
+        self.stack.add_named(self.notebook, "devices")
+        self.add(self.stack)
+        self.show_all()
+        self.updateVisibility()
+        try:
+            self.dbus = Client(added_cb=self.deviceAdded, removed_cb=self.deviceRemoved)
+        except DbusInitializationError as e:
+            log.error("Startup error: %s", e)
+            self._startupFailure("Could not start soundcraft_gui", str(e))
+            raise e
+        except Exception as e:
+            log.exception("Unexpected exception at gui startup")
+            self._startupFailure(f"Unexpected exception {e.__class__.__name__}", str(e))
+            raise e
+        self.dbus.serviceDisconnected.connect(self.dbusDisconnect)
+        self.dbus.serviceConnected.connect(self.dbusReconnect)
+
+    def _startupFailure(self, title, message):
+        dialog = Gtk.MessageDialog(
+            parent=self,
+            message_type=Gtk.MessageType.ERROR,
+            buttons=Gtk.ButtonsType.OK,
+            text=title,
+        )
+        dialog.format_secondary_text(message)
+        dialog.run()
+
+    def dbusDisconnect(self):
+        self.setNoDevice()
+
+    def dbusReconnect(self):
+        try:
+            self.dbus.ensureServiceVersion()
+        except VersionIncompatibilityError:
+            self._startupFailure(
+                "D-Bus service version incompatibility",
+                "Restart of this gui application is required",
+            )
+            self.app.quit()
+            # Todo: Can we relaunch ourselves?
+
+    def setDevice(self, dev):
+        model = DeviceModel(dev)
+        page = self.pages.get(model.path)
+        if page is not None and page.layout == model.layout:
+            page.bind(model)
+        else:
+            if page is not None:
+                # A different model at the same path; its controls differ
+                page.unbind()
+                self.notebook.remove_page(self.notebook.page_num(page))
+            page = DevicePage(model)
+            self.pages[model.path] = page
+            self.notebook.append_page(page, Gtk.Label(label=model["name"]))
+        self.notebook.set_tab_label_text(page, model["name"])
+        page.show_all()
+        self.updateVisibility()
+
+    def setNoDevice(self):
+        for page in self.pages.values():
+            page.unbind()
+            page.hide()
+        self.updateVisibility()
+
+    def updateVisibility(self):
+        shown = [page for page in self.pages.values() if page.get_visible()]
+        self.notebook.set_show_tabs(len(shown) > 1)
+        self.stack.set_visible_child_name("devices" if shown else "none")
+
+    def deviceAdded(self, dev):
+        log.info("Added %s", dev._path)
+        self.setDevice(dev)
+
+    def deviceRemoved(self, path):
+        log.info("Removed %s", path)
+        page = self.pages.get(path)
+        if page is None:
+            # Not one of ours
+            return
+        page.unbind()
+        page.hide()
+        self.updateVisibility()
+
+
 class About(Gtk.AboutDialog):
     def __init__(self):
         super().__init__(
@@ -285,8 +366,7 @@ class App(Gtk.Application):
         except DbusInitializationError:
             self.quit()
         except Exception:
-            print("Unexpected exception at gui startup")
-            traceback.print_exc()
+            log.exception("Unexpected exception at gui startup")
             self.quit()
 
     def about_cb(self, action, parameter):
@@ -311,8 +391,13 @@ class App(Gtk.Application):
 
 
 def main():
+    setupLogging()
     app = App()
-    sys.exit(app.run(sys.argv))
+    # GTK owns the command line, so profiling is only enabled through
+    # SOUNDCRAFT_PROFILE here
+    with profiled(prog="soundcraft_gui"):
+        status = app.run(sys.argv)
+    sys.exit(status)
 
 
 if __name__ == "__main__":
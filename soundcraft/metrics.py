@@ -0,0 +1,242 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Optional counters and latency histograms for the D-Bus service
+
+Everything is recorded in a Registry, which can be read back as plain
+dictionaries (for the D-Bus Stats interface) or rendered in the
+Prometheus text exposition format.  Code that may run without metrics
+enabled records into NULL, which discards everything.
+"""
+
+import http.server
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(upper bound, count of values <= bound) pairs, ending with +Inf"""
+        result = []
+        total = 0
+        for (bound, count) in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def seriesName(name, labels):
+    if not labels:
+        return name
+    text = ",".join(f'{k}="{v}"' for (k, v) in labels)
+    return f"{name}{{{text}}}"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counters(self):
+        with self._lock:
+            return {
+                seriesName(name, labels): value
+                for ((name, labels), value) in self._counters.items()
+            }
+
+    def histograms(self):
+        """Series name -> (count, sum, cumulative bucket counts)"""
+        with self._lock:
+            return {
+                seriesName(name, labels): (h.count, h.sum, h.cumulative())
+                for ((name, labels), h) in self._histograms.items()
+            }
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda i: i[0])
+            typed = set()
+            for ((name, labels), value) in counters:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{seriesName(name, labels)} {value}")
+            for ((name, labels), h) in histograms:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for (bound, count) in h.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket = seriesName(f"{name}_bucket", labels + (("le", le),))
+                    lines.append(f"{bucket} {count}")
+                lines.append(f"{seriesName(name + '_sum', labels)} {h.sum}")
+                lines.append(f"{seriesName(name + '_count', labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+class NullRegistry:
+    def inc(self, name, amount=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+NULL = NullRegistry()
+
+
+class InstrumentedDevice:
+    """Wraps a pyusb-like device to time and count its control transfers"""
+
+    def __init__(self, dev, registry, label):
+        self._dev = dev
+        self._registry = registry
+        self._label = label
+
+    def __getattr__(self, name):
+        return getattr(self._dev, name)
+
+    def ctrl_transfer(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._dev.ctrl_transfer(*args, **kwargs)
+        except Exception as e:
+            self._registry.inc(
+                "usb_transfer_errors_total",
+                device=self._label,
+                error=type(e).__name__,
+            )
+            raise
+        finally:
+            self._registry.observe(
+                "usb_transfer_seconds",
+                time.perf_counter() - start,
+                device=self._label,
+            )
+
+
+class StallDetector:
+    """Measures how late a periodic main loop timer fires
+
+    Call tick() from a timer that is meant to run every 'interval'
+    seconds; lateness beyond 'threshold' seconds is counted as a stall.
+    The first tick only starts the clock, so however long the loop took to
+    start running is not mistaken for a stall.
+    """
+
+    def __init__(self, registry, interval=0.1, threshold=0.05):
+        self.registry = registry
+        self.interval = interval
+        self.threshold = threshold
+        self._last = None
+
+    def tick(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if self._last is None:
+            self._last = now
+            return 0.0
+        lag = max(0.0, now - self._last - self.interval)
+        self._last = now
+        self.registry.observe("mainloop_lag_seconds", lag)
+        if lag > self.threshold:
+            self.registry.inc("mainloop_stalls_total")
+        return lag
+
+
+class _PrometheusHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def servePrometheus(registry, port, host="127.0.0.1"):
+    """Serve /metrics on a background thread; returns the HTTPServer
+
+    Only binds to localhost by default.  Call shutdown() on the result to
+    stop it.
+    """
+    server = http.server.HTTPServer((host, port), _PrometheusHandler)
+    server.registry = registry
+    thread = threading.Thread(
+        target=server.serve_forever, name="prometheus", daemon=True
+    )
+    thread.start()
+    return server
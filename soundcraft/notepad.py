@@ -21,27 +21,52 @@
 
 import array
 import enum
-import json
-import os
+import logging
+import struct
 
-import usb.core
+import soundcraft.state
+import soundcraft.transport
+from soundcraft.diagnostics import timed
 
 
 DEFAULT_STATEDIR = "/var/lib/soundcraft-utils"
 HARMAN_USB = 0x05FC
 
+log = logging.getLogger(__name__)
+
 
 class NotepadBase:
     def __init__(
-        self, idProduct, routingTarget, stateDir=DEFAULT_STATEDIR, fixedRouting=None,
+        self,
+        idProduct,
+        routingTarget,
+        stateDir=DEFAULT_STATEDIR,
+        fixedRouting=None,
+        dev=None,
+        flushInterval=0,
+        transport=None,
+        transferPolicy=None,
+        openSession=True,
     ):
         if fixedRouting is None:
             fixedRouting = []
+        if transferPolicy is None:
+            transferPolicy = soundcraft.transport.defaultPolicy()
+        self.transferPolicy = transferPolicy
         self.routingTarget = routingTarget
         self.fixedRouting = fixedRouting
         self.stateDir = stateDir
-        self.dev = usb.core.find(idVendor=HARMAN_USB, idProduct=idProduct)
+        if transport is None:
+            transport = soundcraft.transport.get()
+        if dev is None:
+            dev = transport.find(HARMAN_USB, idProduct)
+        self.dev = dev
+        self.session = None
         if self.dev is not None:
+            self.session = DeviceSession(self.dev, transport)
+            if openSession:
+                # Otherwise the caller opens it, e.g. on a device worker
+                self.session.open()
             major = self.dev.bcdDevice >> 8
             minor = self.dev.bcdDevice & 0xFF
             try:
@@ -49,14 +74,37 @@ class NotepadBase:
             except Exception:
                 # Fall-back to class name, since reading the product over USB requires write access
                 self.product = self.__class__.__name__
+            try:
+                self.serial = self.dev.serial_number
+            except Exception:
+                self.serial = None
             self.fwVersion = "%d.%02d" % (major, minor)
-            self.stateFile = f"{stateDir}/{self.product}.state"
+            self.info1 = None
+            self.info2 = None
+            self.sampleRate = 0
+            self.sampleRates = []
             self.state = {}
-            self._loadState()
+            if stateDir is None:
+                # No persistence at all
+                self.stateFile = None
+                self._store = None
+            else:
+                self._store = soundcraft.state.openStore(stateDir, flushInterval)
+                self.stateFile = self._store.path
+                self._loadState()
 
     def found(self):
         return self.dev is not None
 
+    @property
+    def stateKey(self):
+        """Identifies this particular device across restarts and replugs"""
+        if self.serial:
+            return str(self.serial)
+        # No serial number; fall back to the physical port it is plugged into
+        ports = getattr(self.dev, "port_numbers", None) or ()
+        return f"{self.dev.bus}-{'.'.join(str(p) for p in ports)}"
+
     def resetState(self):
         storedSource = self.routingSource
         if storedSource == "UNKNOWN":
@@ -72,17 +120,33 @@ class NotepadBase:
     @routingSource.setter
     def routingSource(self, request):
         assert self.found()
+        self.switchSource(self.parseSource(request))
+
+    def parseSource(self, request):
         source = self._parseSourcename(request)
         if source is None:
             raise ValueError(f"Requested input {request} is not a valid choice")
-        print(f"Switching USB audio input to {source.name}")
+        return source
+
+    def routingMessage(self, source):
         # Reverse engineered via Wireshark on Windows
         # 0 => 0x00 00 04 00 00 00 00 00
         # 1 => 0x00 00 04 00 01 00 00 00
         #        Change this -^
-        message = array.array("B", [0x00, 0x00, 0x04, 0x00, source, 0x00, 0x00, 0x00])
-        print(f"Sending {message}")
-        self.dev.ctrl_transfer(0x40, 16, 0, 0, message)
+        return array.array("B", [0x00, 0x00, 0x04, 0x00, source, 0x00, 0x00, 0x00])
+
+    def switchSource(self, source, message=None):
+        """Send the routing change for an already-parsed source to the device
+
+        'message' may be prepared ahead of time with routingMessage().
+        """
+        assert self.found()
+        log.info("Switching USB audio input to %s", source.name)
+        if message is None:
+            message = self.routingMessage(source)
+        log.debug("Sending %s", message)
+        with timed(log, "Routing transfer"):
+            self.transferPolicy.ctrlTransfer(self.dev, 0x40, 16, 0, 0, message)
         self.state["source"] = source
         self._saveState()
 
@@ -95,48 +159,171 @@ class NotepadBase:
         return f"{self.product} (fw v{self.fwVersion})"
 
     def fetchInfo(self):
+        """Re-read the clock information; returns True if any of it changed"""
         assert self.found()
-        # TODO: Decode these?
         # Unfortunately, inspection shows none of the data here
-        # corresponds to thr current source selection
-        self.info1 = self.dev.ctrl_transfer(0xA1, 1, 0x0100, 0x2900, 256)
-        self.info2 = self.dev.ctrl_transfer(0xA1, 2, 0x0100, 0x2900, 256)
+        # corresponds to thr current source selection.
+        # These are USB Audio Class 2 requests to interface 0, entity 0x29,
+        # control selector 1 (sampling frequency): bRequest 1 is CUR and 2
+        # is RANGE.
+        with timed(log, "Info transfers"):
+            info1 = self.transferPolicy.ctrlTransfer(
+                self.dev, 0xA1, 1, 0x0100, 0x2900, 256
+            )
+            info2 = self.transferPolicy.ctrlTransfer(
+                self.dev, 0xA1, 2, 0x0100, 0x2900, 256
+            )
+        changed = info1 != self.info1 or info2 != self.info2
+        self.info1 = info1
+        self.info2 = info2
+        if changed:
+            self.sampleRate = decodeSampleRate(info1)
+            self.sampleRates = decodeSampleRateRanges(info2)
+        return changed
 
     def _parseSourcename(self, request):
-        sources = self.Sources
         if isinstance(request, self.Sources):
             return request
         if isinstance(request, int):
-            return sources(request)
-        try:
-            num = int(request)
-            return self._parseSourcename(num)
-        except ValueError:
             try:
-                return sources[request]
-            except KeyError:
-                for source in sources:
-                    # This could be better; maybe ensure it's a unique substring?
-                    if str(request) in source.name:
-                        return source
-        except Exception:
-            pass
-        return None
+                return self.Sources(request)
+            except ValueError:
+                return None
+        if not isinstance(request, str):
+            return None
+        return self.sourceIndex().lookup(request)
+
+    @classmethod
+    def sourceIndex(cls):
+        # Built on first use, once per device class
+        index = cls.__dict__.get("_sourceIndex")
+        if index is None:
+            index = SourceIndex(cls.Sources, cls.Label)
+            cls._sourceIndex = index
+        return index
 
     def _saveState(self):
+        if self._store is not None:
+            self._store.put(self.stateKey, self.state)
+
+    def _loadState(self):
+        if self._store is not None:
+            self.state = self._store.get(self.stateKey, legacyName=self.product)
+
+    def close(self):
+        """Write out any pending state and release the device"""
+        if not self.found():
+            return
+        if self._store is not None:
+            self._store.flush()
+        self.session.close()
+
+
+class DeviceSession:
+    """Holds a device's USB handle open from detection until close()
+
+    Left to itself pyusb opens the handle on the first transfer, so the
+    first routing switch after a hotplug pays for it.  Interfaces are never
+    claimed: snd-usb-audio owns them, and routing requests go to the device.
+    """
+
+    def __init__(self, dev, transport):
+        self.dev = dev
+        self.transport = transport
+        self.isOpen = False
+
+    def open(self):
+        if self.isOpen:
+            return
         try:
-            os.makedirs(self.stateDir, exist_ok=True)
-            with open(self.stateFile, "w") as fh:
-                fh.write(json.dumps(self.state, sort_keys=True, indent=4))
+            self.transport.open(self.dev)
         except Exception as e:
-            print(f"Warning: Could not write state file: {e}")
+            # Typically missing permissions; transfers will report it too
+            log.info("Could not open the device yet: %s", e)
+            return
+        self.isOpen = True
 
-    def _loadState(self):
+    def close(self):
+        if not self.isOpen:
+            return
+        self.isOpen = False
         try:
-            with open(self.stateFile, "r") as fh:
-                self.state = json.loads(fh.read())
-        except Exception:
-            pass
+            self.transport.release(self.dev)
+        except Exception as e:
+            log.debug("Releasing the device failed: %s", e)
+
+
+class AmbiguousSourceError(ValueError):
+    def __init__(self, request, candidates):
+        self.candidates = sorted(candidates)
+        names = ", ".join(c.name for c in self.candidates)
+        super().__init__(f"Requested input {request} could be any of {names}")
+
+
+class SourceIndex:
+    """Resolves user input to a source in a single dictionary lookup
+
+    Keys are tried in order of confidence: the exact number or name, then
+    case-insensitive names and labels, then any unique part of those.
+    Input that matches parts of several names is rejected rather than
+    silently picking the first one.
+    """
+
+    def __init__(self, sources, labels):
+        self.exact = {}
+        self.folded = {}
+        self.partial = {}
+        for source in sources:
+            self.exact[str(int(source))] = source
+            self.exact[source.name] = source
+            names = [source.name, *labels.get(source, ())]
+            (left, right) = labels.get(source, ("", ""))
+            if left.endswith(" L") and right == f"{left[:-2]} R":
+                # A stereo pair; also accept the label without the L/R
+                names.append(left[:-2])
+            for name in names:
+                name = name.casefold()
+                self.folded.setdefault(name, set()).add(source)
+                for start in range(len(name)):
+                    for end in range(start + 1, len(name) + 1):
+                        self.partial.setdefault(name[start:end], set()).add(source)
+
+    def lookup(self, request):
+        """Return the source for request, or None if nothing matches"""
+        request = request.strip()
+        if request.isdigit():
+            # Numbers only ever mean the source number, e.g. "02" is 2
+            return self.exact.get(str(int(request)))
+        source = self.exact.get(request)
+        if source is not None:
+            return source
+        key = request.casefold()
+        matches = self.folded.get(key) or self.partial.get(key)
+        if not matches:
+            return None
+        if len(matches) > 1:
+            raise AmbiguousSourceError(request, matches)
+        return next(iter(matches))
+
+
+def decodeSampleRate(info):
+    """Decode a UAC2 4-byte CUR parameter block: the sampling rate in Hz"""
+    if info is None or len(info) < 4:
+        return 0
+    return struct.unpack_from("<I", info, 0)[0]
+
+
+def decodeSampleRateRanges(info):
+    """Decode a UAC2 4-byte RANGE parameter block
+
+    Returns a list of (min, max, resolution) tuples of sampling rates in Hz.
+    The block is read in place; struct works directly on pyusb's array.
+    """
+    if info is None or len(info) < 2:
+        return []
+    (count,) = struct.unpack_from("<H", info, 0)
+    count = min(count, (len(info) - 2) // 12)
+    return [struct.unpack_from("<III", info, 2 + 12 * i) for i in range(count)]
 
 
 def stereo_label(base):
@@ -206,8 +393,99 @@ class Notepad_5(NotepadBase):
     }
 
 
-def autodetect(stateDir=DEFAULT_STATEDIR):
-    for devClass in (Notepad_12fx, Notepad_8fx, Notepad_5):
-        dev = devClass(stateDir=stateDir)
-        if dev.found():
-            return dev
+# Maps the USB idProduct of every supported mixer to its device class.  The
+# order is significant: autodetect() prefers devices earlier in this list.
+DEVICES = {
+    0x0032: Notepad_12fx,
+    0x0031: Notepad_8fx,
+    0x0030: Notepad_5,
+}
+
+
+def detectAll(
+    stateDir=DEFAULT_STATEDIR,
+    ignore=(),
+    flushInterval=0,
+    transport=None,
+    openSession=True,
+):
+    """Find every supported device with a single pass over the USB bus
+
+    Devices whose (bus, address) pair is in 'ignore' are skipped without
+    being opened, so callers can cheaply rescan for newly added devices.
+    With openSession=False the caller opens each device's session itself.
+    """
+    if transport is None:
+        transport = soundcraft.transport.get()
+    found = []
+    for usbdev in transport.findAll(HARMAN_USB):
+        devClass = DEVICES.get(usbdev.idProduct)
+        if devClass is None:
+            continue
+        if (usbdev.bus, usbdev.address) in ignore:
+            continue
+        found.append(
+            devClass(
+                stateDir=stateDir,
+                dev=usbdev,
+                flushInterval=flushInterval,
+                transport=transport,
+                openSession=openSession,
+            )
+        )
+    return found
+
+
+def autodetect(stateDir=DEFAULT_STATEDIR, flushInterval=0, transport=None):
+    """Open the preferred supported device, in the order of DEVICES"""
+    if transport is None:
+        transport = soundcraft.transport.get()
+    # One pass over the bus, but only the chosen device is opened
+    first = {}
+    for usbdev in transport.findAll(HARMAN_USB):
+        if usbdev.idProduct in DEVICES:
+            first.setdefault(usbdev.idProduct, usbdev)
+    for (idProduct, devClass) in DEVICES.items():
+        if idProduct in first:
+            return devClass(
+                stateDir=stateDir,
+                dev=first[idProduct],
+                flushInterval=flushInterval,
+                transport=transport,
+            )
+    return None
+
+
+def attach(
+    idProduct,
+    bus,
+    address,
+    stateDir=DEFAULT_STATEDIR,
+    flushInterval=0,
+    transport=None,
+    openSession=True,
+):
+    """Open the one device at a known bus and address, e.g. from a udev event
+
+    The class comes straight from the product ID, so unlike detectAll()
+    this does not look at any other device.  Returns None if the product
+    is not supported, or if the device is no longer there.
+    """
+    devClass = DEVICES.get(idProduct)
+    if devClass is None:
+        return None
+    if transport is None:
+        transport = soundcraft.transport.get()
+    matches = transport.findAll(
+        HARMAN_USB, idProduct=idProduct, bus=bus, address=address
+    )
+    usbdev = next(iter(matches), None)
+    if usbdev is None:
+        return None
+    return devClass(
+        stateDir=stateDir,
+        dev=usbdev,
+        flushInterval=flushInterval,
+        transport=transport,
+        openSession=openSession,
+    )
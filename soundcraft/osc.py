@@ -0,0 +1,255 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import fnmatch
+import logging
+import socket
+import struct
+
+BUNDLE = b"#bundle\0"
+
+log = logging.getLogger(__name__)
+
+
+class OscError(ValueError):
+    pass
+
+
+def _pad(data):
+    return data + b"\0" * (4 - len(data) % 4)
+
+
+def _readString(packet, offset):
+    end = packet.find(b"\0", offset)
+    if end < 0:
+        raise OscError("Unterminated string")
+    # Strings are padded with nulls to a multiple of 4 bytes
+    return (packet[offset:end].decode(errors="replace"), (end // 4 + 1) * 4)
+
+
+def encodeMessage(address, *args):
+    """Encode an OSC message; args may be int, float or str"""
+    tags = ","
+    data = b""
+    for arg in args:
+        if isinstance(arg, bool):
+            tags += "T" if arg else "F"
+        elif isinstance(arg, int):
+            tags += "i"
+            data += struct.pack(">i", arg)
+        elif isinstance(arg, float):
+            tags += "f"
+            data += struct.pack(">f", arg)
+        else:
+            tags += "s"
+            data += _pad(str(arg).encode())
+    return _pad(address.encode()) + _pad(tags.encode()) + data
+
+
+def encodeBundle(*messages, timetag=1):
+    """Encode already encoded messages as a bundle; timetag 1 means now"""
+    data = BUNDLE + struct.pack(">Q", timetag)
+    for message in messages:
+        data += struct.pack(">i", len(message)) + message
+    return data
+
+
+_ARGS = {
+    "i": (">i", 4),
+    "f": (">f", 4),
+    "h": (">q", 8),
+    "d": (">d", 8),
+}
+_CONSTANTS = {"T": True, "F": False, "N": None}
+
+
+def decodeMessage(packet):
+    (address, offset) = _readString(packet, 0)
+    if not address.startswith("/"):
+        raise OscError(f"Invalid address {address}")
+    if offset >= len(packet):
+        # Very old senders leave out the type tags when there are no args
+        return (address, [])
+    (tags, offset) = _readString(packet, offset)
+    if not tags.startswith(","):
+        raise OscError("Missing type tags")
+    args = []
+    for tag in tags[1:]:
+        if tag in _ARGS:
+            (fmt, size) = _ARGS[tag]
+            if offset + size > len(packet):
+                raise OscError("Truncated message")
+            args.append(struct.unpack_from(fmt, packet, offset)[0])
+            offset += size
+        elif tag == "s":
+            (value, offset) = _readString(packet, offset)
+            args.append(value)
+        elif tag in _CONSTANTS:
+            args.append(_CONSTANTS[tag])
+        else:
+            raise OscError(f"Unsupported argument type {tag}")
+    return (address, args)
+
+
+def decode(packet):
+    """Decode a packet into a list of (address, args), flattening bundles
+
+    Bundle timetags are ignored: everything runs as soon as it arrives,
+    which is what show control software sends for 'now' anyway.
+    """
+    if not packet.startswith(BUNDLE):
+        return [decodeMessage(packet)]
+    messages = []
+    offset = len(BUNDLE) + 8
+    while offset < len(packet):
+        if offset + 4 > len(packet):
+            raise OscError("Truncated bundle")
+        (size,) = struct.unpack_from(">i", packet, offset)
+        offset += 4
+        if size <= 0 or offset + size > len(packet):
+            raise OscError("Truncated bundle")
+        end = offset + size
+        messages.extend(decode(packet[offset:end]))
+        offset = end
+    return messages
+
+
+class OscServer:
+    """Routing control over OSC on UDP, for show control software
+
+        /notepad/<n>/source s|i   route a source, by name or number; the
+                                  sender gets /notepad/<n>/source back with
+                                  the source it resolved to
+        /notepad/<n>/source       ask for the current source
+        /notepad/subscribe        send /notepad/<n>/source to the sender
+        /notepad/unsubscribe      whenever a routing change completes
+
+    <n> is the index in the device's D-Bus object path, or a pattern such
+    as '*' to address several.  A bundle can switch several devices in one
+    packet.  Failures are answered with /notepad/error s.  Like
+    ControlServer, this works on the published NotepadDbus objects.
+    """
+
+    def __init__(self, port, watcher, host="127.0.0.1"):
+        self.watcher = watcher
+        self.devices = {}
+        self.subscribers = set()
+        self._subscriptions = {}
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.setblocking(False)
+        self.address = self._sock.getsockname()
+        self._watch = watcher.watch(self._sock.fileno(), self._readable)
+        log.info("Listening for OSC on udp://%s:%d", *self.address)
+
+    def addDevice(self, idx, wrapped):
+        self.devices[idx] = wrapped
+        self._subscriptions[idx] = wrapped.PropertiesChanged.connect(
+            lambda interface, changed, invalidated: self._changed(idx, changed)
+        )
+
+    def removeDevice(self, idx):
+        if self.devices.pop(idx, None) is not None:
+            self._subscriptions.pop(idx).disconnect()
+
+    def _changed(self, idx, changed):
+        if "routingSource" not in changed:
+            return
+        message = encodeMessage(f"/notepad/{idx}/source", changed["routingSource"])
+        for subscriber in list(self.subscribers):
+            self._send(message, subscriber)
+
+    def _send(self, packet, address):
+        try:
+            self._sock.sendto(packet, address)
+        except OSError as e:
+            # UDP is best effort; a vanished subscriber mustn't stop the rest
+            log.debug("Could not send OSC to %s: %s", address, e)
+
+    def _readable(self):
+        # Drain what has queued up, but give the main loop back now and then
+        for _ in range(64):
+            try:
+                (packet, sender) = self._sock.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                log.debug("OSC receive failed: %s", e)
+                break
+            for reply in self.handle(packet, sender):
+                self._send(reply, sender)
+        return True
+
+    def handle(self, packet, sender):
+        """Act on one packet; returns the encoded replies for its sender"""
+        try:
+            messages = decode(packet)
+        except (OscError, struct.error) as e:
+            return [encodeMessage("/notepad/error", f"Malformed packet: {e}")]
+        replies = []
+        for (address, args) in messages:
+            try:
+                replies.extend(self._dispatch(address, args, sender))
+            except Exception as e:
+                replies.append(encodeMessage("/notepad/error", f"{address}: {e}"))
+        return replies
+
+    def _dispatch(self, address, args, sender):
+        parts = address.strip("/").split("/")
+        if parts == ["notepad", "subscribe"]:
+            self.subscribers.add(sender)
+            return []
+        if parts == ["notepad", "unsubscribe"]:
+            self.subscribers.discard(sender)
+            return []
+        if len(parts) != 3 or parts[0] != "notepad" or parts[2] != "source":
+            raise OscError("Unknown address")
+        matches = [
+            idx
+            for idx in sorted(self.devices)
+            if fnmatch.fnmatchcase(str(idx), parts[1])
+        ]
+        if not matches:
+            raise OscError("No such device")
+        replies = []
+        for idx in matches:
+            wrapped = self.devices[idx]
+            if args:
+                request = args[0]
+                if isinstance(request, float):
+                    # Some controllers only send floats
+                    request = int(request)
+                wrapped.routingSource = str(request)
+            replies.append(
+                encodeMessage(f"/notepad/{idx}/source", wrapped.routingSource)
+            )
+        return replies
+
+    def close(self):
+        if self._sock is None:
+            return
+        self.watcher.unwatch(self._watch)
+        for subscription in self._subscriptions.values():
+            subscription.disconnect()
+        self._subscriptions.clear()
+        self._sock.close()
+        self._sock = None
@@ -0,0 +1,110 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from soundcraft.state import StateFile
+
+
+class PresetStore:
+    """Named routing presets, shared by all devices
+
+    Each preset maps a device's stable key (its serial number, or the port
+    it is plugged into) to the name of the source it should be routed to.
+    A path of None keeps the presets in memory only.
+    """
+
+    def __init__(self, path, flushInterval=0):
+        self._file = None if path is None else StateFile(path, flushInterval)
+        self._presets = {} if self._file is None else self._file.load()
+
+    def names(self):
+        return sorted(self._presets)
+
+    def get(self, name):
+        if name not in self._presets:
+            raise KeyError(f"No preset named {name}")
+        return dict(self._presets[name])
+
+    def save(self, name, routing):
+        if not name:
+            raise ValueError("A preset needs a name")
+        self._presets[name] = dict(routing)
+        self._persist()
+
+    def delete(self, name):
+        if self._presets.pop(name, None) is None:
+            raise KeyError(f"No preset named {name}")
+        self._persist()
+
+    def _persist(self):
+        if self._file is not None:
+            self._file.save(self._presets)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class Recall:
+    """A scene recall in progress, finished without blocking the caller
+
+    'futures' maps a key to the Future of one device's switch, whose result
+    is the time.monotonic() it finished at; each device switches on its own
+    worker, so all of them switch in parallel.  post(fn, *args) must run fn
+    on the caller's thread, which is the main loop in the service.  Once
+    every device has finished, or expire() gives up on the rest,
+    done(timings, errors) is called there with the seconds each device took
+    from 'start', and the exception of each one that failed or timed out.
+    """
+
+    def __init__(self, futures, start, post, done):
+        self.start = start
+        self.timings = {}
+        self.errors = {}
+        self._waiting = set(futures)
+        self._done = done
+        for (key, future) in futures.items():
+            future.add_done_callback(lambda f, key=key: post(self._finished, key, f))
+
+    def _finished(self, key, future):
+        if key not in self._waiting:
+            # Already given up on
+            return False
+        self._waiting.discard(key)
+        if future.exception() is not None:
+            self.errors[key] = future.exception()
+        else:
+            self.timings[key] = future.result() - self.start
+        if not self._waiting:
+            self._finish()
+        return False
+
+    def expire(self, timeout):
+        """Report every device that hasn't finished yet as timed out"""
+        for key in self._waiting:
+            self.errors[key] = TimeoutError(f"Timed out after {timeout}s")
+        self._waiting.clear()
+        self._finish()
+
+    def _finish(self):
+        (done, self._done) = (self._done, None)
+        if done is not None:
+            done(self.timings, self.errors)
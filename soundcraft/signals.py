@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+class PropertyBatcher:
+    """Merges PropertiesChanged updates for one object into one emission
+
+    Updates are held for 'window' seconds, or until the main loop next goes
+    idle when that is 0.  A property that changes several times is sent once
+    with its latest value, so subscribers only ever see the final state.
+    'schedule(delay, callback)' runs callback later on the main loop.
+    """
+
+    def __init__(self, emit, schedule, window=0):
+        self._emit = emit
+        self._schedule = schedule
+        self.window = window
+        self._changed = {}
+        self._scheduled = False
+
+    def update(self, changed):
+        self._changed.update(changed)
+        if not self._scheduled:
+            self._scheduled = True
+            self._schedule(self.window, self.flush)
+
+    def flush(self):
+        """Emit whatever is pending right away"""
+        self._scheduled = False
+        (changed, self._changed) = (self._changed, {})
+        if changed:
+            self._emit(changed)
+        # Also removes the main loop source that called this
+        return False
+
+
+class MembershipBatcher:
+    """Batches Added/Removed signals the way PropertyBatcher does properties
+
+    Only the net effect per object is signalled: one added and removed
+    again within the window is never mentioned, while one removed and added
+    back (a replug) is signalled as both, since it is a new object.
+    """
+
+    def __init__(self, emitAdded, emitRemoved, schedule, window=0):
+        self._emitAdded = emitAdded
+        self._emitRemoved = emitRemoved
+        self._schedule = schedule
+        self.window = window
+        # path -> (first event, last event), in order of first event
+        self._pending = {}
+        self._scheduled = False
+
+    def added(self, path):
+        self._record(path, True)
+
+    def removed(self, path):
+        self._record(path, False)
+
+    def _record(self, path, added):
+        (first, _) = self._pending.get(path, (added, None))
+        self._pending[path] = (first, added)
+        if not self._scheduled:
+            self._scheduled = True
+            self._schedule(self.window, self.flush)
+
+    def flush(self):
+        self._scheduled = False
+        (pending, self._pending) = (self._pending, {})
+        # Whatever existed before the window has gone if the first event was
+        # a removal, and whatever is left at the end was added
+        for (path, (first, last)) in pending.items():
+            if not first:
+                self._emitRemoved(path)
+        for (path, (first, last)) in pending.items():
+            if last:
+                self._emitAdded(path)
+        return False
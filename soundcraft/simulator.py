@@ -0,0 +1,258 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import array
+import errno
+import random
+import struct
+import threading
+import time
+
+import usb.core
+
+import soundcraft.notepad
+
+
+def _modelName(devClass):
+    # Notepad_12fx -> 12fx
+    return devClass.__name__.split("_", 1)[1].lower()
+
+
+MODELS = {
+    _modelName(c): idProduct for (idProduct, c) in soundcraft.notepad.DEVICES.items()
+}
+
+
+class SimulatedNotepad:
+    """A fake Notepad that quacks like a pyusb usb.core.Device
+
+    'latency' is added to every control transfer, and 'openLatency' to the
+    first one after the device was opened or released, like libusb opening a
+    handle.  Failures can be injected randomly with 'failureRate', or
+    deterministically with failNext().
+    """
+
+    def __init__(
+        self,
+        idProduct,
+        bus=1,
+        address=1,
+        serial_number=None,
+        bcdDevice=0x0100,
+        latency=0,
+        failureRate=0,
+        sampleRate=48000,
+        openLatency=0,
+    ):
+        self.idVendor = soundcraft.notepad.HARMAN_USB
+        self.idProduct = idProduct
+        self.bcdDevice = bcdDevice
+        self.bus = bus
+        self.address = address
+        self.port_numbers = (address,)
+        self.serial_number = serial_number
+        devClass = soundcraft.notepad.DEVICES.get(idProduct)
+        if devClass is not None:
+            self.product = f"Notepad-{_modelName(devClass).upper()}"
+        else:
+            self.product = f"Simulated {idProduct:04x}"
+        self.latency = latency
+        self.failureRate = failureRate
+        self.sampleRate = sampleRate
+        self.openLatency = openLatency
+        self.connected = True
+        self.opened = False
+        self.opens = 0
+        self.routing = None
+        self.transfers = []
+        self._failures = []
+        self._lock = threading.Lock()
+        self._random = random.Random(address)
+
+    def failNext(self, count=1, errorCode=errno.EPIPE):
+        """Make the next 'count' control transfers fail with errorCode"""
+        with self._lock:
+            self._failures.extend([errorCode] * count)
+
+    def get_active_configuration(self):
+        self._open()
+        return 1
+
+    def release(self):
+        self.opened = False
+
+    def _open(self):
+        with self._lock:
+            if not self.connected:
+                raise usb.core.USBError("No such device", errno=errno.ENODEV)
+            if self.opened:
+                return
+            self.opened = True
+            self.opens += 1
+        if self.openLatency:
+            time.sleep(self.openLatency)
+
+    def ctrl_transfer(
+        self,
+        bmRequestType,
+        bRequest,
+        wValue=0,
+        wIndex=0,
+        data_or_wLength=None,
+        timeout=None,
+    ):
+        self._open()
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if not self.connected:
+                raise usb.core.USBError("No such device", errno=errno.ENODEV)
+            if self._failures:
+                error = self._failures.pop(0)
+            elif self.failureRate and self._random.random() < self.failureRate:
+                error = errno.EPIPE
+            else:
+                error = None
+            if error == errno.ETIMEDOUT:
+                raise usb.core.USBTimeoutError("Operation timed out", errno=error)
+            if error is not None:
+                raise usb.core.USBError("Injected failure", errno=error)
+            self.transfers.append((bmRequestType, bRequest, wValue, wIndex))
+            if bmRequestType & 0x80:
+                return self._read(bRequest, data_or_wLength)
+            if bmRequestType == 0x40 and bRequest == 16:
+                # The routing message; see NotepadBase.switchSource
+                self.routing = data_or_wLength[4]
+            return len(data_or_wLength)
+
+    def _read(self, bRequest, length):
+        # Mimic a USB Audio Class 2 clock source: CUR then RANGE of the
+        # sampling frequency
+        if bRequest == 1:
+            data = struct.pack("<I", self.sampleRate)
+        else:
+            data = struct.pack("<HIII", 1, self.sampleRate, self.sampleRate, 0)
+        return array.array("B", data[:length])
+
+
+class SimulatedBus:
+    """An in-process stand-in for the USB bus, with hotplug support
+
+    'enumerationDelay' is added to every bus scan, and 'latency',
+    'openLatency' and 'failureRate' are the defaults for devices plugged in
+    with plug().
+    """
+
+    def __init__(self, enumerationDelay=0, latency=0, failureRate=0, openLatency=0):
+        self.enumerationDelay = enumerationDelay
+        self.latency = latency
+        self.failureRate = failureRate
+        self.openLatency = openLatency
+        self.hotplug = self
+        self.devices = []
+        self._listeners = []
+        self._nextAddress = 1
+        self._lock = threading.Lock()
+
+    def plug(self, model, **kwargs):
+        """Attach a new simulated device; model is an idProduct or a name like '12fx'"""
+        if isinstance(model, int):
+            idProduct = model
+        elif model.lower() in MODELS:
+            idProduct = MODELS[model.lower()]
+        else:
+            raise ValueError(f"Unknown Notepad model {model}")
+        with self._lock:
+            address = self._nextAddress
+            self._nextAddress += 1
+        kwargs.setdefault("latency", self.latency)
+        kwargs.setdefault("failureRate", self.failureRate)
+        kwargs.setdefault("openLatency", self.openLatency)
+        kwargs.setdefault("serial_number", f"SIM{address:04d}")
+        dev = SimulatedNotepad(idProduct, address=address, **kwargs)
+        with self._lock:
+            self.devices.append(dev)
+        self._notify("add", dev)
+        return dev
+
+    def unplug(self, dev):
+        with self._lock:
+            self.devices.remove(dev)
+            dev.connected = False
+        self._notify("remove", dev)
+
+    def connect(self, callback):
+        """Call callback(action, dev) with action 'add' or 'remove' on hotplug"""
+        self._listeners.append(callback)
+
+    def _notify(self, action, dev):
+        for callback in list(self._listeners):
+            callback(action, dev)
+
+    def _scan(self, idVendor, match):
+        if self.enumerationDelay:
+            time.sleep(self.enumerationDelay)
+        with self._lock:
+            devices = list(self.devices)
+        for dev in devices:
+            if dev.idVendor != idVendor:
+                continue
+            if all(getattr(dev, k, None) == v for (k, v) in match.items()):
+                yield dev
+
+    def find(self, idVendor, idProduct):
+        return next(self._scan(idVendor, {"idProduct": idProduct}), None)
+
+    def findAll(self, idVendor, **match):
+        return self._scan(idVendor, match)
+
+    def open(self, dev):
+        dev.get_active_configuration()
+
+    def release(self, dev):
+        dev.release()
+
+
+def fromSpec(spec):
+    """Build a SimulatedBus from a specification string
+
+    The format is 'sim:<models>[;<option>=<value>...]', for example
+    'sim:12fx,5;latency=0.002;enumeration=0.01;failures=0.05' which
+    plugs in a Notepad-12FX and a Notepad-5 with 2ms of control transfer
+    latency, 10ms to enumerate the bus and a 5% transfer failure rate.
+    'open' sets the cost of opening a device handle.
+    """
+    (_, _, rest) = spec.partition(":")
+    (models, *options) = rest.split(";")
+    settings = {}
+    for option in options:
+        (key, _, value) = option.partition("=")
+        settings[key.strip()] = float(value)
+    bus = SimulatedBus(
+        enumerationDelay=settings.get("enumeration", 0),
+        latency=settings.get("latency", 0),
+        failureRate=settings.get("failures", 0),
+        openLatency=settings.get("open", 0),
+    )
+    for model in models.split(","):
+        if model:
+            bus.plug(model)
+    return bus
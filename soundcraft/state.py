@@ -0,0 +1,203 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import atexit
+import json
+import logging
+import os
+import threading
+import weakref
+
+from soundcraft.diagnostics import timed
+
+
+log = logging.getLogger(__name__)
+_openFiles = weakref.WeakSet()
+
+
+class StateFile:
+    """A small JSON document persisted with write-behind and atomic replace
+
+    With a flushInterval of 0 every save() is written straight through.
+    Otherwise saves only update the in-memory copy and schedule a flush
+    after flushInterval seconds, so a burst of changes results in a single
+    write.  Either way the file is replaced atomically, so a crash leaves
+    either the old or the new contents on disk, never a truncated file.
+    """
+
+    def __init__(self, path, flushInterval=0):
+        self.path = str(path)
+        self.flushInterval = flushInterval
+        self.writes = 0
+        self._data = {}
+        self._dirty = False
+        self._dirReady = False
+        self._timer = None
+        self._lock = threading.Lock()
+        self._writeLock = threading.Lock()
+        _openFiles.add(self)
+
+    def load(self):
+        try:
+            with open(self.path, "r") as fh:
+                data = json.loads(fh.read())
+        except Exception:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        with self._lock:
+            self._data = dict(data)
+            self._dirty = False
+        return data
+
+    def save(self, data):
+        with self._lock:
+            self._data = dict(data)
+            self._dirty = True
+            if self.flushInterval > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flushInterval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        with self._writeLock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                data = self._data
+                self._dirty = False
+            try:
+                with timed(log, f"Writing {self.path}"):
+                    self._write(json.dumps(data, sort_keys=True, indent=4))
+            except Exception as e:
+                log.warning("Could not write state file: %s", e)
+                with self._lock:
+                    self._dirty = True
+
+    def close(self):
+        self.flush()
+        _openFiles.discard(self)
+
+    def _write(self, contents):
+        dirname = os.path.dirname(self.path) or "."
+        if not self._dirReady:
+            os.makedirs(dirname, exist_ok=True)
+            self._dirReady = True
+        tmpPath = f"{self.path}.tmp"
+        with open(tmpPath, "w") as fh:
+            fh.write(contents)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmpPath, self.path)
+        try:
+            dirfd = os.open(dirname, os.O_RDONLY)
+        except OSError:
+            pass
+        else:
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
+        self.writes += 1
+
+
+class StateStore:
+    """The saved state of every device, indexed by a per-device key
+
+    All devices share one StateFile, which is read once when the store is
+    opened; after that get() and put() are dictionary operations, and a
+    put() rewrites the file through the StateFile's write-behind.  Use
+    openStore() so that every device in a state directory shares the same
+    store.
+    """
+
+    def __init__(self, stateDir, flushInterval=0):
+        self.stateDir = str(stateDir)
+        self.path = os.path.join(self.stateDir, STORE_NAME)
+        self._file = StateFile(self.path, flushInterval=flushInterval)
+        self._lock = threading.Lock()
+        with timed(log, f"Loading {self.path}"):
+            self._devices = self._file.load()
+
+    def get(self, key, legacyName=None):
+        """Return a copy of the state saved for key, or an empty dict
+
+        If nothing is saved for key yet but legacyName names one of the
+        old per-product '<legacyName>.state' files, that is imported.
+        """
+        with self._lock:
+            state = self._devices.get(key)
+        if state is None and legacyName is not None:
+            state = self._migrate(key, legacyName)
+        return dict(state or {})
+
+    def put(self, key, state):
+        with self._lock:
+            self._devices[key] = dict(state)
+            devices = dict(self._devices)
+        self._file.save(devices)
+
+    def _migrate(self, key, legacyName):
+        legacy = os.path.join(self.stateDir, f"{legacyName}.state")
+        if not os.path.exists(legacy):
+            return None
+        # The legacy file is left alone, so older versions still find it
+        state = StateFile(legacy).load()
+        if state:
+            self.put(key, state)
+        return state
+
+    def flush(self):
+        self._file.flush()
+
+
+STORE_NAME = "devices.json"
+_stores = {}
+_storesLock = threading.Lock()
+
+
+def openStore(stateDir, flushInterval=0):
+    """Return the StateStore for stateDir, loading it on first use
+
+    The flushInterval of the first caller applies to the shared store.
+    """
+    key = os.path.abspath(str(stateDir))
+    with _storesLock:
+        store = _stores.get(key)
+        if store is None:
+            store = StateStore(stateDir, flushInterval=flushInterval)
+            _stores[key] = store
+        return store
+
+
+def flushAll():
+    """Write out any pending state; called at shutdown"""
+    for stateFile in list(_openFiles):
+        stateFile.flush()
+
+
+atexit.register(flushAll)
@@ -0,0 +1,214 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""How soundcraft-utils reaches USB devices
+
+A transport finds devices and hands back objects that behave like a
+pyusb usb.core.Device: they have idProduct, bcdDevice, bus, address,
+port_numbers, product and serial_number attributes, plus ctrl_transfer().
+
+The default transport talks to real hardware.  Setting the
+SOUNDCRAFT_TRANSPORT environment variable to a 'sim:' specification (see
+soundcraft.simulator.fromSpec) selects an in-process simulated bus instead.
+"""
+
+import errno
+import logging
+import os
+import time
+
+import usb.backend.libusb1
+import usb.core
+import usb.util
+
+log = logging.getLogger(__name__)
+
+# libusb error codes, as reported in USBError.backend_error_code
+LIBUSB_ERROR_NO_DEVICE = -4
+LIBUSB_ERROR_TIMEOUT = -7
+LIBUSB_ERROR_PIPE = -9
+
+
+class UsbTransport:
+    """The host's real USB bus, via pyusb"""
+
+    # Real hardware hotplug is reported through udev instead
+    hotplug = None
+
+    def __init__(self, backend=None):
+        self._backend = backend
+
+    @property
+    def backend(self):
+        # Looked up once, so every scan shares one libusb context instead of
+        # pyusb probing for a backend each time
+        if self._backend is None:
+            self._backend = usb.backend.libusb1.get_backend()
+        return self._backend
+
+    def find(self, idVendor, idProduct):
+        return usb.core.find(
+            idVendor=idVendor, idProduct=idProduct, backend=self.backend
+        )
+
+    def findAll(self, idVendor, **match):
+        return usb.core.find(
+            find_all=True, idVendor=idVendor, backend=self.backend, **match
+        )
+
+    def open(self, dev):
+        """Open the device handle now, rather than on the first transfer"""
+        # Reading the active configuration opens the handle.  Interfaces
+        # are deliberately not claimed: snd-usb-audio owns them.
+        dev.get_active_configuration()
+
+    def release(self, dev):
+        usb.util.dispose_resources(dev)
+
+
+_default = None
+
+
+def get():
+    """Return the transport selected for this process"""
+    global _default
+    if _default is None:
+        spec = os.environ.get("SOUNDCRAFT_TRANSPORT", "usb")
+        if spec == "usb":
+            _default = UsbTransport()
+        elif spec.startswith("sim"):
+            import soundcraft.simulator
+
+            _default = soundcraft.simulator.fromSpec(spec)
+        else:
+            raise ValueError(f"Unknown SOUNDCRAFT_TRANSPORT {spec}")
+    return _default
+
+
+def setDefault(transport):
+    """Override the process-wide transport; None restores auto-selection"""
+    global _default
+    _default = transport
+
+
+class TransferError(usb.core.USBError):
+    """A control transfer that failed, even after any retries"""
+
+    kind = "transfer failure"
+    retryable = False
+
+    def __init__(self, cause, attempts=1):
+        self.cause = cause
+        self.attempts = attempts
+        tries = f" after {attempts} attempts" if attempts > 1 else ""
+        super().__init__(
+            f"USB {self.kind}{tries}: {cause}",
+            getattr(cause, "backend_error_code", None),
+            getattr(cause, "errno", None),
+        )
+
+
+class PipeError(TransferError):
+    """The device stalled (rejected) the request"""
+
+    kind = "pipe error (request stalled)"
+    retryable = True
+
+
+class TransferTimeoutError(TransferError, usb.core.USBTimeoutError):
+    kind = "timeout"
+    retryable = True
+
+
+class DeviceGoneError(TransferError):
+    """The device was unplugged or reset; retrying cannot help"""
+
+    kind = "device disconnected"
+
+
+def classify(error, attempts=1):
+    """Wrap a pyusb USBError in the matching TransferError subclass"""
+    code = getattr(error, "backend_error_code", None)
+    errnum = getattr(error, "errno", None)
+    if isinstance(error, usb.core.USBTimeoutError):
+        errorClass = TransferTimeoutError
+    elif code == LIBUSB_ERROR_TIMEOUT or errnum == errno.ETIMEDOUT:
+        errorClass = TransferTimeoutError
+    elif code == LIBUSB_ERROR_PIPE or errnum == errno.EPIPE:
+        errorClass = PipeError
+    elif code == LIBUSB_ERROR_NO_DEVICE or errnum in (errno.ENODEV, errno.ENOENT):
+        errorClass = DeviceGoneError
+    else:
+        errorClass = TransferError
+    return errorClass(error, attempts)
+
+
+class TransferPolicy:
+    """Timeout and retry rules for a device's control transfers
+
+    Each attempt may take up to 'timeout' milliseconds.  Pipe errors and
+    timeouts are retried up to 'retries' more times, sleeping 'backoff'
+    seconds before the first retry and doubling that each time, up to
+    'maxBackoff'.  So a transfer never takes longer than worstCase()
+    seconds, however badly a hub misbehaves.
+    """
+
+    def __init__(self, timeout=500, retries=2, backoff=0.01, maxBackoff=0.1):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+
+    def delays(self):
+        return [
+            min(self.backoff * 2 ** i, self.maxBackoff) for i in range(self.retries)
+        ]
+
+    def worstCase(self):
+        return (self.retries + 1) * self.timeout / 1000 + sum(self.delays())
+
+    def ctrlTransfer(self, dev, *args):
+        """dev.ctrl_transfer(*args) with this policy's timeout and retries"""
+        delays = self.delays()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return dev.ctrl_transfer(*args, timeout=self.timeout)
+            except usb.core.USBError as e:
+                error = classify(e, attempts)
+                if not error.retryable or attempts > len(delays):
+                    raise error from e
+                log.info("Retrying after %s", error)
+                time.sleep(delays[attempts - 1])
+
+
+_defaultPolicy = TransferPolicy()
+
+
+def defaultPolicy():
+    return _defaultPolicy
+
+
+def setDefaultPolicy(policy):
+    """Set the TransferPolicy for devices opened from now on"""
+    global _defaultPolicy
+    _defaultPolicy = policy
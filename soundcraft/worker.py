@@ -0,0 +1,181 @@
+#
+# Copyright (c) 2020 Jim Ramsay <i.am@jimramsay.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class DeviceWorker:
+    """Runs all I/O for one USB device on a dedicated thread
+
+    Jobs are executed strictly in submission order, and each submit()
+    returns a concurrent.futures.Future for the job's result.  This keeps
+    a slow or stalled device from blocking the caller (normally the GLib
+    main loop), or any other device.
+    """
+
+    def __init__(self, name="usb-worker"):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._stopped:
+                # Nothing would ever run it
+                future.set_exception(RuntimeError("The device worker has stopped"))
+            else:
+                self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def stop(self, timeout=0):
+        """Finish all queued jobs, then exit the worker thread
+
+        Jobs submitted afterwards fail straight away.  Waits up to 'timeout'
+        seconds for the thread to finish (None waits forever).  Returns True
+        if the thread has exited.
+        """
+        with self._lock:
+            self._stopped = True
+            self._queue.put(None)
+        if timeout != 0:
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            (future, fn, args, kwargs) = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+class RoutingCoalescer:
+    """Last-writer-wins batching of routing requests for one device
+
+    A request made while an earlier one is still waiting on the worker
+    replaces it instead of queueing another transfer, and every request in
+    the batch shares the same Future.  A batch is held for 'window' seconds
+    before it is sent, to catch bursts, and is dropped entirely if it asks
+    for the source the device already has.  The Future's result is True if
+    a transfer was sent and False if it was skipped.
+    """
+
+    def __init__(self, worker, switch, current, window=0):
+        self.requested = 0
+        self.merged = 0
+        self.skipped = 0
+        self.sent = 0
+        self.window = window
+        self._worker = worker
+        self._switch = switch
+        self._current = current
+        self._lock = threading.Lock()
+        self._target = None
+        self._future = None
+        # True while a batch is being sent to the device
+        self._busy = False
+
+    def request(self, source):
+        with self._lock:
+            self.requested += 1
+            if self._future is not None:
+                self.merged += 1
+                self._target = source
+                return self._future
+            future = Future()
+            if not self._busy and source == self._current():
+                self.skipped += 1
+                future.set_result(False)
+                return future
+            self._target = source
+            self._future = future
+        self._worker.submit(self._flush)
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requested": self.requested,
+                "merged": self.merged,
+                "skipped": self.skipped,
+                "sent": self.sent,
+            }
+
+    def _flush(self):
+        if self.window > 0:
+            time.sleep(self.window)
+        with self._lock:
+            (target, future) = (self._target, self._future)
+            self._target = None
+            self._future = None
+            self._busy = True
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            if target == self._current():
+                with self._lock:
+                    self.skipped += 1
+                future.set_result(False)
+                return
+            self._switch(target)
+            with self._lock:
+                self.sent += 1
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(True)
+        finally:
+            with self._lock:
+                self._busy = False
+
+
+class AdaptiveInterval:
+    """Polling interval that backs off while nothing changes
+
+    Starts at 'minimum' seconds and doubles after every poll that saw no
+    change, up to 'maximum'; a change drops it straight back to 'minimum'.
+    """
+
+    def __init__(self, minimum, maximum=None):
+        self.minimum = minimum
+        self.maximum = minimum if maximum is None else max(minimum, maximum)
+        self.current = minimum
+
+    def next(self, changed):
+        if changed:
+            self.current = self.minimum
+        else:
+            self.current = min(self.current * 2, self.maximum)
+        return self.current
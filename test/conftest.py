@@ -0,0 +1,11 @@
+import pytest
+
+from soundcraft import simulator, transport
+
+
+@pytest.fixture
+def simbus():
+    bus = simulator.SimulatedBus()
+    transport.setDefault(bus)
+    yield bus
+    transport.setDefault(None)
@@ -0,0 +1,68 @@
+"""Stand-ins shared by the endpoint tests"""
+
+import selectors
+
+
+class SelectorWatcher:
+    """A stand-in for the GLib main loop"""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.watches = {}
+        self.next = 0
+
+    def watch(self, fd, callback, writable=False):
+        self.next += 1
+        self.watches[self.next] = (fd, writable, callback)
+        return self.next
+
+    def unwatch(self, handle):
+        del self.watches[handle]
+
+    def iterate(self, rounds=10):
+        for _ in range(rounds):
+            for (handle, (fd, writable, callback)) in list(self.watches.items()):
+                events = selectors.EVENT_WRITE if writable else selectors.EVENT_READ
+                self.selector.register(fd, events)
+                ready = self.selector.select(0)
+                self.selector.unregister(fd)
+                if ready and handle in self.watches and not callback():
+                    self.watches.pop(handle, None)
+
+
+class Subscriptions:
+    def __init__(self):
+        self.callbacks = []
+
+    def connect(self, callback):
+        self.callbacks.append(callback)
+        subscriptions = self
+
+        class Subscription:
+            def disconnect(self):
+                subscriptions.callbacks.remove(callback)
+
+        return Subscription()
+
+    def __call__(self, *args):
+        for callback in list(self.callbacks):
+            callback(*args)
+
+
+class FakeDevice:
+    name = "Notepad-12FX"
+    sources = {"INPUT_3_4": (), "INPUT_5_6": ()}
+
+    def __init__(self):
+        self.PropertiesChanged = Subscriptions()
+        self._source = "INPUT_3_4"
+
+    @property
+    def routingSource(self):
+        return self._source
+
+    @routingSource.setter
+    def routingSource(self, request):
+        if request not in self.sources:
+            raise ValueError(f"Requested input {request} is not a valid choice")
+        self._source = request
@@ -0,0 +1,98 @@
+import io
+import json
+
+from soundcraft import notepad
+from soundcraft.batch import Batch
+
+
+def runBatch(batch, text, asJson=False):
+    out = io.StringIO()
+    failures = batch.run(io.StringIO(text), out, asJson=asJson)
+    return (failures, out.getvalue().splitlines())
+
+
+def test_batch_text(simbus, tmpdir):
+    usbdev = simbus.plug("12fx")
+    batch = Batch(lambda: notepad.detectAll(stateDir=tmpdir))
+    (failures, lines) = runBatch(
+        batch, "# comment\n\nset INPUT_5_6\nget\nset bogus\npresets\n"
+    )
+    batch.close()
+    assert failures == 2
+    assert usbdev.routing == 1
+    device = "device=Notepad-12FX (fw v1.00)"
+    assert lines[0] == f"ok set INPUT_5_6: {device} routingSource=INPUT_5_6"
+    assert lines[1].startswith("ok get:")
+    assert lines[2].startswith("error set bogus:")
+    assert lines[3].startswith("error presets: Presets are kept by the D-Bus service")
+
+
+def test_batch_json(simbus, tmpdir):
+    simbus.plug("12fx")
+    simbus.plug("5")
+    batch = Batch(lambda: notepad.detectAll(stateDir=tmpdir))
+    (failures, lines) = runBatch(
+        batch, "devices\nuse 1\nlist\nuse 2\nset\n", asJson=True
+    )
+    batch.close()
+    records = [json.loads(line) for line in lines]
+    assert failures == 2
+    assert [r["line"] for r in records] == [1, 2, 3, 4, 5]
+    assert records[0]["result"]["devices"] == [
+        "Notepad-12FX (fw v1.00)",
+        "Notepad-5 (fw v1.00)",
+    ]
+    assert records[2]["result"]["sources"] == list(
+        notepad.Notepad_5.Sources.__members__
+    )
+    assert records[3] == {
+        "line": 4,
+        "command": "use 2",
+        "ok": False,
+        "error": "No device number 2",
+    }
+    assert records[4]["error"] == "Usage: set SOURCE"
+
+
+def test_batch_single_connection(simbus, tmpdir):
+    simbus.plug("8fx")
+    opened = []
+
+    def openDevices():
+        opened.append(True)
+        return notepad.detectAll(stateDir=tmpdir)
+
+    batch = Batch(openDevices)
+    (failures, _) = runBatch(batch, "set 0\nset 1\nget\nlist\n" * 25)
+    batch.close()
+    assert failures == 0
+    assert len(opened) == 1
+
+
+class SnapshotDevice:
+    """Reads like a D-Bus DeviceProxy: only refresh() picks up changes"""
+
+    name = "Notepad-12FX (fw v1.00)"
+    sources = {"INPUT_5_6": (), "MASTER_L_R": ()}
+
+    def __init__(self, live):
+        self.live = live
+        self.refresh()
+
+    def refresh(self):
+        self.routingSource = self.live["routingSource"]
+
+    def close(self):
+        pass
+
+
+def test_batch_refreshes_proxies():
+    live = {"routingSource": "INPUT_5_6"}
+    batch = Batch(lambda: [SnapshotDevice(live)])
+    (_, first) = runBatch(batch, "get\n")
+    # Another client switches the device
+    live["routingSource"] = "MASTER_L_R"
+    (_, second) = runBatch(batch, "get\nlist\n")
+    assert first[0].endswith("routingSource=INPUT_5_6")
+    assert second[0].endswith("routingSource=MASTER_L_R")
+    assert "routingSource=MASTER_L_R" in second[1]
@@ -0,0 +1,77 @@
+import json
+import os
+import socket
+import stat
+
+import pytest
+
+from soundcraft.control import ControlServer
+from helpers import FakeDevice, SelectorWatcher
+
+
+@pytest.fixture
+def server(tmpdir):
+    watcher = SelectorWatcher()
+    server = ControlServer(str(tmpdir.join("control.sock")), watcher, mode=0o600)
+    yield server
+    server.close()
+
+
+def connect(server):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(server.path)
+    server.watcher.iterate()
+    return client.makefile("rw")
+
+
+def request(server, client, *lines):
+    for line in lines:
+        client.write(line + "\n")
+    client.flush()
+    server.watcher.iterate()
+    return [client.readline().rstrip("\n") for line in lines]
+
+
+def test_control_get_set(server):
+    dev = FakeDevice()
+    server.addDevice(3, dev)
+    client = connect(server)
+    replies = request(
+        server, client, "get 3", "set 3 INPUT_5_6", "get 3", "set 3 X", "get 9", "bogus"
+    )
+    assert replies[:3] == ['ok "INPUT_3_4"', 'ok "INPUT_5_6"', 'ok "INPUT_5_6"']
+    assert replies[3] == "error Requested input X is not a valid choice"
+    assert replies[4] == "error No device 9"
+    assert replies[5] == "error Unknown command bogus"
+    assert dev.routingSource == "INPUT_5_6"
+
+
+def test_control_subscribe(server):
+    dev = FakeDevice()
+    server.addDevice(0, dev)
+    client = connect(server)
+    (reply,) = request(server, client, "subscribe")
+    assert json.loads(reply[3:]) == {
+        "0": {
+            "name": "Notepad-12FX",
+            "routingSource": "INPUT_3_4",
+            "sources": ["INPUT_3_4", "INPUT_5_6"],
+        }
+    }
+    dev.PropertiesChanged("iface", {"routingSource": "INPUT_5_6"}, [])
+    server.removeDevice(0)
+    server.watcher.iterate()
+    assert client.readline() == 'event {"routingSource": "INPUT_5_6", "device": 0}\n'
+    assert client.readline() == 'event {"device": 0, "removed": true}\n'
+
+
+def test_control_socket_mode(server):
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+    path = server.path
+    server.close()
+    assert not os.path.exists(path)
+    # A stale socket is replaced, but nothing else is
+    ControlServer(path, SelectorWatcher()).close()
+    open(path, "w").close()
+    with pytest.raises(FileExistsError):
+        ControlServer(path, SelectorWatcher())
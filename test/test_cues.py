@@ -0,0 +1,21 @@
+import time
+
+from soundcraft import cues
+
+
+def test_to_monotonic():
+    deadline = cues.toMonotonic(time.time() + 10)
+    assert abs(deadline - (time.monotonic() + 10)) < 0.01
+
+
+def test_fire_on_time():
+    switched = []
+    cue = cues.Cue(None, "/dev", 2, b"msg", deadline=time.monotonic() + 0.02)
+    jitter = cues.fire(cue, lambda source, message: switched.append((source, message)))
+    assert switched == [(2, b"msg")]
+    assert 0 <= jitter < 0.01
+
+
+def test_fire_late_cue():
+    cue = cues.Cue(None, "/dev", 1, None, deadline=time.monotonic() - 1)
+    assert cues.fire(cue, lambda source, message: None) >= 1
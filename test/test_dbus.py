@@ -0,0 +1,294 @@
+import errno
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("gi")
+
+from gi.repository import GLib
+
+import soundcraft
+from soundcraft import dbus, notepad
+from soundcraft.batch import Batch
+
+SERVICE_TRANSPORT = "sim:12fx,5,8fx"
+
+
+def iterateUntil(condition, timeout=5):
+    """Run the default main context until condition() holds"""
+    context = GLib.MainContext.default()
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        if not context.iteration(False):
+            time.sleep(0.001)
+
+
+class Changes:
+    """Collects a NotepadDbus's PropertiesChanged emissions"""
+
+    def __init__(self, wrapped):
+        self.emitted = []
+        wrapped.PropertiesChanged.connect(self.changed)
+
+    def changed(self, interface, changed, invalidated):
+        self.emitted.append(changed)
+
+    def latest(self, name):
+        values = [changed[name] for changed in self.emitted if name in changed]
+        return values[-1] if values else None
+
+
+@pytest.fixture
+def privateBus(monkeypatch):
+    if shutil.which("dbus-daemon") is None:
+        pytest.skip("dbus-daemon is not installed")
+    daemon = subprocess.Popen(
+        ["dbus-daemon", "--session", "--nofork", "--print-address"],
+        stdout=subprocess.PIPE,
+    )
+    address = daemon.stdout.readline().decode().strip()
+    monkeypatch.setenv("SOUNDCRAFT_BUS_ADDRESS", address)
+    yield address
+    daemon.terminate()
+    daemon.wait()
+
+
+@pytest.fixture
+def localService(privateBus, simbus):
+    """A service in this process, driven by calling it directly"""
+    service = dbus.Service(stateDir=None)
+    yield service
+    service.Shutdown()
+
+
+@pytest.fixture
+def service(privateBus, tmpdir):
+    """A service process on a private bus, driving three simulated Notepads"""
+    env = dict(
+        os.environ,
+        SOUNDCRAFT_TRANSPORT=SERVICE_TRANSPORT,
+        PYTHONPATH=os.path.dirname(os.path.dirname(soundcraft.__file__)),
+    )
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import soundcraft.dbus; soundcraft.dbus.main()",
+            "--state-dir",
+            str(tmpdir),
+        ],
+        env=env,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                dbus.Client().checkService()
+                break
+            except dbus.DbusInitializationError:
+                assert time.monotonic() < deadline, "The service did not start"
+                time.sleep(0.05)
+        yield proc
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def test_failed_switch_corrects_pending_source(simbus):
+    usbdev = simbus.plug("12fx")
+    wrapped = dbus.NotepadDbus(notepad.autodetect(stateDir=None))
+    changes = Changes(wrapped)
+    usbdev.failNext(errorCode=errno.ENODEV)
+    wrapped.routingSource = "INPUT_7_8"
+    # What a client reads, and caches, while the switch is queued
+    assert wrapped.routingSource == "INPUT_7_8"
+    iterateUntil(lambda: changes.latest("routingSource") is not None)
+    assert changes.latest("routingSource") == "UNKNOWN"
+    assert wrapped.routingSource == "UNKNOWN"
+    assert wrapped.lastError.startswith("Could not switch routing")
+    wrapped.close(timeout=1)
+
+
+def test_batch_sees_other_clients(service):
+    client = dbus.Client()
+    batch = Batch(client.devices, client=client)
+    assert batch.execute("set INPUT_5_6")["routingSource"] == "INPUT_5_6"
+    other = dbus.Client().autodetect()
+    other.routingSource = "MASTER_L_R"
+    # No main loop runs, so only a fresh read can see the other client's change
+    assert batch.execute("get")["routingSource"] == "MASTER_L_R"
+    other.close()
+    batch.close()
+
+
+def test_client_announces_every_device(service):
+    added = []
+    dbus.Client(added_cb=added.append)
+    assert [dev._path for dev in added] == [
+        "/soundcraft/utils/notepad/0",
+        "/soundcraft/utils/notepad/1",
+        "/soundcraft/utils/notepad/2",
+    ]
+    assert [dev.name for dev in added] == [
+        "Notepad-12FX (fw v1.00)",
+        "Notepad-5 (fw v1.00)",
+        "Notepad-8FX (fw v1.00)",
+    ]
+    for dev in added:
+        dev.close()
+
+
+def test_recall_scene_in_background(localService, simbus):
+    simbus.plug("12fx")
+    simbus.plug("5")
+    localService.tryRegister()
+    (first, second) = [obj._wrapped for obj in localService.objects.values()]
+
+    def routing():
+        return (first._dev.routingSource, second._dev.routingSource)
+
+    first.routingSource = "INPUT_5_6"
+    second.routingSource = "STEREO_2_3"
+    iterateUntil(lambda: routing() == ("INPUT_5_6", "STEREO_2_3"))
+    localService.SavePreset("show")
+    first.routingSource = "MASTER_L_R"
+    second.routingSource = "MASTER_L_R"
+    iterateUntil(lambda: routing() == ("MASTER_L_R", "MASTER_L_R"))
+
+    for usbdev in simbus.devices:
+        usbdev.latency = 0.2
+    recalled = []
+    localService.SceneRecalled.connect(lambda *args: recalled.append(args))
+    start = time.monotonic()
+    recallId = localService.RecallScene("show")
+    # Returns without waiting for the devices
+    assert time.monotonic() - start < 0.1
+    assert (first.routingSource, second.routingSource) == ("INPUT_5_6", "STEREO_2_3")
+    iterateUntil(lambda: recalled)
+    (doneId, name, timings, errors) = recalled[0]
+    assert (doneId, name, errors) == (recallId, "show", {})
+    assert sorted(timings) == [
+        "/soundcraft/utils/notepad/0",
+        "/soundcraft/utils/notepad/1",
+    ]
+    assert routing() == ("INPUT_5_6", "STEREO_2_3")
+
+
+def test_unplug_drops_cues(localService, simbus):
+    usbdev = simbus.plug("12fx")
+    localService.tryRegister()
+    path = localService.devices[0]
+    assert localService.ScheduleCues([(time.time() + 60, path, "INPUT_5_6")]) == 1
+    simbus.unplug(usbdev)
+    iterateUntil(lambda: not localService.objects)
+    assert localService._cues == set()
+
+
+def test_service_publishes_every_device(localService, simbus):
+    for model in ("12fx", "5", "8fx"):
+        simbus.plug(model)
+    added = []
+    localService.Added.connect(added.append)
+    localService.tryRegister()
+    paths = [f"/soundcraft/utils/notepad/{i}" for i in range(3)]
+    assert localService.devices == paths
+    iterateUntil(lambda: len(added) == 3)
+    assert added == paths
+    # A replugged device comes back at the same path
+    usbdev = simbus.devices[1]
+    simbus.unplug(usbdev)
+    iterateUntil(lambda: len(localService.objects) == 2)
+    assert localService.devices == [paths[0], paths[2]]
+    simbus.plug("5", serial_number=usbdev.serial_number)
+    iterateUntil(lambda: len(localService.objects) == 3)
+    assert localService.devices == paths
+
+
+def test_device_proxy_follows_other_clients(service):
+    dev = dbus.Client().autodetect()
+    before = dev.routingSource
+    other = dbus.Client().autodetect()
+    other.routingSource = "INPUT_7_8"
+    # Served from the snapshot until the main loop delivers the change
+    assert dev.routingSource == before
+    iterateUntil(lambda: dev.routingSource == "INPUT_7_8")
+    assert dev.name == "Notepad-12FX (fw v1.00)"
+    other.close()
+    dev.close()
+
+
+def test_client_without_service(privateBus):
+    # Building the proxies asks nothing of the service
+    client = dbus.Client()
+    with pytest.raises(dbus.DbusServiceSetupError):
+        client.checkService()
+    with pytest.raises(dbus.DbusServiceSetupError):
+        client.presets()
+
+
+def test_static_proxy_classes_are_shared(service):
+    client = dbus.Client()
+    (first, second) = [dev._proxy for dev in client.devices()[:2]]
+    assert type(first) is type(second)
+    assert client.serviceVersion() == soundcraft.__version__
+
+
+def test_service_batches_hotplug_signals(localService, simbus):
+    (added, removed, devices) = ([], [], [])
+    localService.Added.connect(added.append)
+    localService.Removed.connect(removed.append)
+
+    def changed(interface, changed, invalidated):
+        if "devices" in changed:
+            devices.append(changed["devices"])
+
+    localService.PropertiesChanged.connect(changed)
+    plugged = [simbus.plug(model) for model in ("12fx", "5", "8fx")]
+    # Handle the events before the main loop gets a chance to flush
+    for usbdev in plugged:
+        localService.hotplugAdd(
+            usbdev.idVendor, usbdev.idProduct, usbdev.bus, usbdev.address
+        )
+    localService.hotplugRemove(plugged[1].bus, plugged[1].address)
+    simbus.unplug(plugged[1])
+    iterateUntil(lambda: added)
+    while GLib.MainContext.default().iteration(False):
+        pass
+    paths = ["/soundcraft/utils/notepad/0", "/soundcraft/utils/notepad/2"]
+    # The device that came and went within one iteration is never mentioned
+    assert added == paths
+    assert removed == []
+    assert devices == [paths]
+
+
+def test_internal_reads_are_not_counted(simbus):
+    simbus.plug("12fx")
+    registry = soundcraft.metrics.Registry()
+    wrapped = dbus.NotepadDbus(notepad.autodetect(stateDir=None), metrics=registry)
+    changes = Changes(wrapped)
+    wrapped.pollInfo()
+    iterateUntil(lambda: changes.latest("sampleRate") is not None)
+    local = dbus.LocalDevice(wrapped)
+    local.routingSource = "INPUT_5_6"
+    assert (local.name, local.routingSource) == ("Notepad-12FX (fw v1.00)", "INPUT_5_6")
+    assert "INPUT_5_6" in local.sources
+    # Only D-Bus clients' reads and writes belong in the dbus_property_* series
+    assert registry.counters() == {}
+    wrapped.close(timeout=1)
+
+
+def test_device_proxy_set_waits_for_signal(service):
+    dev = dbus.Client().autodetect()
+    signalled = []
+    dev.PropertiesChanged.connect(
+        lambda interface, changed, invalidated: signalled.append(changed)
+    )
+    dev.routingSource = "INPUT_5_6"
+    iterateUntil(lambda: any(c.get("routingSource") == "INPUT_5_6" for c in signalled))
+    assert dev.routingSource == "INPUT_5_6"
+    dev.close()
@@ -0,0 +1,72 @@
+from soundcraft.devicemodel import DeviceModel
+
+
+class ProxyDevice:
+    """Counts reads like a DeviceProxy would count D-Bus round trips"""
+
+    _path = "/soundcraft/utils/notepad/0"
+
+    def __init__(self):
+        self.reads = 0
+        self.requests = []
+        self.closed = False
+        self.onPropertiesChanged = None
+        self.props = {
+            "name": "Notepad-12FX (fw v1.00)",
+            "fixedRouting": [],
+            "routingTarget": ("capture_3", "capture_4"),
+            "sources": {"INPUT_3_4": (), "INPUT_5_6": ()},
+            "routingSource": "INPUT_3_4",
+            "lastError": "",
+        }
+
+    def __getattr__(self, name):
+        if name not in self.__dict__.get("props", {}):
+            raise AttributeError(name)
+        self.reads += 1
+        return self.props[name]
+
+    @property
+    def routingSource(self):
+        self.reads += 1
+        return self.props["routingSource"]
+
+    @routingSource.setter
+    def routingSource(self, request):
+        self.requests.append(request)
+
+    def signal(self, **changed):
+        self.onPropertiesChanged("soundcraft.utils.notepad.device", changed, [])
+
+    def close(self):
+        self.closed = True
+
+
+def test_model_reads_once():
+    dev = ProxyDevice()
+    model = DeviceModel(dev)
+    reads = dev.reads
+    for _ in range(10):
+        assert model["routingSource"] == "INPUT_3_4"
+        assert model.layout[2] == dev.props["sources"]
+    assert dev.reads == reads
+
+
+def test_model_follows_signals():
+    dev = ProxyDevice()
+    model = DeviceModel(dev)
+    seen = []
+    model.watch(seen.append)
+    model.requestSource("INPUT_5_6")
+    assert dev.requests == ["INPUT_5_6"]
+    # Not confirmed by the device yet
+    assert model["routingSource"] == "INPUT_3_4"
+    dev.signal(lastError="Could not switch routing: timeout", sampleRate=48000)
+    assert seen == [{"lastError": "Could not switch routing: timeout"}]
+    assert model["routingSource"] == "INPUT_3_4"
+    dev.signal(routingSource="INPUT_5_6", lastError="")
+    assert model["routingSource"] == "INPUT_5_6"
+    assert model["lastError"] == ""
+    model.close()
+    assert dev.closed
+    assert dev.onPropertiesChanged is None
@@ -0,0 +1,45 @@
+import logging
+import pstats
+import tracemalloc
+
+import pytest
+
+from soundcraft.diagnostics import profiled, timed
+
+
+def test_timed_logs_at_debug(caplog):
+    log = logging.getLogger("soundcraft.test")
+    with caplog.at_level(logging.INFO, logger="soundcraft.test"):
+        with timed(log, "Quiet"):
+            pass
+    assert caplog.records == []
+    with caplog.at_level(logging.DEBUG, logger="soundcraft.test"):
+        with pytest.raises(ValueError):
+            with timed(log, "Transfer"):
+                raise ValueError()
+    assert caplog.records[0].getMessage().startswith("Transfer failed after ")
+
+
+def test_profiled_cprofile(tmpdir):
+    path = str(tmpdir / "out.prof")
+    with profiled(f"cprofile:{path}"):
+        sum(range(1000))
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_profiled_tracemalloc(tmpdir):
+    path = str(tmpdir / "out.tracemalloc")
+    with profiled(f"tracemalloc:{path}"):
+        data = [bytes(100) for i in range(100)]
+    assert len(data) == 100
+    assert len(tracemalloc.Snapshot.load(path).traces) > 0
+    assert not tracemalloc.is_tracing()
+
+
+def test_profiled_off_and_bad_mode(monkeypatch):
+    monkeypatch.delenv("SOUNDCRAFT_PROFILE", raising=False)
+    with profiled():
+        pass
+    with pytest.raises(ValueError):
+        with profiled("perf"):
+            pass
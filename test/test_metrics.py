@@ -0,0 +1,75 @@
+import errno
+import time
+import urllib.request
+
+import pytest
+import usb.core
+
+from soundcraft import metrics, simulator
+
+
+def test_registry_prometheus():
+    registry = metrics.Registry()
+    registry.inc("dbus_property_gets_total", property="name")
+    registry.inc("dbus_property_gets_total", 2, property="name")
+    registry.observe("usb_transfer_seconds", 0.002, device="SIM0001")
+    registry.observe("usb_transfer_seconds", 10, device="SIM0001")
+    assert registry.counters() == {'dbus_property_gets_total{property="name"}': 3}
+    (count, total, buckets) = registry.histograms()[
+        'usb_transfer_seconds{device="SIM0001"}'
+    ]
+    assert (count, total) == (2, 10.002)
+    assert buckets[2] == (0.0025, 1)
+    assert buckets[-1] == (float("inf"), 2)
+    text = registry.prometheus()
+    assert "# TYPE usb_transfer_seconds histogram" in text
+    assert 'usb_transfer_seconds_bucket{device="SIM0001",le="+Inf"} 2' in text
+    assert 'dbus_property_gets_total{property="name"} 3' in text
+
+
+def test_instrumented_device():
+    registry = metrics.Registry()
+    usbdev = simulator.SimulatedNotepad(0x0032, serial_number="SIM0001")
+    dev = metrics.InstrumentedDevice(usbdev, registry, "SIM0001")
+    assert dev.serial_number == "SIM0001"
+    dev.ctrl_transfer(0x40, 16, 0, 0, [0] * 8)
+    usbdev.failNext(errorCode=errno.EPIPE)
+    with pytest.raises(usb.core.USBError):
+        dev.ctrl_transfer(0x40, 16, 0, 0, [0] * 8)
+    (count, _, _) = registry.histograms()['usb_transfer_seconds{device="SIM0001"}']
+    assert count == 2
+    assert registry.counters() == {
+        'usb_transfer_errors_total{device="SIM0001",error="USBError"}': 1
+    }
+
+
+def test_stall_detector():
+    registry = metrics.Registry()
+    detector = metrics.StallDetector(registry, interval=0.1, threshold=0.05)
+    assert detector.tick(now=0) == 0
+    assert detector.tick(now=0.1) == 0
+    assert detector.tick(now=0.5) == pytest.approx(0.3)
+    assert registry.counters() == {"mainloop_stalls_total": 1}
+
+
+def test_stall_detector_ignores_startup():
+    registry = metrics.Registry()
+    detector = metrics.StallDetector(registry, interval=0.1, threshold=0.05)
+    # However late the loop starts, the first tick has nothing to compare to
+    assert detector.tick(now=time.monotonic() + 30) == 0
+    assert registry.counters() == {}
+    assert registry.histograms() == {}
+
+
+def test_prometheus_endpoint():
+    registry = metrics.Registry()
+    registry.inc("hotplug_events_total", action="add")
+    server = metrics.servePrometheus(registry, 0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as resp:
+            body = resp.read().decode()
+        assert 'hotplug_events_total{action="add"} 1' in body
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,5 +1,6 @@
 import array
-from unittest.mock import DEFAULT, MagicMock, patch
+import struct
+from unittest.mock import MagicMock, patch
 
 import pytest
 import usb.core
@@ -10,13 +11,21 @@ class UsbCoreMock:
     def __init__(self):
         self.mockUsb = {}
 
-    def find(self, idVendor, idProduct):
+    def find(self, idVendor, idProduct=None, find_all=False, **kwargs):
+        if find_all:
+            if idVendor != 0x05FC:
+                return iter([])
+            return iter(self.mockUsb.values())
         if idVendor != 0x05FC:
             return None
         return self.mockUsb.get(idProduct, None)
 
-    def setupDevice(self, id):
-        self.mockUsb[id] = DEFAULT
+    def setupDevice(self, id, bus=1, address=None):
+        if address is None:
+            address = len(self.mockUsb) + 1
+        self.mockUsb[(id, bus, address)] = MagicMock(
+            idProduct=id, bus=bus, address=address, product=f"Mock {id:04x}"
+        )
 
 
 @pytest.fixture
@@ -45,6 +54,28 @@ def test_autodetect_single(usbCore, tmpdir, id, expected):
     assert isinstance(dev, expected)
 
 
+def test_autodetect_prefers_12fx(usbCore, tmpdir):
+    usbCore.setupDevice(0x0030)
+    usbCore.setupDevice(0x0032)
+    dev = notepad.autodetect(stateDir=tmpdir)
+    assert isinstance(dev, notepad.Notepad_12fx)
+
+
+def test_detectAll_multiple(usbCore, tmpdir):
+    usbCore.setupDevice(0x0032, address=3)
+    usbCore.setupDevice(0x0032, address=4)
+    usbCore.setupDevice(0x0030, address=5)
+    usbCore.setupDevice(0x0099, address=6)
+    devices = notepad.detectAll(stateDir=tmpdir)
+    assert [type(d) for d in devices] == [
+        notepad.Notepad_12fx,
+        notepad.Notepad_12fx,
+        notepad.Notepad_5,
+    ]
+    assert [d.dev.address for d in devices] == [3, 4, 5]
+    assert usb.core.find.call_count == 1
+
+
 @patch("usb.core.find", return_value=None)
 def test_notepad_notfound(find, tmpdir):
     dev = notepad.Notepad_12fx(stateDir=tmpdir)
@@ -74,7 +105,11 @@ def messageFor(i):
         ("INPUT_5_6", messageFor(1)),
         ("INPUT_7_8", messageFor(2)),
         ("MASTER_L_R", messageFor(3)),
+        ("master_l_r", messageFor(3)),
         ("5_6", messageFor(1)),
+        ("Stereo 7/8", messageFor(2)),
+        ("mix r", messageFor(3)),
+        ("mast", messageFor(3)),
         (notepad.Notepad_12fx.Sources.INPUT_7_8, messageFor(2)),
     ],
 )
@@ -82,19 +117,46 @@ def messageFor(i):
 def test_notepad_statesave(find, desiredSource, expectedCtrlMessage, tmpdir):
     usbdev = find.return_value
     usbdev.product = "TestNotepad"
+    usbdev.serial_number = "TEST0001"
     dev = notepad.Notepad_12fx(stateDir=tmpdir)
     assert dev.found()
     assert dev.routingSource == "UNKNOWN"
     dev.routingSource = desiredSource
-    usbdev.ctrl_transfer.assert_called_with(0x40, 16, 0, 0, expectedCtrlMessage)
+    usbdev.ctrl_transfer.assert_called_with(
+        0x40, 16, 0, 0, expectedCtrlMessage, timeout=dev.transferPolicy.timeout
+    )
     dev2 = notepad.Notepad_12fx(stateDir=tmpdir)
     assert dev2.routingSource == dev.routingSource
 
 
-@pytest.mark.parametrize("input", ["bad", -1, 512, "master_l_r", "INPUT_1_2", None])
+@pytest.mark.parametrize("input", ["bad", -1, 512, "512", "INPUT_1_2", None])
 @patch("usb.core.find")
 def test_notepad_badsource(find, input, tmpdir):
     dev = notepad.Notepad_12fx(stateDir=tmpdir)
     assert dev.found()
     with pytest.raises(ValueError):
         dev.routingSource = input
+
+
+@pytest.mark.parametrize("input", ["INPUT", "input_", "_", "stereo"])
+@patch("usb.core.find")
+def test_notepad_ambiguoussource(find, input, tmpdir):
+    dev = notepad.Notepad_12fx(stateDir=tmpdir)
+    with pytest.raises(notepad.AmbiguousSourceError) as e:
+        dev.routingSource = input
+    assert len(e.value.candidates) > 1
+    find.return_value.ctrl_transfer.assert_not_called()
+
+
+def test_decode_info():
+    ranges = struct.pack("<HIIIIII", 2, 44100, 44100, 0, 48000, 96000, 48000)
+    assert notepad.decodeSampleRateRanges(array.array("B", ranges)) == [
+        (44100, 44100, 0),
+        (48000, 96000, 48000),
+    ]
+    # A short or truncated block decodes as far as it can
+    assert notepad.decodeSampleRateRanges(array.array("B", ranges[:20])) == [
+        (44100, 44100, 0)
+    ]
+    assert notepad.decodeSampleRate(array.array("B", b"\x80\xbb\x00\x00")) == 48000
+    assert notepad.decodeSampleRate(array.array("B")) == 0
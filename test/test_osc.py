@@ -0,0 +1,77 @@
+import socket
+
+import pytest
+
+from soundcraft import osc
+from helpers import FakeDevice, SelectorWatcher
+
+
+def test_osc_codec():
+    packet = osc.encodeMessage("/notepad/0/source", "INPUT_5_6", 2, 1.5)
+    assert len(packet) % 4 == 0
+    assert osc.decode(packet) == [("/notepad/0/source", ["INPUT_5_6", 2, 1.5])]
+    bundle = osc.encodeBundle(
+        osc.encodeMessage("/notepad/0/source", 1),
+        osc.encodeBundle(osc.encodeMessage("/notepad/1/source", "MASTER_L_R")),
+    )
+    assert osc.decode(bundle) == [
+        ("/notepad/0/source", [1]),
+        ("/notepad/1/source", ["MASTER_L_R"]),
+    ]
+    with pytest.raises(osc.OscError):
+        osc.decode(bundle[:-4])
+
+
+@pytest.fixture
+def server():
+    server = osc.OscServer(0, SelectorWatcher())
+    yield server
+    server.close()
+
+
+def exchange(server, client, *packets):
+    for packet in packets:
+        client.sendto(packet, server.address)
+    server.watcher.iterate()
+    replies = []
+    client.setblocking(False)
+    while True:
+        try:
+            replies.extend(osc.decode(client.recv(65536)))
+        except BlockingIOError:
+            return replies
+
+
+def test_osc_server(server):
+    devices = [FakeDevice(), FakeDevice()]
+    for (idx, dev) in enumerate(devices):
+        server.addDevice(idx, dev)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    # Both devices in one bundle, then a query, a bad source and garbage
+    replies = exchange(
+        server,
+        client,
+        osc.encodeBundle(
+            osc.encodeMessage("/notepad/subscribe"),
+            osc.encodeMessage("/notepad/*/source", "INPUT_5_6"),
+        ),
+        osc.encodeMessage("/notepad/1/source"),
+        osc.encodeMessage("/notepad/0/source", "bogus"),
+        b"junk",
+    )
+    assert [d.routingSource for d in devices] == ["INPUT_5_6", "INPUT_5_6"]
+    assert replies[:3] == [
+        ("/notepad/0/source", ["INPUT_5_6"]),
+        ("/notepad/1/source", ["INPUT_5_6"]),
+        ("/notepad/1/source", ["INPUT_5_6"]),
+    ]
+    assert [address for (address, _) in replies[3:]] == ["/notepad/error"] * 2
+
+    # Feedback once a change has reached the device
+    devices[1].PropertiesChanged("iface", {"routingSource": "INPUT_3_4"}, [])
+    assert exchange(server, client) == [("/notepad/1/source", ["INPUT_3_4"])]
+    server.removeDevice(1)
+    (reply,) = exchange(server, client, osc.encodeMessage("/notepad/1/source"))
+    assert reply == ("/notepad/error", ["/notepad/1/source: No such device"])
+    client.close()
@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from soundcraft.presets import PresetStore, Recall
+from soundcraft.worker import DeviceWorker
+
+
+def test_preset_store(tmpdir):
+    path = tmpdir.join("presets.json")
+    store = PresetStore(str(path))
+    store.save("show", {"SIM0001": "INPUT_3_4"})
+    store.save("dry", {"SIM0001": "MASTER_L_R"})
+    assert store.names() == ["dry", "show"]
+    store.delete("dry")
+    with pytest.raises(KeyError):
+        store.get("dry")
+    store.close()
+    assert PresetStore(str(path)).get("show") == {"SIM0001": "INPUT_3_4"}
+
+
+def runRecall(futures, start=0):
+    """Recall on a pretend main loop; returns done()'s arguments"""
+    posted = queue.Queue()
+    results = []
+    Recall(
+        futures,
+        start,
+        lambda fn, *args: posted.put((fn, args)),
+        lambda timings, errors: results.append((timings, errors)),
+    )
+    while not results:
+        (fn, args) = posted.get(timeout=5)
+        fn(*args)
+    return results[0]
+
+
+def test_recall_parallel():
+    workers = [DeviceWorker() for i in range(3)]
+    barrier = threading.Barrier(3, timeout=5)
+    switched = []
+
+    def switch(source):
+        # Only completes if all three switch at the same time
+        barrier.wait()
+        switched.append(source)
+        return time.monotonic()
+
+    def fail(source):
+        raise ValueError(source)
+
+    start = time.monotonic()
+    futures = {f"dev{i}": w.submit(switch, i) for (i, w) in enumerate(workers)}
+    (timings, errors) = runRecall(futures, start)
+    assert sorted(switched) == [0, 1, 2]
+    assert sorted(timings) == ["dev0", "dev1", "dev2"]
+    assert all(seconds >= 0 for seconds in timings.values())
+    assert errors == {}
+    (timings, errors) = runRecall({"dev0": workers[0].submit(fail, 1)})
+    assert timings == {}
+    assert isinstance(errors["dev0"], ValueError)
+    for worker in workers:
+        assert worker.stop(timeout=5)
+
+
+def test_recall_expire():
+    finished = Future()
+    stuck = Future()
+    results = []
+    recall = Recall(
+        {"dev0": finished, "dev1": stuck},
+        0,
+        lambda fn, *args: fn(*args),
+        lambda timings, errors: results.append((timings, errors)),
+    )
+    finished.set_result(1.5)
+    assert results == []
+    recall.expire(5)
+    stuck.set_result(2.0)
+    assert len(results) == 1
+    (timings, errors) = results[0]
+    assert timings == {"dev0": 1.5}
+    assert isinstance(errors["dev1"], TimeoutError)
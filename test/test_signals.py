@@ -0,0 +1,59 @@
+from soundcraft.signals import MembershipBatcher, PropertyBatcher
+
+
+class Scheduler:
+    def __init__(self):
+        self.pending = []
+
+    def __call__(self, delay, callback):
+        self.pending.append((delay, callback))
+
+    def run(self):
+        (pending, self.pending) = (self.pending, [])
+        for (delay, callback) in pending:
+            assert callback() is False
+
+
+def test_property_batcher():
+    scheduler = Scheduler()
+    emitted = []
+    batcher = PropertyBatcher(emitted.append, scheduler, window=0.5)
+    batcher.update({"routingSource": "INPUT_3_4"})
+    batcher.update({"lastError": "oops"})
+    batcher.update({"routingSource": "INPUT_5_6", "lastError": ""})
+    assert emitted == []
+    assert [delay for (delay, _) in scheduler.pending] == [0.5]
+    scheduler.run()
+    assert emitted == [{"routingSource": "INPUT_5_6", "lastError": ""}]
+    # Nothing pending: nothing emitted, nothing scheduled
+    batcher.flush()
+    scheduler.run()
+    assert len(emitted) == 1
+
+
+def test_membership_batcher():
+    scheduler = Scheduler()
+    signals = []
+    batcher = MembershipBatcher(
+        lambda path: signals.append(("Added", path)),
+        lambda path: signals.append(("Removed", path)),
+        scheduler,
+    )
+    # A flap of a new device, a replug, a removal and a plain addition
+    for (event, path) in (
+        ("added", "/n/0"),
+        ("removed", "/n/0"),
+        ("removed", "/n/1"),
+        ("added", "/n/1"),
+        ("removed", "/n/2"),
+        ("added", "/n/3"),
+    ):
+        getattr(batcher, event)(path)
+    assert len(scheduler.pending) == 1
+    scheduler.run()
+    assert signals == [
+        ("Removed", "/n/1"),
+        ("Removed", "/n/2"),
+        ("Added", "/n/1"),
+        ("Added", "/n/3"),
+    ]
@@ -0,0 +1,192 @@
+import errno
+from unittest.mock import patch
+
+import pytest
+import usb.core
+
+from soundcraft import notepad, simulator, transport
+
+
+def test_sim_detect(simbus, tmpdir):
+    simbus.plug("12fx")
+    simbus.plug("5")
+    simbus.plug(0x0099)
+    devices = notepad.detectAll(stateDir=tmpdir)
+    assert [type(d) for d in devices] == [notepad.Notepad_12fx, notepad.Notepad_5]
+    assert devices[0].product == "Notepad-12FX"
+    assert devices[0].serial == "SIM0001"
+    assert isinstance(
+        notepad.Notepad_5(stateDir=tmpdir).dev, simulator.SimulatedNotepad
+    )
+
+
+def test_sim_switch(simbus, tmpdir):
+    usbdev = simbus.plug("8fx")
+    dev = notepad.autodetect(stateDir=tmpdir)
+    dev.routingSource = "INPUT_5_6"
+    assert usbdev.routing == 2
+    assert usbdev.transfers == [(0x40, 16, 0, 0)]
+
+
+def test_sim_failures(simbus, tmpdir):
+    usbdev = simbus.plug("12fx")
+    dev = notepad.autodetect(stateDir=tmpdir)
+    # More failures in a row than the default policy retries
+    usbdev.failNext(count=3, errorCode=errno.ETIMEDOUT)
+    with pytest.raises(usb.core.USBTimeoutError):
+        dev.routingSource = 1
+    assert dev.routingSource == "UNKNOWN"
+    dev.routingSource = 1
+    assert dev.routingSource == "INPUT_5_6"
+    simbus.unplug(usbdev)
+    with pytest.raises(usb.core.USBError) as e:
+        dev.routingSource = 2
+    assert e.value.errno == errno.ENODEV
+
+
+def test_sim_hotplug(simbus):
+    events = []
+    simbus.hotplug.connect(lambda action, dev: events.append((action, dev)))
+    usbdev = simbus.plug("5")
+    simbus.unplug(usbdev)
+    assert events == [("add", usbdev), ("remove", usbdev)]
+
+
+def test_sim_fromspec():
+    bus = simulator.fromSpec("sim:12fx,12fx,5;latency=0.002;failures=0.5")
+    assert [d.idProduct for d in bus.devices] == [0x0032, 0x0032, 0x0030]
+    assert len({d.address for d in bus.devices}) == 3
+    assert bus.devices[0].latency == 0.002
+    assert bus.devices[2].failureRate == 0.5
+    with pytest.raises(ValueError):
+        simulator.fromSpec("sim:42fx")
+
+
+def test_sim_fetchinfo(simbus, tmpdir):
+    usbdev = simbus.plug("12fx", sampleRate=44100)
+    dev = notepad.autodetect(stateDir=tmpdir)
+    assert dev.fetchInfo() is True
+    assert dev.sampleRate == 44100
+    assert dev.sampleRates == [(44100, 44100, 0)]
+    assert dev.fetchInfo() is False
+    usbdev.sampleRate = 48000
+    assert dev.fetchInfo() is True
+    assert dev.sampleRate == 48000
+
+
+def test_sim_attach(simbus, tmpdir):
+    simbus.plug("12fx")
+    usbdev = simbus.plug("5")
+    dev = notepad.attach(usbdev.idProduct, usbdev.bus, usbdev.address, stateDir=tmpdir)
+    assert isinstance(dev, notepad.Notepad_5)
+    assert dev.dev is usbdev
+    # Gone already, or a product we don't support
+    assert notepad.attach(0x0030, usbdev.bus, 42, stateDir=tmpdir) is None
+    assert notepad.attach(0x0099, usbdev.bus, usbdev.address, stateDir=tmpdir) is None
+
+
+def test_sim_same_model_separate_state(simbus, tmpdir):
+    simbus.plug("12fx")
+    simbus.plug("12fx")
+    (first, second) = notepad.detectAll(stateDir=tmpdir)
+    first.routingSource = "INPUT_5_6"
+    second.routingSource = "MASTER_L_R"
+    (first, second) = notepad.detectAll(stateDir=tmpdir)
+    assert first.routingSource == "INPUT_5_6"
+    assert second.routingSource == "MASTER_L_R"
+
+
+@pytest.mark.parametrize(
+    "errorCode, failures, errorClass, attempts",
+    [
+        (errno.EPIPE, 1, None, 2),
+        (errno.ETIMEDOUT, 2, None, 3),
+        (errno.EPIPE, 3, transport.PipeError, 3),
+        (errno.ETIMEDOUT, 5, transport.TransferTimeoutError, 3),
+        (errno.EIO, 1, transport.TransferError, 1),
+    ],
+)
+def test_sim_transfer_policy(simbus, errorCode, failures, errorClass, attempts):
+    usbdev = simbus.plug("12fx")
+    policy = transport.TransferPolicy(timeout=100, retries=2, backoff=0.001)
+    dev = notepad.Notepad_12fx(stateDir=None, transferPolicy=policy)
+    usbdev.failNext(failures, errorCode=errorCode)
+    if errorClass is None:
+        dev.routingSource = 2
+        assert usbdev.routing == 2
+    else:
+        with pytest.raises(errorClass) as e:
+            dev.routingSource = 2
+        assert e.value.attempts == attempts
+        assert e.value.errno == errorCode
+        assert usbdev.routing is None
+    assert len(usbdev._failures) == max(0, failures - attempts)
+
+
+def test_sim_device_gone_not_retried(simbus):
+    usbdev = simbus.plug("5")
+    dev = notepad.Notepad_5(stateDir=None)
+    simbus.unplug(usbdev)
+    with pytest.raises(transport.DeviceGoneError) as e:
+        dev.fetchInfo()
+    assert e.value.attempts == 1
+    assert "disconnected" in str(e.value)
+
+
+def test_policy_worst_case():
+    policy = transport.TransferPolicy(
+        timeout=200, retries=3, backoff=0.05, maxBackoff=0.1
+    )
+    assert policy.delays() == [0.05, 0.1, 0.1]
+    assert policy.worstCase() == pytest.approx(0.8 + 0.25)
+
+
+def test_sim_session(simbus, tmpdir):
+    usbdev = simbus.plug("12fx")
+    dev = notepad.autodetect(stateDir=tmpdir)
+    # Opened at detection, not on the first transfer
+    assert usbdev.opened and usbdev.opens == 1
+    dev.routingSource = "INPUT_5_6"
+    dev.routingSource = "INPUT_7_8"
+    assert usbdev.opens == 1
+    dev.close()
+    assert not usbdev.opened
+    assert not dev.session.isOpen
+
+
+def test_sim_autodetect_opens_one(simbus, tmpdir):
+    five = simbus.plug("5")
+    twelve = simbus.plug("12fx")
+    dev = notepad.autodetect(stateDir=tmpdir)
+    assert dev.dev is twelve
+    # The device that wasn't picked was never opened
+    assert twelve.opened and not five.opened
+    dev.close()
+
+
+def test_sim_session_deferred(simbus, tmpdir):
+    usbdev = simbus.plug("8fx")
+    (dev,) = notepad.detectAll(stateDir=tmpdir, openSession=False)
+    assert not usbdev.opened
+    dev.session.open()
+    dev.session.open()
+    assert usbdev.opens == 1
+    dev.close()
+
+
+def test_sim_session_unplugged(simbus, tmpdir):
+    usbdev = simbus.plug("12fx")
+    usbdev.connected = False
+    dev = notepad.Notepad_12fx(stateDir=tmpdir, dev=usbdev)
+    assert not dev.session.isOpen
+    dev.close()
+
+
+def test_usb_transport_backend():
+    backend = object()
+    usbTransport = transport.UsbTransport(backend=backend)
+    with patch("usb.core.find", return_value=iter([])) as find:
+        list(usbTransport.findAll(notepad.HARMAN_USB))
+        usbTransport.find(notepad.HARMAN_USB, 0x0032)
+    for (_, kwargs) in find.call_args_list:
+        assert kwargs["backend"] is backend
@@ -0,0 +1,65 @@
+import json
+import time
+
+from soundcraft.state import STORE_NAME, StateFile, StateStore, openStore
+
+
+def test_statefile_roundtrip(tmpdir):
+    path = tmpdir / "sub" / "dev.state"
+    store = StateFile(path)
+    assert store.load() == {}
+    store.save({"source": 2})
+    assert json.loads(path.read()) == {"source": 2}
+    assert not (tmpdir / "sub" / "dev.state.tmp").exists()
+    assert StateFile(path).load() == {"source": 2}
+
+
+def test_statefile_corrupt(tmpdir):
+    path = tmpdir / "dev.state"
+    path.write('{"source": ')
+    assert StateFile(path).load() == {}
+
+
+def test_statefile_writebehind_coalesces(tmpdir):
+    path = tmpdir / "dev.state"
+    store = StateFile(path, flushInterval=60)
+    for i in range(10):
+        store.save({"source": i})
+    assert not path.exists()
+    assert store.writes == 0
+    store.close()
+    assert store.writes == 1
+    assert json.loads(path.read()) == {"source": 9}
+
+
+def test_statefile_writebehind_timer(tmpdir):
+    path = tmpdir / "dev.state"
+    store = StateFile(path, flushInterval=0.01)
+    store.save({"source": 1})
+    store.save({"source": 3})
+    deadline = time.monotonic() + 5
+    while store.writes == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert store.writes == 1
+    assert json.loads(path.read()) == {"source": 3}
+
+
+def test_statestore_per_device(tmpdir):
+    store = StateStore(tmpdir)
+    store.put("SERIAL1", {"source": 1})
+    store.put("SERIAL2", {"source": 3})
+    store.flush()
+    reloaded = StateStore(tmpdir)
+    assert reloaded.get("SERIAL1") == {"source": 1}
+    assert reloaded.get("SERIAL2") == {"source": 3}
+    assert reloaded.get("SERIAL3") == {}
+    assert openStore(tmpdir) is openStore(str(tmpdir))
+
+
+def test_statestore_migrates_legacy(tmpdir):
+    tmpdir.join("Notepad-12FX.state").write(json.dumps({"source": 2}))
+    store = StateStore(tmpdir)
+    assert store.get("SERIAL1", legacyName="Notepad-12FX") == {"source": 2}
+    assert store.get("SERIAL2", legacyName="Notepad-5") == {}
+    store.flush()
+    assert json.loads(tmpdir.join(STORE_NAME).read()) == {"SERIAL1": {"source": 2}}
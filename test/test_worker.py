@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+from soundcraft.worker import AdaptiveInterval, DeviceWorker, RoutingCoalescer
+
+
+def test_worker_runs_in_order():
+    worker = DeviceWorker()
+    seen = []
+    futures = [worker.submit(seen.append, i) for i in range(20)]
+    for f in futures:
+        f.result(timeout=5)
+    assert seen == list(range(20))
+    assert worker.stop(timeout=5)
+
+
+def test_worker_exception():
+    worker = DeviceWorker()
+
+    def fail():
+        raise ValueError("stalled")
+
+    with pytest.raises(ValueError):
+        worker.submit(fail).result(timeout=5)
+    assert worker.submit(lambda: 42).result(timeout=5) == 42
+    assert worker.stop(timeout=5)
+
+
+def test_worker_does_not_block_caller():
+    worker = DeviceWorker()
+    release = threading.Event()
+    stuck = worker.submit(release.wait)
+    queued = worker.submit(lambda: "done")
+    assert not stuck.done()
+    assert not queued.done()
+    release.set()
+    assert queued.result(timeout=5) == "done"
+    assert worker.stop(timeout=5)
+
+
+class FakeSwitch:
+    def __init__(self, current=None):
+        self.current = current
+        self.sent = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, source):
+        self.started.set()
+        self.gate.wait(5)
+        self.sent.append(source)
+        self.current = source
+
+
+def test_coalescer_last_writer_wins():
+    worker = DeviceWorker()
+    switch = FakeSwitch(current=0)
+    coalescer = RoutingCoalescer(worker, switch, lambda: switch.current)
+    switch.gate.clear()
+    first = coalescer.request(1)
+    # Wait until the first batch is in flight, then pile up a burst behind it
+    assert switch.started.wait(5)
+    futures = [coalescer.request(src) for src in (2, 3, 2, 3)]
+    assert len(set(futures)) == 1
+    switch.gate.set()
+    assert first.result(timeout=5) is True
+    assert futures[-1].result(timeout=5) is True
+    assert switch.sent == [1, 3]
+    assert coalescer.stats() == {"requested": 5, "merged": 3, "skipped": 0, "sent": 2}
+    assert worker.stop(timeout=5)
+
+
+def test_coalescer_skips_current():
+    worker = DeviceWorker()
+    switch = FakeSwitch(current=2)
+    coalescer = RoutingCoalescer(worker, switch, lambda: switch.current)
+    assert coalescer.request(2).result(timeout=5) is False
+    # A burst that ends up back where it started sends nothing
+    coalescer.window = 0.05
+    futures = [coalescer.request(src) for src in (1, 3, 2)]
+    assert futures[-1].result(timeout=5) is False
+    assert switch.sent == []
+    assert coalescer.stats() == {"requested": 4, "merged": 2, "skipped": 2, "sent": 0}
+    assert worker.stop(timeout=5)
+
+
+def test_coalescer_stats_from_many_threads():
+    worker = DeviceWorker()
+    switch = FakeSwitch(current=0)
+    coalescer = RoutingCoalescer(worker, switch, lambda: switch.current)
+    futures = []
+
+    def burst():
+        futures.extend(coalescer.request(i % 3) for i in range(200))
+
+    threads = [threading.Thread(target=burst) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    for f in futures:
+        f.result(timeout=5)
+    # Every request is accounted for exactly once
+    stats = coalescer.stats()
+    assert stats["requested"] == 800
+    assert stats["merged"] + stats["skipped"] + stats["sent"] == 800
+    assert stats["sent"] == len(switch.sent)
+    assert worker.stop(timeout=5)
+
+
+def test_coalescer_error():
+    worker = DeviceWorker()
+
+    def broken(source):
+        raise IOError("pipe error")
+
+    coalescer = RoutingCoalescer(worker, broken, lambda: None)
+    with pytest.raises(IOError):
+        coalescer.request(1).result(timeout=5)
+    assert coalescer.stats()["sent"] == 0
+    assert worker.stop(timeout=5)
+
+
+def test_adaptive_interval():
+    interval = AdaptiveInterval(1, 5)
+    assert [interval.next(False) for i in range(4)] == [2, 4, 5, 5]
+    assert interval.next(True) == 1
+    assert interval.next(False) == 2
+
+
+def test_worker_submit_after_stop():
+    worker = DeviceWorker()
+    queued = worker.submit(lambda: 1)
+    assert worker.stop(timeout=5)
+    assert queued.result(timeout=5) == 1
+    late = worker.submit(lambda: 2)
+    assert late.done()
+    with pytest.raises(RuntimeError):
+        late.result()